@@ -32,7 +32,9 @@ GUIDED 모드에서 :py:func:`Vehicle.simple_takeoff` 및 :py:attr:`Vehicle.simp
 """
 
 import sys
+import asyncio
 import collections
+import concurrent.futures
 
 # Python3.10 removed MutableMapping from collections:
 if sys.version_info.major == 3 and sys.version_info.minor >= 10:
@@ -44,6 +46,7 @@ import copy
 import logging
 import math
 import struct
+import threading
 import time
 
 import monotonic
@@ -336,6 +339,61 @@ class Battery(object):
                                                                self.level)
 
 
+_TELEMETRY_SNAPSHOT_FIELDS = ('lat', 'lon', 'alt', 'alt_asl',
+                              'pitch', 'roll', 'yaw', 'heading', 'airspeed', 'groundspeed',
+                              'battery_voltage', 'battery_current', 'battery_level',
+                              'mode', 'armed', 'home_lat', 'home_lon', 'home_alt', 'time')
+
+
+class TelemetrySnapshot(collections.namedtuple('TelemetrySnapshot', _TELEMETRY_SNAPSHOT_FIELDS)):
+    """
+    An immutable, consistent view of the vehicle's most commonly used telemetry.
+
+    An object of this type is returned by :py:attr:`Vehicle.snapshot`. The message handlers build
+    a new snapshot for every update and swap it in with a single assignment, so a reader always
+    sees all fields from the same point in time without taking a lock. Fields are ``None`` until
+    the corresponding message has been received.
+
+    :param lat: Latitude (degrees).
+    :param lon: Longitude (degrees).
+    :param alt: Altitude relative to home (metres).
+    :param alt_asl: Altitude above mean sea level (metres).
+    :param pitch: Pitch in radians.
+    :param roll: Roll in radians.
+    :param yaw: Yaw in radians.
+    :param heading: Heading in degrees (0..360).
+    :param airspeed: Airspeed (m/s).
+    :param groundspeed: Groundspeed (m/s).
+    :param battery_voltage: Battery voltage in volts.
+    :param battery_current: Battery current (see :py:class:`Battery`).
+    :param battery_level: Remaining battery energy (percent).
+    :param mode: Flight mode name.
+    :param armed: ``True`` if the vehicle is armed.
+    :param home_lat: Home latitude (degrees).
+    :param home_lon: Home longitude (degrees).
+    :param home_alt: Home altitude above mean sea level (metres).
+    :param time: ``monotonic`` timestamp of the update that produced this snapshot.
+    """
+
+    # A tuple underneath: no per-instance __dict__, and _replace() builds the copy in C.
+    __slots__ = ()
+
+    def __str__(self):
+        return 'TelemetrySnapshot:' + ','.join(
+            '%s=%s' % (name, value) for name, value in zip(self._fields, self))
+
+
+TelemetrySnapshot.__new__.__defaults__ = (None,) * len(_TELEMETRY_SNAPSHOT_FIELDS)
+
+# Field positions used by the high-rate message listeners (see Vehicle._update_snapshot_fields).
+_SNAPSHOT_TIME = _TELEMETRY_SNAPSHOT_FIELDS.index('time')
+_SNAPSHOT_POSITION = tuple(_TELEMETRY_SNAPSHOT_FIELDS.index(f) for f in ('lat', 'lon', 'alt'))
+_SNAPSHOT_POSITION_ASL = tuple(_TELEMETRY_SNAPSHOT_FIELDS.index(f) for f in ('lat', 'lon', 'alt', 'alt_asl'))
+_SNAPSHOT_ATTITUDE = tuple(_TELEMETRY_SNAPSHOT_FIELDS.index(f) for f in ('pitch', 'roll', 'yaw'))
+_SNAPSHOT_VFR_HUD = tuple(_TELEMETRY_SNAPSHOT_FIELDS.index(f) for f in ('heading', 'airspeed', 'groundspeed'))
+_SNAPSHOT_BATTERY = tuple(_TELEMETRY_SNAPSHOT_FIELDS.index(f) for f in ('battery_voltage', 'battery_current', 'battery_level'))
+
+
 class Rangefinder(object):
     """
     Rangefinder readings.
@@ -628,6 +686,10 @@ class HasObservers(object):
         self._attribute_listeners = {}
         self._attribute_cache = {}
 
+        # Precompiled from _attribute_listeners: attr_name -> tuple of observers, '*' observers included.
+        self._attribute_dispatch = {}
+        self._attribute_dispatch_all = ()
+
     def add_attribute_listener(self, attr_name, observer):
         """
         Add an attribute listener callback.
@@ -677,6 +739,7 @@ class HasObservers(object):
             self._attribute_listeners[attr_name] = listeners_for_attr
         if observer not in listeners_for_attr:
             listeners_for_attr.append(observer)
+            self._rebuild_attribute_dispatch()
 
     def remove_attribute_listener(self, attr_name, observer):
         """
@@ -700,6 +763,14 @@ class HasObservers(object):
             listeners_for_attr.remove(observer)
             if len(listeners_for_attr) == 0:
                 del self._attribute_listeners[attr_name]
+            self._rebuild_attribute_dispatch()
+
+    def _rebuild_attribute_dispatch(self):
+        # Built aside and swapped in, so a concurrent notify sees either the old or the new table.
+        catch_all = tuple(self._attribute_listeners.get('*', ()))
+        self._attribute_dispatch = dict((name, tuple(fns) + catch_all)
+                                        for name, fns in self._attribute_listeners.items() if name != '*')
+        self._attribute_dispatch_all = catch_all
 
     def notify_attribute_listeners(self, attr_name, value, cache=False):
         """
@@ -728,19 +799,37 @@ class HasObservers(object):
                 return
             self._attribute_cache[attr_name] = value
 
+        self._attribute_notified(attr_name)
+
         # Notify observers.
-        for fn in self._attribute_listeners.get(attr_name, []):
+        for fn in self._attribute_dispatch.get(attr_name, self._attribute_dispatch_all):
             try:
                 fn(self, attr_name, value)
             except Exception:
                 self._logger.exception('Exception in attribute handler for %s' % attr_name, exc_info=True)
 
-        for fn in self._attribute_listeners.get('*', []):
+    def _notify_attribute(self, attr_name, getter, owner=None):
+        """
+        Same as ``notify_attribute_listeners(attr_name, getter(owner))`` (with ``cache=False``), but the
+        value is only built when there is a listener for ``attr_name``. ``owner`` defaults to ``self``.
+
+        ``getter`` is typically a property's ``fget``, so the call itself allocates nothing.
+        """
+        self._attribute_notified(attr_name)
+        listeners = self._attribute_dispatch.get(attr_name, self._attribute_dispatch_all)
+        if not listeners:
+            return
+        value = getter(self if owner is None else owner)
+        for fn in listeners:
             try:
                 fn(self, attr_name, value)
             except Exception:
                 self._logger.exception('Exception in attribute handler for %s' % attr_name, exc_info=True)
 
+    def _attribute_notified(self, attr_name):
+        """Called for every attribute update, whether or not it has listeners."""
+        pass
+
     def on_attribute(self, name):
         """
         Decorator for attribute listeners.
@@ -884,6 +973,11 @@ class Channels(dict):
         self._readonly = True
         self._count = max(self._count, channel)
 
+    def _update_channels(self, keys, values):
+        # Bulk version of _update_channel. ``keys`` are consecutive channel numbers, as strings.
+        dict.update(self, zip(keys, values))
+        self._count = max(self._count, int(keys[-1]))
+
     @property
     def overrides(self):
         """
@@ -961,19 +1055,23 @@ class Locations(HasObservers):
         def listener(vehicle, name, m):
             (self._lat, self._lon) = (m.lat / 1.0e7, m.lon / 1.0e7)
             self._relative_alt = m.relative_alt / 1000.0
-            self.notify_attribute_listeners('global_relative_frame', self.global_relative_frame)
-            vehicle.notify_attribute_listeners('location.global_relative_frame',
-                                               vehicle.location.global_relative_frame)
+            if self._alt is not None or m.alt != 0:
+                vehicle._update_snapshot_fields(_SNAPSHOT_POSITION_ASL,
+                                                (self._lat, self._lon, self._relative_alt, m.alt / 1000.0))
+            else:
+                vehicle._update_snapshot_fields(_SNAPSHOT_POSITION, (self._lat, self._lon, self._relative_alt))
+            self._notify_attribute('global_relative_frame', Locations.global_relative_frame.fget)
+            vehicle._notify_attribute('location.global_relative_frame',
+                                      Locations.global_relative_frame.fget, self)
 
             if self._alt is not None or m.alt != 0:
                 # Require first alt value to be non-0
                 # TODO is this the proper check to do?
                 self._alt = m.alt / 1000.0
-                self.notify_attribute_listeners('global_frame', self.global_frame)
-                vehicle.notify_attribute_listeners('location.global_frame',
-                                                   vehicle.location.global_frame)
+                self._notify_attribute('global_frame', Locations.global_frame.fget)
+                vehicle._notify_attribute('location.global_frame', Locations.global_frame.fget, self)
 
-            vehicle.notify_attribute_listeners('location', vehicle.location)
+            vehicle._notify_attribute('location', Vehicle.location.fget)
 
         self._north = None
         self._east = None
@@ -984,9 +1082,9 @@ class Locations(HasObservers):
             self._north = m.x
             self._east = m.y
             self._down = m.z
-            self.notify_attribute_listeners('local_frame', self.local_frame)
-            vehicle.notify_attribute_listeners('location.local_frame', vehicle.location.local_frame)
-            vehicle.notify_attribute_listeners('location', vehicle.location)
+            self._notify_attribute('local_frame', Locations.local_frame.fget)
+            vehicle._notify_attribute('location.local_frame', Locations.local_frame.fget, self)
+            vehicle._notify_attribute('location', Vehicle.location.fget)
 
     @property
     def local_frame(self):
@@ -1129,15 +1227,21 @@ class Vehicle(HasObservers):
         # By default, we presume all "commands" are loaded.
         self._ready_attrs = {'commands'}
 
+        # Callbacks of threads and tasks blocked in wait_for/until, called on every attribute update.
+        self._state_waiters = ()
+        self._state_waiters_lock = threading.Lock()
+
         # Default parameters when calling wait_ready() or wait_ready(True).
         self._default_ready_attrs = ['parameters', 'gps_0', 'armed', 'mode', 'attitude']
 
-        @self.on_attribute('*')
-        def listener(_, name, value):
-            self._ready_attrs.add(name)
+        # Message rates confirmed by set_stream_profile.
+        self._stream_rates = {}
 
         # Attaches message listeners.
         self._message_listeners = dict()
+        # Precompiled from _message_listeners: message type -> tuple of listeners, '*' listeners included.
+        self._message_dispatch = {}
+        self._message_dispatch_all = ()
 
         @handler.forward_message
         def listener(_, msg):
@@ -1172,7 +1276,7 @@ class Vehicle(HasObservers):
         @self.on_message('GLOBAL_POSITION_INT')
         def listener(self, name, m):
             (self._vx, self._vy, self._vz) = (m.vx / 100.0, m.vy / 100.0, m.vz / 100.0)
-            self.notify_attribute_listeners('velocity', self.velocity)
+            self._notify_attribute('velocity', Vehicle.velocity.fget)
 
         self._pitch = None
         self._yaw = None
@@ -1189,7 +1293,8 @@ class Vehicle(HasObservers):
             self._pitchspeed = m.pitchspeed
             self._yawspeed = m.yawspeed
             self._rollspeed = m.rollspeed
-            self.notify_attribute_listeners('attitude', self.attitude)
+            self._update_snapshot_fields(_SNAPSHOT_ATTITUDE, (m.pitch, m.roll, m.yaw))
+            self._notify_attribute('attitude', Vehicle.attitude.fget)
 
         self._heading = None
         self._airspeed = None
@@ -1197,12 +1302,13 @@ class Vehicle(HasObservers):
 
         @self.on_message('VFR_HUD')
         def listener(self, name, m):
+            self._update_snapshot_fields(_SNAPSHOT_VFR_HUD, (m.heading, m.airspeed, m.groundspeed))
             self._heading = m.heading
-            self.notify_attribute_listeners('heading', self.heading)
+            self._notify_attribute('heading', Vehicle.heading.fget)
             self._airspeed = m.airspeed
-            self.notify_attribute_listeners('airspeed', self.airspeed)
+            self._notify_attribute('airspeed', Vehicle.airspeed.fget)
             self._groundspeed = m.groundspeed
-            self.notify_attribute_listeners('groundspeed', self.groundspeed)
+            self._notify_attribute('groundspeed', Vehicle.groundspeed.fget)
 
         self._rngfnd_distance = None
         self._rngfnd_voltage = None
@@ -1211,7 +1317,7 @@ class Vehicle(HasObservers):
         def listener(self, name, m):
             self._rngfnd_distance = m.distance
             self._rngfnd_voltage = m.voltage
-            self.notify_attribute_listeners('rangefinder', self.rangefinder)
+            self._notify_attribute('rangefinder', Vehicle.rangefinder.fget)
 
         self._mount_pitch = None
         self._mount_yaw = None
@@ -1222,16 +1328,18 @@ class Vehicle(HasObservers):
             self._mount_pitch = m.pointing_a / 100.0
             self._mount_roll = m.pointing_b / 100.0
             self._mount_yaw = m.pointing_c / 100.0
-            self.notify_attribute_listeners('mount', self.mount_status)
+            self._notify_attribute('mount', Vehicle.mount_status.fget)
 
         self._capabilities = None
         self._raw_version = None
+        self._autopilot_version = None
         self._autopilot_version_msg_count = 0
 
         @self.on_message('AUTOPILOT_VERSION')
         def listener(vehicle, name, m):
             self._capabilities = m.capabilities
             self._raw_version = m.flight_sw_version
+            self._autopilot_version = m
             self._autopilot_version_msg_count += 1
             if self._capabilities != 0 or self._autopilot_version_msg_count > 5:
                 # ArduPilot <3.4 fails to send capabilities correctly
@@ -1246,18 +1354,19 @@ class Vehicle(HasObservers):
         # All keys are strings.
         self._channels = Channels(self, 8)
 
+        rc_channel_fields = ['chan%d_raw' % i for i in range(1, 19)]
+        rc_channel_keys = [str(i) for i in range(1, 19)]
+
         @self.on_message(['RC_CHANNELS_RAW', 'RC_CHANNELS'])
         def listener(self, name, m):
-            def set_rc(chnum, v):
-                '''Private utility for handling rc channel messages'''
+            if name == "RC_CHANNELS":
+                self._channels._update_channels(rc_channel_keys, [getattr(m, f) for f in rc_channel_fields])
+            else:
                 # use port to allow ch nums greater than 8
-                port = 0 if name == "RC_CHANNELS" else m.port
-                self._channels._update_channel(str(port * 8 + chnum), v)
-
-            for i in range(1, (18 if name == "RC_CHANNELS" else 8)+1):
-                set_rc(i, getattr(m, "chan{}_raw".format(i)))
+                keys = [str(m.port * 8 + i) for i in range(1, 9)]
+                self._channels._update_channels(keys, [getattr(m, f) for f in rc_channel_fields[:8]])
 
-            self.notify_attribute_listeners('channels', self.channels)
+            self._notify_attribute('channels', Vehicle.channels.fget)
 
         self._voltage = None
         self._current = None
@@ -1268,7 +1377,12 @@ class Vehicle(HasObservers):
             self._voltage = m.voltage_battery
             self._current = m.current_battery
             self._level = m.battery_remaining
-            self.notify_attribute_listeners('battery', self.battery)
+            # Same units as Battery, which is only built for 'battery' listeners.
+            self._update_snapshot_fields(_SNAPSHOT_BATTERY, (
+                m.voltage_battery / 1000.0,
+                None if m.current_battery == -1 else m.current_battery / 100.0,
+                None if m.battery_remaining == -1 else m.battery_remaining))
+            self._notify_attribute('battery', Vehicle.battery.fget)
 
         self._eph = None
         self._epv = None
@@ -1281,7 +1395,7 @@ class Vehicle(HasObservers):
             self._epv = m.epv
             self._satellites_visible = m.satellites_visible
             self._fix_type = m.fix_type
-            self.notify_attribute_listeners('gps_0', self.gps_0)
+            self._notify_attribute('gps_0', Vehicle.gps_0.fget)
 
         self._current_waypoint = 0
 
@@ -1315,7 +1429,10 @@ class Vehicle(HasObservers):
             # ignore groundstations
             if m.type == mavutil.mavlink.MAV_TYPE_GCS or (not self._handler.master.probably_vehicle_heartbeat(m)):
                 return
-            self._armed = (m.base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED) != 0
+            armed = (m.base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED) != 0
+            if armed != self._armed:
+                self._update_snapshot(armed=armed)
+            self._armed = armed
             self.notify_attribute_listeners('armed', self.armed, cache=True)
             self._autopilot_type = m.autopilot
             self._vehicle_type = m.type
@@ -1325,98 +1442,128 @@ class Vehicle(HasObservers):
                 self._flightmode = mavutil.interpret_px4_mode(m.base_mode, m.custom_mode)
             else:
                 self._flightmode = self._mode_mapping_bynumber[m.custom_mode]
+            if self._flightmode != self._snapshot.mode:
+                self._update_snapshot(mode=self._flightmode)
             self.notify_attribute_listeners('mode', self.mode, cache=True)
             self._system_status = m.system_status
             self.notify_attribute_listeners('system_status', self.system_status, cache=True)
 
+        # Telemetry snapshot, replaced (never mutated) by the message listeners.
+        self._snapshot = TelemetrySnapshot(mode=self._flightmode, armed=self._armed)
+
+        # Telemetry history, recorded from the receive loop once enable_history() is called.
+        self._history = None
+
+        @handler.forward_loop
+        def listener(_):
+            if self._history is not None:
+                self._history.record(self._snapshot)
+
         # Waypoints.
 
         self._home_location = None
         self._wploader = mavwp.MAVWPLoader()
         self._wp_loaded = True
-        self._wp_uploaded = None
+        self._wp_upload = None
+        self._wp_download = None
+        self._wp_opaque_id = None
         self._wpts_dirty = False
         self._commands = CommandSequence(self)
 
         @self.on_message(['WAYPOINT_COUNT', 'MISSION_COUNT'])
         def listener(self, name, msg):
-            if not self._wp_loaded:
-                self._wploader.clear()
-                self._wploader.expected_count = msg.count
-                self._master.waypoint_request_send(0)
+            if self._wp_download is not None:
+                self._wp_download.handle_count(msg)
 
         @self.on_message(['HOME_POSITION'])
         def listener(self, name, msg):
             self._home_location = LocationGlobal(msg.latitude / 1.0e7, msg.longitude / 1.0e7, msg.altitude / 1000.0)
+            self._update_home_snapshot()
             self.notify_attribute_listeners('home_location', self.home_location, cache=True)
 
-        @self.on_message(['WAYPOINT', 'MISSION_ITEM'])
+        @self.on_message(['WAYPOINT', 'MISSION_ITEM', 'MISSION_ITEM_INT'])
         def listener(self, name, msg):
-            if not self._wp_loaded:
-                if msg.seq == 0:
-                    if not (msg.x == 0 and msg.y == 0 and msg.z == 0):
-                        self._home_location = LocationGlobal(msg.x, msg.y, msg.z)
+            if self._wp_download is not None:
+                self._wp_download.handle_item(name, msg)
 
-                if msg.seq > self._wploader.count():
-                    # Unexpected waypoint
-                    pass
-                elif msg.seq < self._wploader.count():
-                    # Waypoint duplicate
-                    pass
-                else:
-                    self._wploader.add(msg)
+        @self.on_message(['MISSION_ACK'])
+        def listener(self, name, msg):
+            if self._wp_download is not None:
+                self._wp_download.handle_ack(msg)
+
+        @handler.forward_loop
+        def listener(_):
+            if self._wp_download is not None:
+                self._wp_download.tick(monotonic.monotonic())
 
-                    if msg.seq + 1 < self._wploader.expected_count:
-                        self._master.waypoint_request_send(msg.seq + 1)
-                    else:
-                        self._wp_loaded = True
-                        self.notify_attribute_listeners('commands', self.commands)
+        # Commands.
 
-        # Waypoint send to master
-        @self.on_message(['WAYPOINT_REQUEST', 'MISSION_REQUEST'])
+        from app.libs.dronekit.command import CommandClient
+        self._command_client = CommandClient(self)
+
+        @self.on_message('COMMAND_ACK')
         def listener(self, name, msg):
-            if self._wp_uploaded is not None:
-                wp = self._wploader.wp(msg.seq)
-                handler.fix_targets(wp)
-                self._master.mav.send(wp)
-                self._wp_uploaded[msg.seq] = True
+            self._command_client.handle_ack(msg)
+
+        @handler.forward_loop
+        def listener(_):
+            self._command_client.tick(monotonic.monotonic())
 
         # TODO: Waypoint loop listeners
 
         # Parameters.
 
         start_duration = 0.2
-        repeat_duration = 1
+        repeat_duration = 0.5
 
         self._params_count = -1
         self._params_set = []
+        self._params_received = 0
         self._params_loaded = False
         self._params_start = False
         self._params_map = {}
         self._params_last = monotonic.monotonic()  # Last new param.
-        self._params_duration = start_duration
         self._parameters = Parameters(self)
 
+        # Once the PARAM_REQUEST_LIST stream stalls, missing indexes are requested one by one,
+        # keeping up to _params_window requests in flight (index -> time sent).
+        self._params_window = 32
+        self._params_gapfill = False
+        self._params_requested = {}
+
+        # Parameter cache: values published from disk are refreshed from the vehicle while
+        # _params_revalidating is set.
+        self._param_cache = None
+        self._params_revalidating = False
+        self._params_cache_hash = None
+
         @handler.forward_loop
         def listener(_):
-            # Check the time duration for last "new" params exceeds watchdog.
-            if not self._params_start:
+            if not self._params_start or (self._params_loaded and not self._params_revalidating):
                 return
 
-            if not self._params_loaded and all(x is not None for x in self._params_set):
-                self._params_loaded = True
-                self.notify_attribute_listeners('parameters', self.parameters)
-
-            if not self._params_loaded and monotonic.monotonic() - self._params_last > self._params_duration:
-                c = 0
-                for i, v in enumerate(self._params_set):
-                    if v is None:
-                        self._master.mav.param_request_read_send(0, 0, b'', i)
-                        c += 1
-                        if c > 50:
-                            break
-                self._params_duration = repeat_duration
-                self._params_last = monotonic.monotonic()
+            if self._params_received == self._params_count:
+                self._params_complete()
+                return
+
+            now = monotonic.monotonic()
+            if not self._params_gapfill:
+                if now - self._params_last <= start_duration:
+                    return
+                self._params_gapfill = True
+
+            requested = self._params_requested
+            for i, sent in list(requested.items()):
+                if now - sent > repeat_duration:
+                    del requested[i]
+            if len(requested) >= self._params_window:
+                return
+            for i, v in enumerate(self._params_set):
+                if v is None and i not in requested:
+                    self._master.mav.param_request_read_send(0, 0, b'', i)
+                    requested[i] = now
+                    if len(requested) >= self._params_window:
+                        break
 
         @self.on_message(['PARAM_VALUE'])
         def listener(self, name, msg):
@@ -1427,6 +1574,10 @@ class Vehicle(HasObservers):
                 self._params_start = True
                 self._params_count = msg.param_count
                 self._params_set = [None] * msg.param_count
+                self._params_received = 0
+                self._params_gapfill = False
+                self._params_requested = {}
+                self._load_cached_params()
 
             # Attempt to set the params. We throw an error
             # if the index is out of range of the count or
@@ -1435,12 +1586,14 @@ class Vehicle(HasObservers):
                 if msg.param_index < msg.param_count and msg:
                     if self._params_set[msg.param_index] is None:
                         self._params_last = monotonic.monotonic()
-                        self._params_duration = start_duration
+                        self._params_received += 1
                     self._params_set[msg.param_index] = msg
+                    self._params_requested.pop(msg.param_index, None)
 
                 self._params_map[msg.param_id] = msg.param_value
                 self._parameters.notify_attribute_listeners(msg.param_id, msg.param_value,
                                                             cache=True)
+                self._parameters._acknowledge(msg.param_id, msg.param_value)
             except:
                 import traceback
                 traceback.print_exc()
@@ -1491,7 +1644,7 @@ class Vehicle(HasObservers):
         def listener(_):
             if self._heartbeat_lastreceived:
                 self._last_heartbeat = monotonic.monotonic() - self._heartbeat_lastreceived
-                self.notify_attribute_listeners('last_heartbeat', self.last_heartbeat)
+                self._notify_attribute('last_heartbeat', Vehicle.last_heartbeat.fget)
 
     @property
     def last_heartbeat(self):
@@ -1607,6 +1760,7 @@ class Vehicle(HasObservers):
             self._message_listeners[name] = []
         if fn not in self._message_listeners[name]:
             self._message_listeners[name].append(fn)
+            self._rebuild_message_dispatch()
 
     def remove_message_listener(self, name, fn):
         """
@@ -1624,23 +1778,213 @@ class Vehicle(HasObservers):
                 self._message_listeners[name].remove(fn)
                 if len(self._message_listeners[name]) == 0:
                     del self._message_listeners[name]
+                self._rebuild_message_dispatch()
+
+    def _rebuild_message_dispatch(self):
+        # Built aside and swapped in, so the receive thread sees either the old or the new table.
+        catch_all = tuple(self._message_listeners.get('*', ()))
+        self._message_dispatch = dict((name, tuple(fns) + catch_all)
+                                      for name, fns in self._message_listeners.items() if name != '*')
+        self._message_dispatch_all = catch_all
 
     def notify_message_listeners(self, name, msg):
-        for fn in self._message_listeners.get(name, []):
+        for fn in self._message_dispatch.get(name, self._message_dispatch_all):
             try:
                 fn(self, name, msg)
             except Exception:
                 self._logger.exception('Exception in message handler for %s' % msg.get_type(), exc_info=True)
 
-        for fn in self._message_listeners.get('*', []):
+    def _attribute_notified(self, attr_name):
+        # Track updated attributes for wait_ready.
+        self._ready_attrs.add(attr_name)
+        for check in self._state_waiters:
+            check(attr_name)
+
+    def _add_state_waiter(self, check):
+        # Copied on write, so notifications iterate a snapshot without taking the lock.
+        with self._state_waiters_lock:
+            self._state_waiters = self._state_waiters + (check,)
+
+    def _remove_state_waiter(self, check):
+        with self._state_waiters_lock:
+            self._state_waiters = tuple(fn for fn in self._state_waiters if fn is not check)
+
+    def _wait_state(self, condition, timeout=None, interval=1.0):
+        '''Block until ``condition()`` is True.
+
+        The condition is evaluated on every attribute update (in the thread delivering it), and
+        the waiting thread is only woken once it holds, so the wait ends as soon as the message
+        that satisfies it has been processed. It is also re-checked every ``interval`` seconds
+        for conditions that do not depend on vehicle attributes.
+
+        Returns ``False`` if ``timeout`` seconds pass (``None`` waits forever) or the connection
+        is lost first.
+        '''
+        if condition():
+            return True
+        woken = threading.Event()
+
+        def check(attr_name):
             try:
-                fn(self, name, msg)
+                if condition():
+                    woken.set()
             except Exception:
-                self._logger.exception('Exception in message handler for %s' % msg.get_type(), exc_info=True)
+                # Re-raised by the waiting thread when it evaluates the condition itself.
+                woken.set()
+
+        deadline = None if timeout is None else monotonic.monotonic() + timeout
+        self._add_state_waiter(check)
+        try:
+            while not condition():
+                if not self._handler._alive:
+                    return False
+                wait = interval
+                if deadline is not None:
+                    remaining = deadline - monotonic.monotonic()
+                    if remaining <= 0:
+                        return False
+                    wait = min(wait, remaining)
+                woken.wait(wait)
+                woken.clear()
+            return True
+        finally:
+            self._remove_state_waiter(check)
+
+    async def until(self, predicate, timeout=None, errmsg=None):
+        '''Wait, without blocking the event loop, until ``predicate(vehicle)`` is True.
+
+        .. code:: python
+
+            vehicle.mode = VehicleMode('GUIDED')
+            await vehicle.until(lambda v: v.mode.name == 'GUIDED', timeout=5)
+
+        The predicate is evaluated on every attribute update in the thread that delivers vehicle
+        messages, so it should be cheap and must not block; the awaiting task is only resumed
+        once it holds (or at least once a second, to notice a lost connection).
+
+        :param predicate: Called as ``predicate(vehicle)``.
+        :param timeout: Seconds to wait, or ``None`` to wait forever.
+        :param errmsg: Message of the exception raised on timeout.
+        :raises TimeoutError: if the predicate is still False after ``timeout`` seconds.
+        :raises APIException: if the connection is lost while waiting.
+        '''
+        if predicate(self):
+            return
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        fired = [False]
+
+        def check(attr_name):
+            # Wake the task once per wait; it re-evaluates the predicate itself.
+            if fired[0]:
+                return
+            try:
+                ready = predicate(self)
+            except Exception:
+                ready = True
+            if ready:
+                fired[0] = True
+                loop.call_soon_threadsafe(woken.set)
+
+        deadline = None if timeout is None else monotonic.monotonic() + timeout
+        self._add_state_waiter(check)
+        try:
+            while not predicate(self):
+                if not self._handler._alive:
+                    raise APIException('Connection lost while waiting%s' % (': %s' % errmsg if errmsg else ''))
+                wait = 1.0
+                if deadline is not None:
+                    remaining = deadline - monotonic.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(errmsg or 'Condition not met after %s seconds' % timeout)
+                    wait = min(wait, remaining)
+                try:
+                    await asyncio.wait_for(woken.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                woken.clear()
+                fired[0] = False
+        finally:
+            self._remove_state_waiter(check)
+
+    @property
+    def ingest_policy(self):
+        """
+        The :py:class:`IngestPolicy <dronekit.ingest.IngestPolicy>` filtering incoming messages,
+        or ``None`` if every message is decoded and dispatched.
+        """
+        return self._handler.ingest_policy
+
+    def set_ingest_policy(self, policy):
+        """
+        Filter and decimate incoming messages before they are decoded.
+
+        Messages rejected by ``policy`` never reach message listeners and do not update the
+        attributes derived from them. Pass ``None`` to accept everything again.
+
+        .. code:: python
+
+            from dronekit.ingest import IngestPolicy
+
+            # Drop RAW_IMU and keep ATTITUDE at 10 Hz.
+            vehicle.set_ingest_policy(IngestPolicy(deny=['RAW_IMU'], rates={'ATTITUDE': 10}))
+
+        :param policy: An :py:class:`IngestPolicy <dronekit.ingest.IngestPolicy>`, or ``None``.
+        """
+        self._handler.ingest_policy = policy
 
     def close(self):
+        self._command_client.cancel_all()
         return self._handler.close()
 
+    @property
+    def command_client(self):
+        """
+        The :py:class:`CommandClient <dronekit.command.CommandClient>` sending ``COMMAND_LONG``
+        messages to this vehicle and matching them with their ``COMMAND_ACK``.
+        """
+        return self._command_client
+
+    def set_mode(self, mode):
+        """
+        Request a flight mode change with ``MAV_CMD_DO_SET_MODE``.
+
+        Unlike assigning :py:attr:`mode`, this returns a future that resolves to the
+        :py:class:`CommandResult <dronekit.command.CommandResult>` of the vehicle's ``COMMAND_ACK``.
+        The :py:attr:`mode` attribute changes with the next ``HEARTBEAT``.
+
+        :param mode: A :py:class:`VehicleMode`, a mode name or (ArduPilot only) a mode number.
+        :raises ValueError: if the mode is not known for this vehicle.
+        """
+        if isinstance(mode, basestring):
+            mode = VehicleMode(mode)
+        if self._autopilot_type == mavutil.mavlink.MAV_AUTOPILOT_PX4:
+            if mode.name not in mavutil.px4_map:
+                raise ValueError('Unknown flight mode: %s' % mode.name)
+            base_mode, main_mode, sub_mode = mavutil.px4_map[mode.name]
+            return self._command_client.send(mavutil.mavlink.MAV_CMD_DO_SET_MODE,
+                                             base_mode, main_mode, sub_mode)
+        if isinstance(mode, int):
+            custom_mode = mode
+        elif self._mode_mapping and mode.name in self._mode_mapping:
+            custom_mode = self._mode_mapping[mode.name]
+        else:
+            raise ValueError('Unknown flight mode: %s' % mode.name)
+        return self._command_client.send(mavutil.mavlink.MAV_CMD_DO_SET_MODE,
+                                         mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED, custom_mode)
+
+    def set_armed(self, armed=True, force=False):
+        """
+        Arm or disarm with ``MAV_CMD_COMPONENT_ARM_DISARM``.
+
+        Returns a future that resolves to the :py:class:`CommandResult <dronekit.command.CommandResult>`
+        of the vehicle's ``COMMAND_ACK`` (for example ``MAV_RESULT_FAILED`` when pre-arm checks fail).
+
+        :param force: Skip the autopilot's pre-arm (or in-flight disarm) checks.
+        """
+        return self._command_client.send(mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM,
+                                         1 if armed else 0, 21196 if force else 0)
+
     def flush(self):
         """
         Call ``flush()`` after :py:func:`adding <CommandSequence.add>` or :py:func:`clearing <CommandSequence.clear>` mission commands.
@@ -2031,6 +2375,77 @@ class Vehicle(HasObservers):
         """
         return self._channels
 
+    @property
+    def snapshot(self):
+        """
+        The latest :py:class:`TelemetrySnapshot` (position, attitude, speeds, battery, mode, armed and home).
+
+        Reading this attribute is a single reference read: no objects are built and all fields
+        come from the same update, unlike reading :py:attr:`location`, :py:attr:`attitude` and
+        :py:attr:`battery` one after the other.
+
+        .. code-block:: python
+
+            snap = vehicle.snapshot
+            print "Position: %s, %s at %sm" % (snap.lat, snap.lon, snap.alt)
+        """
+        return self._snapshot
+
+    @property
+    def history(self):
+        """
+        The :py:class:`TelemetryHistory <dronekit.history.TelemetryHistory>` recording this
+        vehicle's telemetry, or ``None`` until :py:func:`enable_history` is called.
+        """
+        return self._history
+
+    def enable_history(self, seconds=600, rate=5, fields=None):
+        """
+        Start keeping the last ``seconds`` of telemetry in memory.
+
+        The :py:attr:`snapshot` is sampled at up to ``rate`` Hz (the receive loop runs every 50 ms
+        or faster, so rates above 20 Hz are not reached) into a ring buffer of
+        ``seconds * rate`` samples allocated up front. Calling it again replaces the history.
+
+        .. code-block:: python
+
+            history = vehicle.enable_history(seconds=300, rate=10)
+            trail = history.window(60, fields=('lat', 'lon'))
+
+        :param seconds: How much history to keep.
+        :param rate: Samples per second.
+        :param fields: Snapshot fields to record (default
+            :py:const:`HISTORY_FIELDS <dronekit.history.HISTORY_FIELDS>`).
+        :returns: The new :py:class:`TelemetryHistory <dronekit.history.TelemetryHistory>`.
+        """
+        from app.libs.dronekit.history import HISTORY_FIELDS, TelemetryHistory
+        if seconds <= 0 or rate <= 0:
+            raise ValueError('History seconds and rate must be positive')
+        self._history = TelemetryHistory(max(1, int(math.ceil(seconds * rate))),
+                                         fields=fields or HISTORY_FIELDS, interval=1.0 / rate)
+        return self._history
+
+    def disable_history(self):
+        """Stop recording telemetry and release the history buffer."""
+        self._history = None
+
+    def _update_snapshot(self, **changes):
+        # Called from the thread (or event loop) that dispatches this vehicle's messages,
+        # so swapping the reference is enough to publish the update.
+        self._snapshot = self._snapshot._replace(time=monotonic.monotonic(), **changes)
+
+    def _update_snapshot_fields(self, indices, values):
+        # Positional variant of _update_snapshot for the per-message hot paths (no keyword dicts).
+        fields = list(self._snapshot)
+        for index, value in zip(indices, values):
+            fields[index] = value
+        fields[_SNAPSHOT_TIME] = monotonic.monotonic()
+        self._snapshot = tuple.__new__(TelemetrySnapshot, fields)
+
+    def _update_home_snapshot(self):
+        home = self._home_location
+        self._update_snapshot(home_lat=home.lat, home_lon=home.lon, home_alt=home.alt)
+
     @property
     def home_location(self):
         """
@@ -2085,6 +2500,7 @@ class Vehicle(HasObservers):
 
         # Set cached home location.
         self._home_location = copy.copy(pos)
+        self._update_home_snapshot()
 
         # Send MAVLink update.
         self.send_mavlink(self.message_factory.command_long_encode(
@@ -2113,22 +2529,94 @@ class Vehicle(HasObservers):
         """
         return self._parameters
 
-    def wait_for(self, condition, timeout=None, interval=0.1, errmsg=None):
+    @property
+    def param_cache(self):
+        """
+        The :py:class:`ParamCache <dronekit.param_cache.ParamCache>` used for this vehicle's parameters,
+        or ``None`` (the default) to always download them.
+
+        When the vehicle's table is cached, the parameters are available as soon as the vehicle reports
+        its parameter count, and :py:attr:`Parameters.revalidating` stays ``True`` while the table is
+        downloaded again in the background. Values that changed are updated (and their listeners
+        notified) as they arrive, and the cache is rewritten once the download completes.
+
+        Set it before :py:func:`initialize`, e.g. with ``connect(..., param_cache='/var/cache/dronekit')``.
+        """
+        return self._param_cache
+
+    @param_cache.setter
+    def param_cache(self, cache):
+        if cache is not None and not hasattr(cache, 'load'):
+            from app.libs.dronekit.param_cache import ParamCache
+            cache = ParamCache(cache)
+        self._param_cache = cache
+
+    def _param_cache_key(self):
+        if self._param_cache is None or self._autopilot_version is None or self._heartbeat_system is None:
+            return None
+        return self._heartbeat_system, self._param_cache.firmware_key(self._autopilot_version)
+
+    def _load_cached_params(self):
+        key = self._param_cache_key()
+        if key is None:
+            return
+        params = self._param_cache.load(key[0], key[1], self._params_count)
+        if params is None:
+            return
+        for name, value, _ in params:
+            self._params_map[name] = value
+        self._params_cache_hash = self._param_cache.table_hash(params)
+        self._params_loaded = True
+        self._params_revalidating = True
+        self._logger.info('Loaded %d parameters from cache, revalidating' % len(params))
+        self.notify_attribute_listeners('parameters', self.parameters)
+
+    def _mission_downloaded(self, items):
+        self._wp_opaque_id = self._wp_download.opaque_id
+        self._wploader.clear()
+        for item in items:
+            self._wploader.add(item)
+        if items:
+            home = items[0]
+            if not (home.x == 0 and home.y == 0 and home.z == 0):
+                self._home_location = LocationGlobal(home.x, home.y, home.z)
+                self._update_home_snapshot()
+        self._wpts_dirty = False
+        self._wp_loaded = True
+        self.notify_attribute_listeners('commands', self.commands)
+
+    def _params_complete(self):
+        revalidated = self._params_revalidating
+        self._params_revalidating = False
+        if revalidated:
+            # Drop cached names the vehicle no longer has.
+            names = set(msg.param_id for msg in self._params_set)
+            for name in [name for name in self._params_map if name not in names]:
+                del self._params_map[name]
+        else:
+            self._params_loaded = True
+            self.notify_attribute_listeners('parameters', self.parameters)
+
+        key = self._param_cache_key()
+        if key is not None:
+            params = [(msg.param_id, msg.param_value, msg.param_type) for msg in self._params_set]
+            if self._param_cache.table_hash(params) != self._params_cache_hash:
+                self._params_cache_hash = self._param_cache.save(key[0], key[1], params)
+
+    def wait_for(self, condition, timeout=None, interval=1.0, errmsg=None):
         '''Wait for a condition to be True.
 
         Wait for condition, a callable, to return True.  If timeout is
         nonzero, raise a TimeoutError(errmsg) if the condition is not
-        True after timeout seconds.  Check the condition everal
-        interval seconds.
+        True after timeout seconds.  The condition is checked whenever
+        a vehicle attribute is updated, and at least every interval
+        seconds. Raises APIException if the connection is lost.
         '''
 
-        t0 = time.time()
-        while not condition():
-            t1 = time.time()
-            if timeout and (t1 - t0) >= timeout:
-                raise TimeoutError(errmsg)
-
-            time.sleep(interval)
+        if not self._wait_state(condition, timeout=timeout or None, interval=interval):
+            if not self._handler._alive:
+                raise APIException('Connection lost while waiting%s' % (': %s' % errmsg if errmsg else ''))
+            raise TimeoutError(errmsg)
 
     def wait_for_armable(self, timeout=None):
         '''Wait for the vehicle to become armable.
@@ -2247,13 +2735,15 @@ class Vehicle(HasObservers):
            other commands are executed. A good example is provided in the guide topic :doc:`guide/taking_off`.
 
         :param alt: Target height, in metres.
+        :returns: A future resolving to the :py:class:`CommandResult <dronekit.command.CommandResult>`
+            of the takeoff command (``None`` if ``alt`` is not given).
         """
         if alt is not None:
             altitude = float(alt)
             if math.isnan(altitude) or math.isinf(altitude):
                 raise ValueError("Altitude was NaN or Infinity. Please provide a real number")
-            self._master.mav.command_long_send(0, 0, mavutil.mavlink.MAV_CMD_NAV_TAKEOFF,
-                                               0, 0, 0, 0, 0, 0, 0, altitude)
+            return self._command_client.send(mavutil.mavlink.MAV_CMD_NAV_TAKEOFF,
+                                             0, 0, 0, 0, 0, 0, altitude)
 
     def simple_goto(self, location, airspeed=None, groundspeed=None):
         '''
@@ -2374,23 +2864,17 @@ class Vehicle(HasObservers):
         self._heartbeat_started = True
         self._heartbeat_lastreceived = start
 
-        # Poll for first heartbeat.
+        # Wait for first heartbeat.
         # If heartbeat times out, this will interrupt.
-        while self._handler._alive:
-            time.sleep(.1)
-            if self._heartbeat_lastreceived != start:
-                break
-        if not self._handler._alive:
+        if not self._wait_state(lambda: self._heartbeat_lastreceived != start):
             raise APIException('Timeout in initializing connection.')
 
         # Register target_system now.
         self._handler.target_system = self._heartbeat_system
 
         # Wait until board has booted.
-        while True:
-            if self._flightmode not in [None, 'INITIALISING', 'MAV']:
-                break
-            time.sleep(0.1)
+        if not self._wait_state(lambda: self._flightmode not in [None, 'INITIALISING', 'MAV']):
+            raise APIException('Connection lost while waiting for the vehicle to boot.')
 
         # Initialize data stream.
         if rate is not None:
@@ -2399,14 +2883,30 @@ class Vehicle(HasObservers):
 
         self.add_message_listener('HEARTBEAT', self.send_capabilities_request)
 
+        if self._param_cache is not None:
+            # The cache is keyed by firmware build, so ask for AUTOPILOT_VERSION before the first
+            # PARAM_VALUE arrives rather than waiting for the next heartbeat.
+            # The AUTOPILOT_VERSION listener notifies 'autopilot_version', which ends the wait as
+            # soon as the answer is processed; the request is resent every 0.2s in case it was lost.
+            deadline = monotonic.monotonic() + 1
+            while self._handler._alive:
+                remaining = deadline - monotonic.monotonic()
+                if remaining <= 0:
+                    break
+                self.send_capabilities_request(self, 'HEARTBEAT', None)
+                if self._wait_state(lambda: self._autopilot_version is not None, timeout=min(0.2, remaining)):
+                    break
+
         # Ensure initial parameter download has started.
-        while True:
+        while self._handler._alive:
             # This fn actually rate limits itself to every 2s.
             # Just retry with persistence to get our first param stream.
             self._master.param_fetch_all()
             time.sleep(0.1)
             if self._params_count > -1:
                 break
+        if not self._handler._alive:
+            raise APIException('Connection lost while starting the parameter download.')
 
     def send_capabilties_request(self, vehicle, name, m):
         '''An alias for send_capabilities_request.
@@ -2421,6 +2921,70 @@ class Vehicle(HasObservers):
         capability_msg = vehicle.message_factory.command_long_encode(0, 0, mavutil.mavlink.MAV_CMD_REQUEST_AUTOPILOT_CAPABILITIES, 0, 1, 0, 0, 0, 0, 0, 0)
         vehicle.send_mavlink(capability_msg)
 
+    @property
+    def stream_profile(self):
+        """
+        Message rates (Hz) confirmed by :py:func:`set_stream_profile`, as ``{message: rate}``.
+        """
+        return dict(self._stream_rates)
+
+    def set_stream_profile(self, rates, timeout=1.0, retries=2):
+        """
+        Set the rate of individual messages with ``MAV_CMD_SET_MESSAGE_INTERVAL``.
+
+        Requests are sent one message at a time through :py:attr:`command_client`, each confirmed
+        by its ``COMMAND_ACK`` and resent up to ``retries`` times. If a request is never
+        acknowledged the autopilot is assumed not to be answering, and the remaining messages are
+        not sent. Messages not in ``rates`` keep their current rate.
+
+        .. code:: python
+
+            vehicle.set_stream_profile({'GLOBAL_POSITION_INT': 10, 'SYS_STATUS': 1, 'RAW_IMU': 0})
+
+        :param rates: ``{message name or id: rate in Hz}``. A rate of ``0`` stops the message and
+            ``None`` restores the autopilot's default rate.
+        :param timeout: Seconds to wait for each acknowledgement.
+        :param retries: Number of times a request is resent before giving up on that message.
+        :returns: ``{message: MAV_RESULT}`` for each requested message, ``None`` where no
+            acknowledgement was received.
+        """
+        requests = []
+        for message, rate in rates.items():
+            msgid = message if isinstance(message, int) else getattr(
+                mavutil.mavlink, 'MAVLINK_MSG_ID_' + message, None)
+            if msgid is None:
+                raise APIException('Unknown MAVLink message: %s' % message)
+            if rate is None:
+                interval = 0
+            elif rate <= 0:
+                interval = -1
+            else:
+                interval = int(1e6 / rate)
+            requests.append((message, msgid, interval, rate))
+
+        results = dict((message, None) for message, _, _, _ in requests)
+        for message, msgid, interval, rate in requests:
+            # All requests share one command id, so they go out one at a time anyway.
+            future = self._command_client.send(
+                mavutil.mavlink.MAV_CMD_SET_MESSAGE_INTERVAL, msgid, interval,
+                timeout=timeout, retries=retries, progress_timeout=timeout * (retries + 1))
+            # The receive loop resolves the future; if it stops, nothing else will.
+            while not concurrent.futures.wait([future], timeout)[0]:
+                if not self._handler._alive:
+                    raise APIException('Connection lost while setting message intervals.')
+            try:
+                results[message] = future.result().result
+            except TimeoutError:
+                break
+            except APIException:
+                raise APIException('Connection lost while setting message intervals.')
+            if results[message] == mavutil.mavlink.MAV_RESULT_ACCEPTED:
+                if rate is None:
+                    self._stream_rates.pop(message, None)
+                else:
+                    self._stream_rates[message] = rate
+        return results
+
     def play_tune(self, tune):
         '''Play a tune on the vehicle'''
         msg = self.message_factory.play_tune_encode(0, 0, tune)
@@ -2475,10 +3039,18 @@ class Vehicle(HasObservers):
         still_waiting_callback = kwargs.get('still_waiting_callback')
         still_waiting_message_interval = kwargs.get('still_waiting_interval', 1)
 
-        while not await_attributes.issubset(self._ready_attrs):
-            time.sleep(0.1)
+        def ready():
+            return await_attributes.issubset(self._ready_attrs)
+
+        while not ready():
+            # Wakes as soon as the last awaited attribute arrives (or for the next progress callback).
+            self._wait_state(ready, timeout=max(0, min(timeout - (monotonic.monotonic() - start),
+                                                       still_waiting_message_interval)))
+            if not self._handler._alive:
+                raise APIException('Connection lost while waiting for %s.' %
+                                   ', '.join(sorted(await_attributes - self._ready_attrs)))
             now = monotonic.monotonic()
-            if now - start > timeout:
+            if now - start >= timeout:
                 if raise_exception:
                     raise TimeoutError('wait_ready experienced a timeout after %s seconds.' %
                                        timeout)
@@ -2493,12 +3065,15 @@ class Vehicle(HasObservers):
         return True
 
     def reboot(self):
-        """Requests an autopilot reboot by sending a ``MAV_CMD_PREFLIGHT_REBOOT_SHUTDOWN`` command."""
+        """
+        Requests an autopilot reboot by sending a ``MAV_CMD_PREFLIGHT_REBOOT_SHUTDOWN`` command.
+
+        Returns a future resolving to the :py:class:`CommandResult <dronekit.command.CommandResult>`
+        of the command.
+        """
 
-        reboot_msg = self.message_factory.command_long_encode(
-            0, 0,  # target_system, target_component
+        return self._command_client.send_slow(
             mavutil.mavlink.MAV_CMD_PREFLIGHT_REBOOT_SHUTDOWN,  # command
-            0,  # confirmation
             1,  # param 1, autopilot (reboot)
             0,  # param 2, onboard computer (do nothing)
             0,  # param 3, camera (do nothing)
@@ -2506,15 +3081,11 @@ class Vehicle(HasObservers):
             0, 0, 0  # param 5 ~ 7 not used
         )
 
-        self.send_mavlink(reboot_msg)
-
     def send_calibrate_gyro(self):
-        """Request gyroscope calibration."""
+        """Request gyroscope calibration (returns a future for the ``COMMAND_ACK`` result)."""
 
-        calibration_command = self.message_factory.command_long_encode(
-            self._handler.target_system, 0,  # target_system, target_component
+        calibration_command = (
             mavutil.mavlink.MAV_CMD_PREFLIGHT_CALIBRATION,  # command
-            0,  # confirmation
             1,  # param 1, 1: gyro calibration, 3: gyro temperature calibration
             0,  # param 2, 1: magnetometer calibration
             0,  # param 3, 1: ground pressure calibration
@@ -2523,17 +3094,15 @@ class Vehicle(HasObservers):
             0,  # param 6, 2: airspeed calibration
             0,  # param 7, 1: ESC calibration, 3: barometer temperature calibration
         )
-        self.send_mavlink(calibration_command)
+        return self._command_client.send_slow(*calibration_command)
 
     def send_calibrate_magnetometer(self):
-        """Request magnetometer calibration."""
+        """Request magnetometer calibration (returns a future for the ``COMMAND_ACK`` result)."""
 
         # ArduPilot requires the MAV_CMD_DO_START_MAG_CAL command, only present in the ardupilotmega.xml definition
         if self._autopilot_type == mavutil.mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA:
-            calibration_command = self.message_factory.command_long_encode(
-                self._handler.target_system, 0,  # target_system, target_component
+            calibration_command = (
                 mavutil.mavlink.MAV_CMD_DO_START_MAG_CAL,  # command
-                0,  # confirmation
                 0,  # param 1, uint8_t bitmask of magnetometers (0 means all).
                 1,  # param 2, Automatically retry on failure (0=no retry, 1=retry).
                 1,  # param 3, Save without user input (0=require input, 1=autosave).
@@ -2543,10 +3112,8 @@ class Vehicle(HasObservers):
                 0,  # param 7, Empty.
             )
         else:
-            calibration_command = self.message_factory.command_long_encode(
-                self._handler.target_system, 0,  # target_system, target_component
+            calibration_command = (
                 mavutil.mavlink.MAV_CMD_PREFLIGHT_CALIBRATION,  # command
-                0,  # confirmation
                 0,  # param 1, 1: gyro calibration, 3: gyro temperature calibration
                 1,  # param 2, 1: magnetometer calibration
                 0,  # param 3, 1: ground pressure calibration
@@ -2556,18 +3123,16 @@ class Vehicle(HasObservers):
                 0,  # param 7, 1: ESC calibration, 3: barometer temperature calibration
             )
 
-        self.send_mavlink(calibration_command)
+        return self._command_client.send_slow(*calibration_command)
 
     def send_calibrate_accelerometer(self, simple=False):
-        """Request accelerometer calibration.
+        """Request accelerometer calibration (returns a future for the ``COMMAND_ACK`` result).
 
         :param simple: if True, perform simple accelerometer calibration
         """
 
-        calibration_command = self.message_factory.command_long_encode(
-            self._handler.target_system, 0,  # target_system, target_component
+        calibration_command = (
             mavutil.mavlink.MAV_CMD_PREFLIGHT_CALIBRATION,  # command
-            0,  # confirmation
             0,  # param 1, 1: gyro calibration, 3: gyro temperature calibration
             0,  # param 2, 1: magnetometer calibration
             0,  # param 3, 1: ground pressure calibration
@@ -2576,15 +3141,13 @@ class Vehicle(HasObservers):
             0,  # param 6, 2: airspeed calibration
             0,  # param 7, 1: ESC calibration, 3: barometer temperature calibration
         )
-        self.send_mavlink(calibration_command)
+        return self._command_client.send_slow(*calibration_command)
 
     def send_calibrate_vehicle_level(self):
-        """Request vehicle level (accelerometer trim) calibration."""
+        """Request vehicle level (accelerometer trim) calibration (returns a future for the ``COMMAND_ACK`` result)."""
 
-        calibration_command = self.message_factory.command_long_encode(
-            self._handler.target_system, 0,  # target_system, target_component
+        calibration_command = (
             mavutil.mavlink.MAV_CMD_PREFLIGHT_CALIBRATION,  # command
-            0,  # confirmation
             0,  # param 1, 1: gyro calibration, 3: gyro temperature calibration
             0,  # param 2, 1: magnetometer calibration
             0,  # param 3, 1: ground pressure calibration
@@ -2593,15 +3156,13 @@ class Vehicle(HasObservers):
             0,  # param 6, 2: airspeed calibration
             0,  # param 7, 1: ESC calibration, 3: barometer temperature calibration
         )
-        self.send_mavlink(calibration_command)
+        return self._command_client.send_slow(*calibration_command)
 
     def send_calibrate_barometer(self):
-        """Request barometer calibration."""
+        """Request barometer calibration (returns a future for the ``COMMAND_ACK`` result)."""
 
-        calibration_command = self.message_factory.command_long_encode(
-            self._handler.target_system, 0,  # target_system, target_component
+        calibration_command = (
             mavutil.mavlink.MAV_CMD_PREFLIGHT_CALIBRATION,  # command
-            0,  # confirmation
             0,  # param 1, 1: gyro calibration, 3: gyro temperature calibration
             0,  # param 2, 1: magnetometer calibration
             1,  # param 3, 1: ground pressure calibration
@@ -2610,7 +3171,7 @@ class Vehicle(HasObservers):
             0,  # param 6, 2: airspeed calibration
             0,  # param 7, 1: ESC calibration, 3: barometer temperature calibration
         )
-        self.send_mavlink(calibration_command)
+        return self._command_client.send_slow(*calibration_command)
 
 
 class Gimbal(object):
@@ -2821,6 +3382,9 @@ class Parameters(MutableMapping, HasObservers):
         super(Parameters, self).__init__()
         self._logger = logging.getLogger(__name__)
         self._vehicle = vehicle
+        # Pending set() calls, each collecting PARAM_VALUEs by name.
+        self._ack_sinks = []
+        self._acks_changed = threading.Condition()
 
     def __getitem__(self, name):
         name = name.upper()
@@ -2847,33 +3411,144 @@ class Parameters(MutableMapping, HasObservers):
             self.wait_ready()
         return self._vehicle._params_map.get(name, None)
 
-    def set(self, name, value, retries=3, wait_ready=False):
+    def as_dict(self):
+        """
+        A copy of all parameter values as a ``{name: value}`` dict, taken without waiting for the
+        download to finish.
+        """
+        return dict(self._vehicle._params_map)
+
+    def set(self, name, value, retries=3, wait_ready=False, timeout=1.0):
+        """
+        Set a parameter and wait for the vehicle to confirm it.
+
+        The set is confirmed by the ``PARAM_VALUE`` the vehicle sends back. It is resent if no
+        confirmation arrives within ``timeout`` seconds, or if the vehicle reports a different value,
+        up to ``retries`` times (so at most ``retries + 1`` requests). With ``retries=0`` the request
+        is sent once without waiting.
+
+        :returns: ``True`` if the vehicle reported the new value.
+        """
+        return self.set_many({name: value}, retries=retries, wait_ready=wait_ready, timeout=timeout)[name.upper()]
+
+    def set_many(self, values, window=10, retries=3, wait_ready=False, timeout=1.0, callback=None):
+        """
+        Set several parameters, keeping up to ``window`` requests in flight.
+
+        Each parameter is confirmed as in :py:func:`set`, so a large table takes a few round
+        trips rather than one per parameter.
+
+        .. code:: python
+
+            results = vehicle.parameters.set_many({'WPNAV_SPEED': 500, 'RTL_ALT': 1500})
+            failed = [name for name, ok in results.items() if not ok]
+
+        :param values: ``{name: value}``.
+        :param window: Maximum number of unconfirmed requests.
+        :param callback: Called as ``callback(name, ok)`` once each parameter is confirmed or
+            given up on (from the calling thread).
+        :returns: ``{name: True if the vehicle reported the new value}`` (names upper-cased).
+        """
         if wait_ready:
             self.wait_ready()
 
-        # TODO dumbly reimplement this using timeout loops
-        # because we should actually be awaiting an ACK of PARAM_VALUE
-        # changed, but we don't have a proper ack structure, we'll
-        # instead just wait until the value itself was changed
+        # Values are compared as the single precision floats carried by PARAM_SET / PARAM_VALUE.
+        queue = collections.deque((name.upper(), float(struct.unpack('f', struct.pack('f', value))[0]))
+                                  for name, value in values.items())
+        results = dict((name, False) for name, _ in queue)
+        master = self._vehicle._master
+        if retries <= 0:
+            for name, value in queue:
+                master.param_set_send(name, value)
+                if callback:
+                    callback(name, False)
+            return results
+
+        acks = {}
+        inflight = {}  # name -> [value, time sent, attempts]
+        with self._acks_changed:
+            self._ack_sinks.append(acks)
+        try:
+            while queue or inflight:
+                # (name, ok) for the parameters settled in this round, reported once the lock is
+                # released: the receive thread takes it to deliver every PARAM_VALUE.
+                finished = []
+                with self._acks_changed:
+                    now = monotonic.monotonic()
+                    while queue and len(inflight) < window:
+                        name, value = queue.popleft()
+                        master.param_set_send(name, value)
+                        inflight[name] = [value, now, 1]
+
+                    deadline = min(sent for _, sent, _ in inflight.values()) + timeout
+                    if not acks and now < deadline:
+                        self._acks_changed.wait(deadline - now)
+                    now = monotonic.monotonic()
+
+                    resend = []
+                    for name, value in acks.items():
+                        request = inflight.get(name)
+                        if request is None:
+                            continue
+                        if value == request[0]:
+                            results[name] = True
+                            del inflight[name]
+                            finished.append((name, True))
+                        else:
+                            # Rejected, or a PARAM_VALUE sent before our request arrived.
+                            resend.append(name)
+                    acks.clear()
+                    resend.extend(name for name, request in inflight.items()
+                                  if now - request[1] >= timeout and name not in resend)
+
+                    for name in resend:
+                        request = inflight[name]
+                        if request[2] > retries:
+                            self._logger.error("failed to set parameter %s to %f" % (name, request[0]))
+                            del inflight[name]
+                            finished.append((name, False))
+                        else:
+                            master.param_set_send(name, request[0])
+                            request[1] = now
+                            request[2] += 1
+
+                if callback:
+                    for name, ok in finished:
+                        callback(name, ok)
+                if not self._vehicle._handler._alive:
+                    break
+        finally:
+            with self._acks_changed:
+                self._ack_sinks.remove(acks)
+        return results
+
+    def _acknowledge(self, name, value):
+        # Called for every PARAM_VALUE: hands the value to pending set()/set_many() calls.
+        if self._ack_sinks:
+            with self._acks_changed:
+                for acks in self._ack_sinks:
+                    acks[name] = value
+                self._acks_changed.notify_all()
 
-        name = name.upper()
-        # convert to single precision floating point number (the type used by low level mavlink messages)
-        value = float(struct.unpack('f', struct.pack('f', value))[0])
-        remaining = retries
-        while True:
-            self._vehicle._master.param_set_send(name, value)
-            tstart = monotonic.monotonic()
-            if remaining == 0:
-                break
-            remaining -= 1
-            while monotonic.monotonic() - tstart < 1:
-                if name in self._vehicle._params_map and self._vehicle._params_map[name] == value:
-                    return True
-                time.sleep(0.1)
+    @property
+    def download_progress(self):
+        """
+        Progress of the parameter download as a ``(received, total)`` tuple.
+
+        ``total`` is ``None`` until the vehicle has reported its parameter count.
+        """
+        total = self._vehicle._params_count
+        if total < 0:
+            return 0, None
+        return self._vehicle._params_received, total
 
-        if retries > 0:
-            self._logger.error("timeout setting parameter %s to %f" % (name, value))
-        return False
+    @property
+    def revalidating(self):
+        """
+        ``True`` while the values loaded from the :py:attr:`parameter cache <Vehicle.param_cache>`
+        are being refreshed from the vehicle.
+        """
+        return self._vehicle._params_revalidating
 
     def wait_ready(self, **kwargs):
         """
@@ -3070,35 +3745,74 @@ class CommandSequence(object):
         '''
         Download all waypoints from the vehicle.
         The download is asynchronous. Use :py:func:`wait_ready()` to block your thread until the download is complete.
+
+        Items are requested a few at a time and requests that go unanswered are resent (see
+        :py:class:`MissionDownload <dronekit.mission.MissionDownload>`). Calling ``download()`` while a
+        download is running does not start another one.
         '''
-        self.wait_ready()
-        self._vehicle._ready_attrs.remove('commands')
-        self._vehicle._wp_loaded = False
-        self._vehicle._master.waypoint_request_list_send()
-        # BIG FIXME - wait for full wpt download before allowing any of the accessors to work
+        from app.libs.dronekit.mission import MissionDownload
+
+        vehicle = self._vehicle
+        if vehicle._wp_download is not None and not vehicle._wp_download.finished.is_set():
+            return
+        vehicle._ready_attrs.discard('commands')
+        vehicle._wp_loaded = False
+        vehicle._wp_download = MissionDownload(vehicle, on_complete=vehicle._mission_downloaded)
+        vehicle._wp_download.start()
 
     def wait_ready(self, **kwargs):
         """
         Block the calling thread until waypoints have been downloaded.
 
         This can be called after :py:func:`download()` to block the thread until the asynchronous download is complete.
+        If the download fails, :py:class:`APIException` is raised (or ``False`` returned with
+        ``raise_exception=False``) as soon as the vehicle stops answering.
+        """
+        download = self._vehicle._wp_download
+        if download is None:
+            return self._vehicle.wait_ready('commands', **kwargs)
+        timeout = kwargs.get('timeout', 30)
+        raise_exception = kwargs.get('raise_exception', True)
+        if not download.finished.wait(timeout):
+            if raise_exception:
+                raise TimeoutError('wait_ready experienced a timeout after %s seconds.' % timeout)
+            return False
+        if download.error is not None:
+            if raise_exception:
+                raise APIException(download.error)
+            return False
+        return True
+
+    @property
+    def download_progress(self):
         """
-        return self._vehicle.wait_ready('commands', **kwargs)
+        Progress of the last mission download as a ``(received, total)`` tuple (``total`` is
+        ``None`` until the vehicle has reported its mission size), or ``None`` if no download was
+        started.
+        """
+        download = self._vehicle._wp_download
+        if download is None:
+            return None
+        return download.received, download.count
 
-    def clear(self):
+    def clear(self, keep_home=True):
         '''
         Clear the command list.
 
         This command will be sent to the vehicle only after you call :py:func:`upload() <Vehicle.commands.upload>`.
+
+        :param bool keep_home: Keep the home location (item 0). Pass ``False`` to add your own
+            home item before the mission.
         '''
 
         # Add home point again.
         self.wait_ready()
         home = None
-        try:
-            home = self._vehicle._wploader.wp(0)
-        except:
-            pass
+        if keep_home:
+            try:
+                home = self._vehicle._wploader.wp(0)
+            except:
+                pass
         self._vehicle._wploader.clear()
         if home:
             self._vehicle._wploader.add(home, comment='Added by DroneKit')
@@ -3119,28 +3833,56 @@ class CommandSequence(object):
         self._vehicle._wploader.add(cmd, comment='Added by DroneKit')
         self._vehicle._wpts_dirty = True
 
-    def upload(self, timeout=None):
+    def upload(self, timeout=None, progress=None, start=None, end=None):
         """
         Call ``upload()`` after :py:func:`adding <CommandSequence.add>` or :py:func:`clearing <CommandSequence.clear>` mission commands.
 
         After the return from ``upload()`` any writes are guaranteed to have completed (or thrown an
         exception) and future reads will see their effects.
 
+        The mission is sent in a single transfer (see :py:class:`MissionUpload <dronekit.mission.MissionUpload>`)
+        which completes when the vehicle acknowledges it with ``MISSION_ACK``.
+
         :param int timeout: The timeout for uploading the mission. No timeout if not provided or set to None.
+        :param progress: Called as ``progress(sent, total)`` as items are sent.
+        :param start: With ``end``, only send items ``start`` to ``end`` (inclusive, counting the
+            home location as item 0) with ``MISSION_WRITE_PARTIAL_LIST``. Use this when the vehicle
+            already holds the rest of the mission.
+        :raises MissionTransferError: if the vehicle rejects the mission.
         """
+        from app.libs.dronekit.mission import MissionUpload
+
         if self._vehicle._wpts_dirty:
-            self._vehicle._master.waypoint_clear_all_send()
-            start_time = time.time()
-            if self._vehicle._wploader.count() > 0:
-                self._vehicle._wp_uploaded = [False] * self._vehicle._wploader.count()
-                self._vehicle._master.waypoint_count_send(self._vehicle._wploader.count())
-                while False in self._vehicle._wp_uploaded:
-                    if timeout and time.time() - start_time > timeout:
-                        raise TimeoutError
-                    time.sleep(0.1)
-                self._vehicle._wp_uploaded = None
+            loader = self._vehicle._wploader
+            upload = MissionUpload(self._vehicle, [loader.wp(i) for i in range(loader.count())],
+                                   progress=progress, start=start, end=end)
+            self._vehicle._wp_upload = upload
+            try:
+                upload.run(deadline=monotonic.monotonic() + timeout if timeout else None)
+            finally:
+                self._vehicle._wp_upload = None
+            self._vehicle._wp_opaque_id = upload.opaque_id
             self._vehicle._wpts_dirty = False
 
+    @property
+    def opaque_id(self):
+        """
+        The mission id the vehicle reported after the last upload or download, or ``None`` if the
+        firmware (or MAVLink dialect) does not provide one.
+        """
+        return self._vehicle._wp_opaque_id
+
+    @property
+    def upload_progress(self):
+        """
+        Progress of the mission upload in progress as a ``(sent, total)`` tuple, or ``None``
+        when no upload is running.
+        """
+        upload = self._vehicle._wp_upload
+        if upload is None:
+            return None
+        return upload.sent, upload.total
+
     @property
     def count(self):
         '''
@@ -3205,7 +3947,10 @@ def connect(ip,
             heartbeat_timeout=30,
             source_system=255,
             source_component=0,
+            target_system=0,
             use_native=False,
+            use_asyncio=False,
+            param_cache=None,
             drone_id="default"):
     """
     Returns a :py:class:`Vehicle` object connected to the address specified by string parameter ``ip``.
@@ -3243,6 +3988,8 @@ def connect(ip,
         If a heartbeat is not detected within this time an exception will be raised.
     :param int source_system: The MAVLink ID of the :py:class:`Vehicle` object returned by this method (by default 255).
     :param int source_component: The MAVLink Component ID fo the :py:class:`Vehicle` object returned by this method (by default 0).
+    :param int target_system: The MAVLink system id of the vehicle. Required for ``udpmux:host:port``
+        connections, where several vehicles share one listening socket and are told apart by system id.
     :param bool use_native: Use precompiled MAVLink parser.
 
         .. note::
@@ -3258,17 +4005,29 @@ def connect(ip,
             The ``status_printer`` argument is deprecated. To redirect the logging from the library and from the
             autopilot, configure the ``dronekit`` and ``autopilot`` loggers using the Python ``logging`` module.
 
+    :param bool use_asyncio: Drive the link from the shared asyncio event loop
+        (:py:class:`AsyncMAVConnection <dronekit.aiomavlink.AsyncMAVConnection>`) instead of
+        starting two threads per vehicle.
+    :param param_cache: Directory (or :py:class:`ParamCache <dronekit.param_cache.ParamCache>`) where
+        parameter tables are cached between connections. See :py:attr:`Vehicle.param_cache`.
+
 
     :returns: A connected vehicle of the type defined in ``vehicle_class`` (a superclass of :py:class:`Vehicle`).
     """
 
-    from app.libs.dronekit.mavlink import MAVConnection
+    if ip.startswith('udpmux:'):
+        from app.libs.dronekit.mavlink import MAVMuxConnection as MAVConnection
+    elif use_asyncio:
+        from app.libs.dronekit.aiomavlink import AsyncMAVConnection as MAVConnection
+    else:
+        from app.libs.dronekit.mavlink import MAVConnection
 
     if not vehicle_class:
         vehicle_class = Vehicle
 
-    handler = MAVConnection(ip, baud=baud, source_system=source_system, source_component=source_component, use_native=use_native)
+    handler = MAVConnection(ip, baud=baud, target_system=target_system, source_system=source_system, source_component=source_component, use_native=use_native)
     vehicle = vehicle_class(handler, drone_id=drone_id)
+    vehicle.param_cache = param_cache
 
     if status_printer:
         vehicle._autopilot_logger.addHandler(ErrprinterHandler(status_printer))
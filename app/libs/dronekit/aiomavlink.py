@@ -0,0 +1,409 @@
+from __future__ import print_function
+
+import asyncio
+import atexit
+import copy
+import logging
+import threading
+
+from app.libs.dronekit import APIException
+from app.libs.dronekit.ingest import parse_filtered
+from pymavlink import mavutil
+
+
+class MAVLinkEventLoop(object):
+    """
+    The asyncio event loop shared by every :py:class:`AsyncMAVConnection` in the process.
+
+    The loop runs on a single daemon thread, so the (blocking) :py:class:`Vehicle` API can still
+    be used from ordinary threads while all links are multiplexed on one loop.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='mavlink-event-loop')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def in_loop_thread(self):
+        return threading.current_thread() is self._thread
+
+    def call_soon(self, fn, *args):
+        self.loop.call_soon_threadsafe(fn, *args)
+
+    def run(self, coro, timeout=None):
+        """Run ``coro`` on the shared loop and block the calling thread until it completes."""
+        if self.in_loop_thread():
+            raise APIException('Cannot block on the MAVLink event loop from its own thread.')
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+
+class _StreamProtocol(asyncio.Protocol):
+    def __init__(self, connection):
+        self._connection = connection
+
+    def data_received(self, data):
+        self._connection._data_received(data, None)
+
+    def connection_lost(self, exc):
+        self._connection._connection_lost(exc)
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, connection):
+        self._connection = connection
+
+    def datagram_received(self, data, addr):
+        self._connection._data_received(data, addr)
+
+    def error_received(self, exc):
+        # ICMP port unreachable etc. The peer may simply not be up yet.
+        self._connection._logger.debug('UDP error: %s' % exc)
+
+    def connection_lost(self, exc):
+        self._connection._connection_lost(exc)
+
+
+class mavasync(mavutil.mavfile):
+    '''a MAVLink port whose I/O is performed by an asyncio transport'''
+    def __init__(self, connection, address, source_system=255, source_component=0, use_native=mavutil.default_native):
+        self._connection = connection
+        mavutil.mavfile.__init__(self, None, address, source_system=source_system, source_component=source_component, use_native=use_native)
+
+    def write(self, buf):
+        self._connection._send(buf)
+
+    def recv(self, n=None):
+        return b''
+
+    def close(self):
+        pass
+
+
+def _split_address(address):
+    a = address.split(':')
+    if len(a) != 2:
+        raise APIException('Ports must be specified as host:port (got %s)' % address)
+    return a[0], int(a[1])
+
+
+def parse_connection_string(ip):
+    """
+    Split a :ref:`connection string <get_started_connecting>` into ``(kind, address)``.
+
+    ``kind`` is one of ``'udpin'``, ``'udpout'``, ``'tcp'`` or ``'serial'``. Like
+    ``mavutil.mavlink_connection``, a bare ``host:port`` (or ``udp:host:port``) listens on UDP.
+    """
+    for prefix, kind in (('udpin:', 'udpin'), ('udp:', 'udpin'), ('udpout:', 'udpout'), ('tcp:', 'tcp')):
+        if ip.startswith(prefix):
+            return kind, _split_address(ip[len(prefix):])
+    if ip.startswith('tcpin:') or ip.startswith('udpbcast:'):
+        raise APIException('Connection type not supported by the asyncio transport: %s' % ip)
+    if ip.find(':') != -1 and not ip.startswith('/') and not ip.upper().startswith('COM'):
+        return 'udpin', _split_address(ip)
+    return 'serial', ip
+
+
+class AsyncMAVConnection(object):
+    """
+    A MAVLink link driven by the shared asyncio event loop (:py:class:`MAVLinkEventLoop`).
+
+    It exposes the same interface as :py:class:`MAVConnection` (``master``, ``forward_message``,
+    ``forward_loop``, ``start``, ``close``...), but does not own any threads: UDP and TCP links use
+    asyncio protocols and serial ports are watched with ``add_reader``. Outgoing packets written
+    between two loop iterations are flushed together in a single ``write``/``sendto``.
+    """
+
+    # Period of the loop listeners (heartbeats, parameter watchdog), same as the threaded select timeout.
+    loop_interval = 0.05
+
+    def __init__(self, ip, baud=115200, target_system=0, source_system=255, source_component=0, use_native=False, event_loop=None):
+        self._logger = logging.getLogger(__name__)
+        self._event_loop = event_loop or MAVLinkEventLoop.instance()
+        self._kind, self._address = parse_connection_string(ip)
+        self._baud = baud
+
+        self.master = mavasync(self, ip, source_system=source_system, source_component=source_component, use_native=use_native)
+        self.master.mav = mavutil.mavlink.MAVLink(
+            self.master,
+            srcSystem=self.master.source_system,
+            srcComponent=self.master.source_component,
+            use_native=use_native)
+        self._patch_send()
+
+        # Targets
+        self.target_system = target_system
+
+        # Listeners.
+        self.loop_listeners = []
+        self.message_listeners = []
+
+        self._accept_input = True
+        self._alive = True
+        self._death_error = None
+
+        # IngestPolicy for incoming messages (None accepts everything).
+        self.ingest_policy = None
+
+        self._transport = None
+        self._serial = None
+        self._addresses = set()
+        self._started = False
+        self._tick_handle = None
+
+        # Packets written by any thread, flushed from the loop thread.
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._flush_scheduled = False
+
+        def onexit():
+            self._alive = False
+
+        atexit.register(onexit)
+
+    def _patch_send(self):
+        # Monkey-patch MAVLink object for fix_targets.
+        mav = self.master.mav
+        sendfn = mav.send
+
+        def newsendfn(mavmsg, *args, **kwargs):
+            self.fix_targets(mavmsg)
+            return sendfn(mavmsg, *args, **kwargs)
+
+        mav.send = newsendfn
+        self._patched_mav = mav
+
+    #
+    # Transport setup (runs on the loop thread).
+    #
+
+    async def _open(self):
+        loop = self._event_loop.loop
+        if self._kind == 'udpin':
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _DatagramProtocol(self), local_addr=self._address)
+        elif self._kind == 'udpout':
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _DatagramProtocol(self), remote_addr=self._address)
+        elif self._kind == 'tcp':
+            self._transport, _ = await loop.create_connection(
+                lambda: _StreamProtocol(self), self._address[0], self._address[1])
+        else:
+            self._serial = mavutil.mavserial(self._address, baud=self._baud,
+                                             source_system=self.master.source_system,
+                                             source_component=self.master.source_component)
+            loop.add_reader(self._serial.fd, self._serial_readable)
+        self._tick_handle = loop.call_later(self.loop_interval, self._tick)
+
+    def _serial_readable(self):
+        try:
+            data = self._serial.recv()
+        except Exception as e:
+            self._connection_lost(e)
+            return
+        if data:
+            self._data_received(data, None)
+
+    #
+    # Receive path (runs on the loop thread).
+    #
+
+    def _data_received(self, data, addr):
+        if addr is not None and self._kind == 'udpin':
+            self._addresses.add(addr)
+
+        if not self._accept_input:
+            return
+
+        if self.master.first_byte:
+            self.master.auto_mavlink_version(data)
+            if self.master.mav is not self._patched_mav:
+                self._patch_send()
+
+        policy = self.ingest_policy
+        try:
+            if policy is None:
+                msgs = self.master.mav.parse_buffer(data)
+            else:
+                msgs = parse_filtered(self.master.mav, data, lambda sysid: policy)
+        except mavutil.mavlink.MAVError as e:
+            self._logger.debug('mav recv error: %s' % str(e))
+            return
+        if not msgs:
+            return
+
+        for msg in msgs:
+            self.master.post_message(msg)
+            for fn in self.message_listeners:
+                try:
+                    fn(self, msg)
+                except Exception:
+                    self._logger.exception(
+                        'Exception in message handler for %s' % msg.get_type(),
+                        exc_info=True
+                    )
+
+    def _tick(self):
+        if not self._alive:
+            return
+        try:
+            for fn in self.loop_listeners:
+                fn(self)
+        except APIException as e:
+            self._logger.exception('Exception in MAVLink loop listener')
+            self._die(e)
+            return
+        except Exception:
+            self._logger.exception('Exception in MAVLink loop listener', exc_info=True)
+        self._tick_handle = self._event_loop.loop.call_later(self.loop_interval, self._tick)
+
+    def _connection_lost(self, exc):
+        if self._alive:
+            self._die(exc or APIException('Connection closed by peer'))
+
+    def _die(self, error):
+        self._alive = False
+        self._death_error = error
+        self._close_transport()
+
+    #
+    # Send path.
+    #
+
+    def _send(self, buf):
+        with self._pending_lock:
+            self._pending.append(bytes(buf))
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self._event_loop.call_soon(self._flush)
+
+    def _flush(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+            self._flush_scheduled = False
+        if not pending:
+            return
+        data = b''.join(pending)
+        try:
+            if self._kind == 'udpin':
+                if self._transport is not None:
+                    for addr in self._addresses:
+                        self._transport.sendto(data, addr)
+            elif self._kind == 'udpout':
+                if self._transport is not None:
+                    self._transport.sendto(data)
+            elif self._kind == 'tcp':
+                if self._transport is not None:
+                    self._transport.write(data)
+            elif self._serial is not None:
+                self._serial.write(data)
+        except Exception:
+            self._logger.exception('mav send error', exc_info=True)
+
+    #
+    # MAVConnection interface.
+    #
+
+    def fix_targets(self, message):
+        """Set correct target IDs for our vehicle"""
+        if hasattr(message, 'target_system'):
+            message.target_system = self.target_system
+
+    def forward_loop(self, fn):
+        """
+        Decorator for event loop.
+        """
+        self.loop_listeners.append(fn)
+
+    def forward_message(self, fn):
+        """
+        Decorator for message inputs.
+        """
+        self.message_listeners.append(fn)
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        try:
+            self._event_loop.run(self._open())
+        except Exception as e:
+            self._alive = False
+            self._death_error = e
+            raise APIException('Unable to open %s: %s' % (self.master.address, e))
+
+    def reset(self):
+        with self._pending_lock:
+            self._pending = []
+
+    def _close_transport(self):
+        if self._tick_handle is not None:
+            self._tick_handle.cancel()
+            self._tick_handle = None
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        if self._serial is not None:
+            self._event_loop.loop.remove_reader(self._serial.fd)
+            self._serial.close()
+            self._serial = None
+
+    async def _close(self):
+        self._flush()
+        self._close_transport()
+
+    def close(self):
+        self._alive = False
+        if not self._started:
+            return
+        if self._event_loop.in_loop_thread():
+            self._flush()
+            self._close_transport()
+        else:
+            self._event_loop.run(self._close())
+
+    def pipe(self, target):
+        target.target_system = self.target_system
+
+        # vehicle -> self -> target
+        @self.forward_message
+        def callback(_, msg):
+            try:
+                target.master.mav.file.write(msg.pack(target.master.mav))
+            except:
+                try:
+                    assert len(msg.get_msgbuf()) > 0
+                    target.master.mav.file.write(msg.get_msgbuf())
+                except:
+                    self._logger.exception('Could not pack this object on receive: %s' % type(msg), exc_info=True)
+
+        # target -> self -> vehicle
+        @target.forward_message
+        def callback(_, msg):
+            msg = copy.copy(msg)
+            target.fix_targets(msg)
+            try:
+                self.master.mav.file.write(msg.pack(self.master.mav))
+            except:
+                try:
+                    assert len(msg.get_msgbuf()) > 0
+                    self.master.mav.file.write(msg.get_msgbuf())
+                except:
+                    self._logger.exception('Could not pack this object on forward: %s' % type(msg), exc_info=True)
+
+        return target
@@ -0,0 +1,245 @@
+"""
+``COMMAND_LONG`` requests answered by ``COMMAND_ACK``.
+
+:py:class:`CommandClient` sends a command and returns a :py:class:`concurrent.futures.Future`
+that resolves to a :py:class:`CommandResult` when the matching ``COMMAND_ACK`` arrives. Unanswered
+commands are resent with an increasing ``confirmation``; an ``MAV_RESULT_IN_PROGRESS`` answer stops
+the resends and the future waits for the final result. Commands with different ids are in flight
+at the same time. ``COMMAND_ACK`` only carries the command id, so a second command with the same id
+is queued until the first one is answered.
+
+The client is available as :py:attr:`Vehicle.command_client <dronekit.Vehicle.command_client>`:
+
+.. code:: python
+
+    result = vehicle.command_client.send(mavutil.mavlink.MAV_CMD_NAV_TAKEOFF, 0, 0, 0, 0, 0, 0, 10).result()
+    if not result.accepted:
+        print('Takeoff rejected: %s' % result.name)
+
+From asyncio, ``await asyncio.wrap_future(future)``.
+"""
+
+import collections
+import threading
+from concurrent.futures import Future
+
+import monotonic
+from pymavlink import mavutil
+
+from app.libs.dronekit import APIException, TimeoutError
+
+mavlink = mavutil.mavlink
+
+
+def command_result_name(result):
+    """Name of a ``MAV_RESULT`` value, e.g. ``'MAV_RESULT_DENIED'``."""
+    entry = mavlink.enums['MAV_RESULT'].get(result)
+    return entry.name if entry is not None else str(result)
+
+
+class CommandResult(object):
+    """
+    The final ``COMMAND_ACK`` of a command.
+
+    :param command: The ``MAV_CMD`` id.
+    :param result: The ``MAV_RESULT`` from the vehicle.
+    :param latency: Seconds from the first transmission to the final acknowledgement.
+    :param attempts: Number of times the command was sent.
+    """
+
+    def __init__(self, command, result, latency, attempts):
+        self.command = command
+        self.result = result
+        self.latency = latency
+        self.attempts = attempts
+
+    @property
+    def accepted(self):
+        return self.result == mavlink.MAV_RESULT_ACCEPTED
+
+    @property
+    def name(self):
+        return command_result_name(self.result)
+
+    def __str__(self):
+        return 'CommandResult:command=%s,result=%s,latency=%.3f,attempts=%s' % (
+            self.command, self.name, self.latency, self.attempts)
+
+
+class _PendingCommand(object):
+
+    def __init__(self, command, params, timeout, retries, progress_timeout, adaptive=True):
+        self.command = command
+        self.params = params
+        self.timeout = timeout
+        self.adaptive = adaptive
+        self.retries = retries
+        self.progress_timeout = progress_timeout
+        self.future = Future()
+        self.attempts = 0
+        self.started = None
+        self.sent = None
+        # Set once the vehicle answers MAV_RESULT_IN_PROGRESS.
+        self.in_progress = False
+        self.progress = None
+
+
+class CommandClient(object):
+    """
+    Sends ``COMMAND_LONG`` messages and matches them with their ``COMMAND_ACK``.
+
+    :param vehicle: The :py:class:`Vehicle` to command. Its receive thread delivers the
+        acknowledgements and calls :py:func:`tick` to resend unanswered commands.
+    :param timeout: Longest wait for an acknowledgement before a command is resent (shortened
+        to a few measured round trips, at least ``min_timeout``).
+    :param retries: Number of resends before the command fails with :py:class:`TimeoutError`.
+    :param progress_timeout: Longest wait for the final result after ``MAV_RESULT_IN_PROGRESS``.
+    :param slow_timeout: Resend timeout of :py:func:`send_slow` (never shortened).
+    :param slow_retries: Number of resends of :py:func:`send_slow`.
+    """
+
+    def __init__(self, vehicle, timeout=1.0, retries=3, progress_timeout=60.0, min_timeout=0.1,
+                 slow_timeout=10.0, slow_retries=1):
+        self._vehicle = vehicle
+        self.timeout = timeout
+        self.retries = retries
+        self.slow_timeout = slow_timeout
+        self.slow_retries = slow_retries
+        self.progress_timeout = progress_timeout
+        self.min_timeout = min_timeout
+        self._lock = threading.Lock()
+        # command id -> deque of _PendingCommand; the head is in flight.
+        self._queues = {}
+        self._rtt = None
+
+    @property
+    def in_flight(self):
+        """Ids of the commands currently waiting for their acknowledgement."""
+        with self._lock:
+            return sorted(self._queues)
+
+    @property
+    def round_trip(self):
+        """Smoothed seconds between sending a command and its first acknowledgement (``None`` until measured)."""
+        return self._rtt
+
+    def send(self, command, param1=0, param2=0, param3=0, param4=0, param5=0, param6=0, param7=0,
+             timeout=None, retries=None, progress_timeout=None, adaptive=True):
+        """
+        Send a ``COMMAND_LONG`` and return a future for its result.
+
+        The future resolves to a :py:class:`CommandResult` for any final answer (check
+        :py:attr:`CommandResult.accepted`), and raises :py:class:`TimeoutError` if the vehicle
+        never answers or :py:class:`APIException` if the connection is lost.
+
+        :param adaptive: Shorten the resend timeout to a few measured round trips. Pass ``False``
+            for commands the vehicle only acknowledges once their work is done (calibrations,
+            reboot), so they wait the full ``timeout`` before being resent.
+        """
+        pending = _PendingCommand(command, (param1, param2, param3, param4, param5, param6, param7),
+                                  self.timeout if timeout is None else timeout,
+                                  self.retries if retries is None else retries,
+                                  self.progress_timeout if progress_timeout is None else progress_timeout,
+                                  adaptive)
+        with self._lock:
+            queue = self._queues.get(command)
+            if queue is None:
+                self._queues[command] = collections.deque([pending])
+                self._transmit(pending, monotonic.monotonic())
+            else:
+                queue.append(pending)
+        return pending.future
+
+    def send_slow(self, command, *params, **kwargs):
+        """
+        :py:func:`send` for commands the vehicle only acknowledges once their work is done
+        (calibrations, reboot): the command is resent after ``slow_timeout`` rather than a few
+        round trips, so it is not repeated while the vehicle is still working on it.
+        """
+        kwargs.setdefault('timeout', self.slow_timeout)
+        kwargs.setdefault('retries', self.slow_retries)
+        return self.send(command, *params, adaptive=False, **kwargs)
+
+    def _resend_timeout(self, pending):
+        if self._rtt is None or not pending.adaptive:
+            return pending.timeout
+        return min(pending.timeout, max(self.min_timeout, 4 * self._rtt))
+
+    def _transmit(self, pending, now):
+        vehicle = self._vehicle
+        if pending.started is None:
+            pending.started = now
+        pending.sent = now
+        confirmation = min(pending.attempts, 255)
+        pending.attempts += 1
+        vehicle.send_mavlink(vehicle.message_factory.command_long_encode(
+            0, 0, pending.command, confirmation, *pending.params))
+
+    def _settle(self, pending, now, result=None, error=None):
+        # Called with the lock held; starts the next queued command with the same id. Returns a
+        # function resolving the future, to be called once the lock is released (done callbacks
+        # may send further commands).
+        queue = self._queues[pending.command]
+        queue.popleft()
+        if queue:
+            self._transmit(queue[0], now)
+        else:
+            del self._queues[pending.command]
+        if error is not None:
+            return lambda: pending.future.set_exception(error)
+        outcome = CommandResult(pending.command, result, now - pending.started, pending.attempts)
+        return lambda: pending.future.set_result(outcome)
+
+    def handle_ack(self, msg):
+        """Resolve the in-flight command acknowledged by ``msg`` (a ``COMMAND_ACK``)."""
+        now = monotonic.monotonic()
+        with self._lock:
+            queue = self._queues.get(msg.command)
+            if not queue:
+                return
+            pending = queue[0]
+            if not pending.in_progress and pending.attempts == 1:
+                # Only unambiguous samples: an answer to a resent command may be for either copy.
+                rtt = now - pending.sent
+                self._rtt = rtt if self._rtt is None else 0.875 * self._rtt + 0.125 * rtt
+            if msg.result == mavlink.MAV_RESULT_IN_PROGRESS:
+                # Accepted and running: no more resends, wait for the final answer.
+                pending.in_progress = True
+                pending.sent = now
+                pending.progress = getattr(msg, 'progress', None)
+                return
+            resolve = self._settle(pending, now, result=msg.result)
+        resolve()
+
+    def tick(self, now):
+        """Resend unanswered commands and fail those that ran out of retries."""
+        if not self._queues:
+            return
+        resolved = []
+        with self._lock:
+            for queue in list(self._queues.values()):
+                pending = queue[0]
+                if pending.in_progress:
+                    if now - pending.sent >= pending.progress_timeout:
+                        resolved.append(self._settle(pending, now, error=TimeoutError(
+                            'No final COMMAND_ACK for command %s after %s seconds in progress' %
+                            (pending.command, pending.progress_timeout))))
+                elif now - pending.sent >= self._resend_timeout(pending):
+                    if pending.attempts > pending.retries:
+                        resolved.append(self._settle(pending, now, error=TimeoutError(
+                            'No COMMAND_ACK for command %s after %d attempts' %
+                            (pending.command, pending.attempts))))
+                    else:
+                        self._transmit(pending, now)
+        for resolve in resolved:
+            resolve()
+
+    def cancel_all(self, error=None):
+        """Fail every queued and in-flight command (used when the connection is closed)."""
+        error = error or APIException('Connection closed before the command was acknowledged')
+        with self._lock:
+            queues, self._queues = self._queues, {}
+        for queue in queues.values():
+            for pending in queue:
+                if not pending.future.done():
+                    pending.future.set_exception(error)
@@ -0,0 +1,223 @@
+"""
+Fixed-memory telemetry history.
+
+A :py:class:`TelemetryHistory` records :py:class:`TelemetrySnapshot <dronekit.TelemetrySnapshot>`
+fields into preallocated ``array('d')`` columns used as a ring buffer: once ``capacity`` samples are
+stored the oldest ones are overwritten, so memory stays at ``8 * capacity * (len(fields) + 1)``
+bytes however long the vehicle flies.
+
+History is off by default. :py:func:`Vehicle.enable_history <dronekit.Vehicle.enable_history>`
+creates one that records the vehicle's snapshot from its receive thread:
+
+.. code:: python
+
+    history = vehicle.enable_history(seconds=600, rate=5)
+
+    # Everything from the last 30 seconds.
+    recent = history.window(30)
+    print(recent['time'][-1], recent['lat'][-1], recent['lon'][-1])
+
+    # The last 10 minutes averaged into at most 200 points, for a chart.
+    chart = history.downsample(600, 200, fields=('alt', 'battery_voltage'))
+"""
+
+import math
+import threading
+import time
+from array import array
+
+import monotonic
+
+from app.libs.dronekit import TelemetrySnapshot
+
+# Fields recorded when none are given: a trail (position, speed, attitude) and the battery.
+HISTORY_FIELDS = ('lat', 'lon', 'alt', 'groundspeed', 'battery_voltage', 'pitch', 'roll', 'yaw')
+
+# Snapshot fields that cannot be stored as floats (or are stored anyway, as ``time``).
+_NOT_RECORDABLE = ('mode', 'time')
+
+_NAN = float('nan')
+
+
+def _listed(column):
+    # NaN marks a missing value in the columns; callers (and JSON) get None instead.
+    return [None if value != value else value for value in column]
+
+
+class TelemetryHistory(object):
+    """
+    The last ``capacity`` telemetry samples, one ``array('d')`` column per field.
+
+    Samples are added by :py:func:`record` (one writer) and read by the query methods from any
+    thread. Times are wall-clock seconds (``time.time()``) derived from the monotonic snapshot
+    times, so they stay increasing even if the system clock is adjusted while recording.
+
+    :param capacity: Number of samples kept.
+    :param fields: :py:class:`TelemetrySnapshot <dronekit.TelemetrySnapshot>` fields to record
+        (default :py:const:`HISTORY_FIELDS`). Missing values are stored as NaN.
+    :param interval: Minimum seconds between two recorded samples.
+    """
+
+    def __init__(self, capacity, fields=HISTORY_FIELDS, interval=0.0):
+        if capacity < 1:
+            raise ValueError('History capacity must be at least 1')
+        for field in fields:
+            if field not in TelemetrySnapshot._fields or field in _NOT_RECORDABLE:
+                raise ValueError('Not a recordable telemetry field: %s' % field)
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self.interval = interval
+        self._indices = tuple(TelemetrySnapshot._fields.index(field) for field in self.fields)
+        self._time = array('d', [_NAN]) * capacity
+        self._columns = tuple(array('d', [_NAN]) * capacity for _ in self.fields)
+        self._head = 0
+        self._count = 0
+        self._last = None
+        self._offset = time.time() - monotonic.monotonic()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self):
+        """Memory used by the columns, in bytes (fixed at creation)."""
+        return self._time.itemsize * self.capacity * (len(self._columns) + 1)
+
+    def record(self, snapshot):
+        """
+        Store ``snapshot`` unless it is no newer than ``interval`` after the last stored sample.
+
+        :returns: ``True`` if the sample was stored.
+        """
+        stamp = snapshot.time
+        if stamp is None or (self._last is not None and
+                             (stamp <= self._last or stamp - self._last < self.interval)):
+            return False
+        with self._lock:
+            self._last = stamp
+            slot = self._head
+            self._time[slot] = stamp + self._offset
+            for column, index in zip(self._columns, self._indices):
+                value = snapshot[index]
+                column[slot] = _NAN if value is None else value
+            self._head = (slot + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+        return True
+
+    def clear(self):
+        """Drop every stored sample."""
+        with self._lock:
+            self._head = 0
+            self._count = 0
+            self._last = None
+
+    def _columns_for(self, fields):
+        if fields is None:
+            return self.fields, self._columns
+        columns = []
+        for field in fields:
+            if field not in self.fields:
+                raise ValueError('Field is not recorded: %s' % field)
+            columns.append(self._columns[self.fields.index(field)])
+        return tuple(fields), columns
+
+    def _start(self, since):
+        # First logical position (0 = oldest) whose time is >= since; times increase in ring order.
+        first = self._head - self._count
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._time[(first + middle) % self.capacity] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _copy(self, columns, since):
+        # Chronological copies of the time column and ``columns`` from ``since`` on, as arrays.
+        with self._lock:
+            start = self._start(since) if since is not None else 0
+            count = self._count - start
+            first = (self._head - self._count + start) % self.capacity
+            end = first + count
+            copies = []
+            for column in (self._time,) + tuple(columns):
+                if end <= self.capacity:
+                    copies.append(column[first:end])
+                else:
+                    copies.append(column[first:] + column[:end - self.capacity])
+        return copies
+
+    def _since(self, seconds, now):
+        if seconds is None:
+            return None
+        return (time.time() if now is None else now) - seconds
+
+    def window(self, seconds=None, fields=None, now=None):
+        """
+        Every stored sample of the last ``seconds`` (all of them if ``None``).
+
+        :param fields: Fields to return (default: all recorded fields).
+        :param now: Wall-clock time the window ends at (default: now).
+        :returns: ``{'time': [...], field: [...]}``, oldest first, ``None`` for missing values.
+        """
+        names, columns = self._columns_for(fields)
+        copies = self._copy(columns, self._since(seconds, now))
+        result = {'time': copies[0].tolist()}
+        for name, column in zip(names, copies[1:]):
+            result[name] = _listed(column)
+        return result
+
+    def downsample(self, seconds, points, fields=None, now=None, how='mean'):
+        """
+        The last ``seconds`` reduced to at most ``points`` samples.
+
+        The window is cut into ``points`` equal time buckets and each non-empty bucket becomes
+        one sample: the average of its samples (``how='mean'``, missing values ignored) or its
+        most recent sample (``how='last'``, e.g. for angles that wrap around). Windows holding no
+        more than ``points`` samples are returned as stored.
+
+        :returns: The same layout as :py:func:`window`.
+        """
+        if points < 1:
+            raise ValueError('points must be at least 1')
+        if how not in ('mean', 'last'):
+            raise ValueError('Unknown downsampling: %s' % how)
+        names, columns = self._columns_for(fields)
+        copies = self._copy(columns, self._since(seconds, now))
+        times, values = copies[0], copies[1:]
+        if len(times) <= points:
+            result = {'time': times.tolist()}
+            for name, column in zip(names, values):
+                result[name] = _listed(column)
+            return result
+
+        start, end = times[0], times[-1]
+        width = (end - start) / points or 1.0
+        buckets = [min(int((stamp - start) / width), points - 1) for stamp in times]
+        result = {'time': []}
+        for name in names:
+            result[name] = []
+        if how == 'last':
+            for position in range(len(times)):
+                if position + 1 == len(times) or buckets[position + 1] != buckets[position]:
+                    result['time'].append(times[position])
+                    for name, column in zip(names, values):
+                        result[name].append(column[position])
+        else:
+            position = 0
+            while position < len(times):
+                bucket = buckets[position]
+                stop = position
+                while stop < len(times) and buckets[stop] == bucket:
+                    stop += 1
+                result['time'].append(math.fsum(times[position:stop]) / (stop - position))
+                for name, column in zip(names, values):
+                    present = [value for value in column[position:stop] if value == value]
+                    result[name].append(math.fsum(present) / len(present) if present else _NAN)
+                position = stop
+        for name in names:
+            result[name] = _listed(result[name])
+        return result
@@ -0,0 +1,180 @@
+"""
+Per-vehicle filtering of incoming MAVLink traffic.
+
+An :py:class:`IngestPolicy` decides, by message id, which messages a connection decodes and
+dispatches to its :py:class:`Vehicle <dronekit.Vehicle>`. On datagram links it is applied to the
+raw frame headers, so rejected messages are never unpacked into Python objects.
+
+.. code:: python
+
+    from dronekit.ingest import IngestPolicy
+
+    # Keep only what the vehicle listens to, and ATTITUDE at no more than 10 Hz.
+    vehicle.set_ingest_policy(IngestPolicy.consumed_by(vehicle, rates={'ATTITUDE': 10}))
+"""
+
+import time
+
+from pymavlink import mavutil
+
+# Protocol traffic the vehicle cannot work without (connection, parameters, commands, missions).
+ALWAYS_ACCEPTED = ('HEARTBEAT', 'COMMAND_ACK', 'PARAM_VALUE', 'AUTOPILOT_VERSION',
+                   'HOME_POSITION', 'STATUSTEXT')
+
+_MAVLINK_V1_STX = 0xFE
+_MAVLINK_V2_STX = 0xFD
+_MAVLINK_V2_SIGNATURE_LEN = 13
+
+
+def _message_ids():
+    return dict((cls.msgname, msgid) for msgid, cls in mavutil.mavlink.mavlink_map.items())
+
+
+def _resolve(messages, ids):
+    resolved = set()
+    for message in messages or ():
+        if isinstance(message, int):
+            resolved.add(message)
+        elif message in ids:
+            resolved.add(ids[message])
+        else:
+            raise ValueError('Unknown MAVLink message: %s' % message)
+    return resolved
+
+
+class IngestPolicy(object):
+    """
+    Which incoming messages are decoded and dispatched, by message name or id.
+
+    :py:const:`ALWAYS_ACCEPTED` messages and the ``MISSION_*`` protocol are let through regardless
+    of the policy, so connecting, parameter download, commands and mission transfer keep working.
+
+    :param allow: If given, only these messages are accepted.
+    :param deny: Messages that are always dropped.
+    :param rates: ``{message: max Hz}``. Messages arriving faster are decimated to that rate
+        (a rate of 0 drops the message).
+
+    A policy belongs to a single connection: decimation state is kept on the instance.
+    """
+
+    def __init__(self, allow=None, deny=None, rates=None):
+        ids = _message_ids()
+        self._always = frozenset(_resolve(ALWAYS_ACCEPTED, ids) |
+                                 set(msgid for name, msgid in ids.items() if name.startswith('MISSION_')))
+        self._allow = None if allow is None else frozenset(_resolve(allow, ids))
+        deny = _resolve(deny, ids)
+        self._intervals = {}
+        for message, rate in (rates or {}).items():
+            for msgid in _resolve([message], ids):
+                if rate > 0:
+                    self._intervals[msgid] = 1.0 / rate
+                else:
+                    deny.add(msgid)
+        self._deny = frozenset(deny)
+        # Message id -> earliest time the next one is accepted.
+        self._due = {}
+        self.dropped = 0
+
+    @classmethod
+    def consumed_by(cls, vehicle, rates=None, deny=None):
+        """
+        A policy accepting only the messages ``vehicle`` has message listeners for.
+
+        Listeners added afterwards are not taken into account. If the vehicle has a
+        ``'*'`` listener every message is accepted (only ``rates`` and ``deny`` apply).
+        """
+        names = list(vehicle._message_listeners)
+        if '*' in names:
+            return cls(deny=deny, rates=rates)
+        ids = _message_ids()
+        return cls(allow=[name for name in names if name in ids], deny=deny, rates=rates)
+
+    def accept(self, msgid, now):
+        """Whether to keep a message with id ``msgid`` received at ``now`` (``time.monotonic()``)."""
+        if msgid in self._always:
+            return True
+        if (self._allow is not None and msgid not in self._allow) or msgid in self._deny:
+            self.dropped += 1
+            return False
+        interval = self._intervals.get(msgid)
+        if interval is None:
+            return True
+        due = self._due.get(msgid, 0.0)
+        if now < due:
+            self.dropped += 1
+            return False
+        # Keep the average rate under jitter, but don't let a long gap turn into a burst.
+        self._due[msgid] = due + interval if now - due < interval else now + interval
+        return True
+
+    def accept_message(self, msg):
+        """:py:func:`accept` for an already decoded message."""
+        return self.accept(msg.get_msgId(), time.monotonic())
+
+
+def split_frames(data):
+    """
+    Split a buffer of complete MAVLink v1/v2 frames into ``(start, end, sysid, msgid)`` tuples.
+
+    Only the headers are read. Returns ``None`` if ``data`` is not exactly a sequence of frames
+    (garbage, or a frame cut at a read boundary).
+    """
+    frames = []
+    i, n = 0, len(data)
+    while i < n:
+        stx = data[i]
+        if stx == _MAVLINK_V2_STX:
+            if i + 10 > n:
+                return None
+            end = i + 12 + data[i + 1]
+            if data[i + 2] & 1:
+                end += _MAVLINK_V2_SIGNATURE_LEN
+            sysid = data[i + 5]
+            msgid = data[i + 7] | data[i + 8] << 8 | data[i + 9] << 16
+        elif stx == _MAVLINK_V1_STX:
+            if i + 6 > n:
+                return None
+            end = i + 8 + data[i + 1]
+            sysid = data[i + 3]
+            msgid = data[i + 5]
+        else:
+            return None
+        if end > n:
+            return None
+        frames.append((i, end, sysid, msgid))
+        i = end
+    return frames
+
+
+def parse_filtered(mav, data, policy_for, now=None):
+    """
+    Parse ``data`` with the ``MAVLink`` parser ``mav``, keeping only the messages that
+    ``policy_for(sysid)`` accepts (a ``None`` policy accepts everything).
+
+    When the parser holds no partial frame and ``data`` splits into whole frames, rejected
+    frames are removed before decoding. Otherwise everything is decoded and filtered afterwards.
+
+    ``now`` is the receive time used for decimation (defaults to ``time.monotonic()``).
+    """
+    if now is None:
+        now = time.monotonic()
+    frames = split_frames(data) if mav.buf_len() == 0 else None
+    if frames is None:
+        msgs = mav.parse_buffer(data) or []
+        kept = []
+        for msg in msgs:
+            policy = policy_for(msg.get_srcSystem())
+            if policy is None or policy.accept(msg.get_msgId(), now):
+                kept.append(msg)
+        return kept
+
+    kept = []
+    for start, end, sysid, msgid in frames:
+        policy = policy_for(sysid)
+        if policy is None or policy.accept(msgid, now):
+            kept.append((start, end))
+    if not kept:
+        return []
+    if len(kept) < len(frames):
+        data = b''.join([data[start:end] for start, end in kept])
+    return mav.parse_buffer(data) or []
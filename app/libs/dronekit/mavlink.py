@@ -9,9 +9,11 @@ import os
 import platform
 import copy
 from app.libs.dronekit import APIException
+from app.libs.dronekit.ingest import parse_filtered
 from pymavlink import mavutil
+from collections import OrderedDict
 from queue import Queue, Empty
-from threading import Thread
+from threading import Lock, Thread
 
 if platform.system() == 'Windows':
     from errno import WSAECONNRESET as ECONNABORTED
@@ -39,6 +41,10 @@ class MAVWriter(object):
 
 class mavudpin_multi(mavutil.mavfile):
     '''a UDP mavlink socket'''
+
+    # Largest UDP payload; the receive buffer is allocated once per socket.
+    recv_buffer_size = 65535
+
     def __init__(self, device, baud=None, input=True, broadcast=False, source_system=255, source_component=0, use_native=mavutil.default_native):
         self._logger = logging.getLogger(__name__)
         a = device.split(':')
@@ -59,6 +65,8 @@ class mavudpin_multi(mavutil.mavfile):
                 self.broadcast = True
         mavutil.set_close_on_exec(self.port.fileno())
         self.port.setblocking(False)
+        self._recv_buf = bytearray(self.recv_buffer_size)
+        self._recv_view = memoryview(self._recv_buf)
         mavutil.mavfile.__init__(self, self.port.fileno(), device, source_system=source_system, source_component=source_component, input=input, use_native=use_native)
 
     def close(self):
@@ -110,17 +118,368 @@ class mavudpin_multi(mavutil.mavfile):
 
         return m
 
+    def recv_batches(self, policy_for=None):
+        '''read every pending datagram, yielding (sender address, parsed messages) for each
+
+        policy_for(sysid) returns the IngestPolicy for frames from that system (or None); rejected
+        frames are dropped before decoding'''
+        while True:
+            try:
+                n, new_addr = self.port.recvfrom_into(self._recv_buf)
+            except socket.error as e:
+                if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    return
+                if e.errno == errno.ECONNREFUSED:
+                    continue
+                raise
+            if self.udp_server:
+                self.addresses.add(new_addr)
+            elif self.broadcast:
+                self.addresses = {new_addr}
+
+            data = self._recv_view[:n]
+            if n > 0 and self.first_byte:
+                self.auto_mavlink_version(data)
+            try:
+                if policy_for is None:
+                    parsed = self.mav.parse_buffer(data)
+                else:
+                    parsed = parse_filtered(self.mav, data, policy_for)
+            except mavutil.mavlink.MAVError as e:
+                self._logger.debug('mav recv error: %s' % str(e))
+                continue
+            if parsed:
+                yield new_addr, parsed
+
+    def recv_msgs(self, policy_for=None):
+        '''read every pending datagram and return all the messages they contain'''
+        msgs = []
+        for _, parsed in self.recv_batches(policy_for):
+            for m in parsed:
+                self.post_message(m)
+            msgs.extend(parsed)
+        return msgs
+
+
+class mavmux_channel(mavutil.mavfile):
+    '''one vehicle (MAVLink system id) behind a shared MAVUDPMultiplexer socket'''
+    def __init__(self, mux, sysid, address, source_system=255, source_component=0, use_native=mavutil.default_native):
+        self._mux = mux
+        self._sysid = sysid
+        self._use_native = use_native
+        mavutil.mavfile.__init__(self, None, address, source_system=source_system, source_component=source_component, input=False, use_native=use_native)
+
+    def follow_protocol(self, msg):
+        '''take the wire protocol of a frame the multiplexer decoded, answering MAVLink2 frames in MAVLink2'''
+        self.first_byte = False
+        if self.WIRE_PROTOCOL_VERSION == '2.0' or msg.get_msgbuf()[0] != mavutil.mavlink.PROTOCOL_MARKER_V2:
+            return
+        # The multiplexer decoded a MAVLink2 frame, so the loaded dialect is already the MAVLink2 one.
+        self.mav = mavutil.mavlink.MAVLink(self, srcSystem=self.source_system, srcComponent=self.source_component, use_native=self._use_native)
+        self.mav.robust_parsing = self.robust_parsing
+        self.WIRE_PROTOCOL_VERSION = mavutil.mavlink.WIRE_PROTOCOL_VERSION
+
+    def write(self, buf):
+        self._mux.sendto(self._sysid, buf)
+
+    def recv(self, n=None):
+        return b''
+
+    def close(self):
+        pass
+
+
+class MAVUDPMultiplexer(object):
+    """
+    A single listening UDP socket shared by many vehicles.
+
+    Incoming frames are routed to the attached :py:class:`MAVMuxConnection` by MAVLink source
+    system id, and replies are sent back to the address each system was last heard from. One
+    thread serves the socket and runs the loop listeners of every attached vehicle.
+
+    Use :py:func:`get` to share one instance per listening address.
+    """
+
+    # Vehicles heard but not attached yet that are remembered (most recent first), so a vehicle
+    # attaching later can be answered and initialized at once. Other traffic from unattached
+    # systems (ground stations, strays) is not recorded.
+    max_unattached_systems = 64
+
+    _instances = {}
+    _instances_lock = Lock()
+
+    def __init__(self, device, source_system=255, source_component=0, use_native=False):
+        self._logger = logging.getLogger(__name__)
+        self.device = device
+        self.master = mavudpin_multi(device, input=True, source_system=source_system, source_component=source_component, use_native=use_native)
+
+        # Copy-on-write so the receive thread can iterate without locking.
+        self._channels = {}
+        self._channels_lock = Lock()
+
+        # Last address each attached system was heard from.
+        self._peers = {}
+        # Last address and heartbeat of vehicles heard but not attached, oldest first.
+        self._unattached = OrderedDict()
+
+        self._alive = True
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @classmethod
+    def get(cls, device, **kwargs):
+        with cls._instances_lock:
+            mux = cls._instances.get(device)
+            if mux is None or not mux._alive:
+                mux = cls(device, **kwargs)
+                cls._instances[device] = mux
+            return mux
+
+    @property
+    def systems(self):
+        """System ids of the attached vehicles heard so far and of the unattached vehicles heard recently."""
+        with self._channels_lock:
+            return sorted(set(self._peers) | set(self._unattached))
+
+    def attach(self, channel):
+        sysid = channel.target_system
+        with self._channels_lock:
+            if sysid in self._channels:
+                raise APIException('System id %s is already attached to %s' % (sysid, self.device))
+            channels = dict(self._channels)
+            channels[sysid] = channel
+            self._channels = channels
+            heard = self._unattached.pop(sysid, None)
+        if heard is not None:
+            addr, heartbeat = heard
+            self._peers.setdefault(sysid, addr)
+            # Replay the last heartbeat so the vehicle initializes without waiting for the next one.
+            channel._replay.append(heartbeat)
+
+    def detach(self, channel):
+        with self._channels_lock:
+            if self._channels.get(channel.target_system) is not channel:
+                return
+            channels = dict(self._channels)
+            del channels[channel.target_system]
+            self._channels = channels
+            self._peers.pop(channel.target_system, None)
+
+    def sendto(self, sysid, buf):
+        addr = self._peers.get(sysid)
+        if addr is None:
+            return
+        try:
+            self.master.port.sendto(buf, addr)
+        except socket.error:
+            pass
+
+    def _run(self):
+        try:
+            while self._alive:
+                for channel in self._channels.values():
+                    channel._tick()
+
+                self.master.select(0.05)
+
+                channels = self._channels
+                policy_for = None
+                if any(channel.ingest_policy is not None for channel in channels.values()):
+                    policy_for = self._policy_for
+                for addr, parsed in self.master.recv_batches(policy_for):
+                    for msg in parsed:
+                        sysid = msg.get_srcSystem()
+                        channel = channels.get(sysid)
+                        if channel is not None:
+                            self._peers[sysid] = addr
+                            channel._deliver(msg)
+                        elif msg.get_type() == 'HEARTBEAT' and self.master.probably_vehicle_heartbeat(msg):
+                            self._remember_unattached(sysid, addr, msg)
+        except Exception:
+            if self._alive:
+                self._logger.exception('Exception in MAVLink multiplexer loop', exc_info=True)
+                self._alive = False
+                for channel in self._channels.values():
+                    channel._die(APIException('Multiplexed UDP socket %s failed' % self.device))
+                self.master.close()
+
+    def _remember_unattached(self, sysid, addr, heartbeat):
+        with self._channels_lock:
+            if sysid in self._channels:
+                # Attached since this batch started; its next message records the address.
+                return
+            self._unattached.pop(sysid, None)
+            self._unattached[sysid] = (addr, heartbeat)
+            while len(self._unattached) > self.max_unattached_systems:
+                self._unattached.popitem(last=False)
+
+    def _policy_for(self, sysid):
+        channel = self._channels.get(sysid)
+        return None if channel is None else channel.ingest_policy
+
+    def close(self):
+        self._alive = False
+        self._thread.join()
+        self.master.close()
+        with self._instances_lock:
+            if self._instances.get(self.device) is self:
+                del self._instances[self.device]
+
+
+class MAVMuxConnection(object):
+    """
+    A vehicle attached to a shared :py:class:`MAVUDPMultiplexer` (``udpmux:host:port``).
+
+    It offers the same interface as :py:class:`MAVConnection` but owns no socket or thread, so
+    attaching another vehicle to a receiver that is already running is immediate.
+    """
+
+    def __init__(self, ip, baud=115200, target_system=0, source_system=255, source_component=0, use_native=False):
+        self._logger = logging.getLogger(__name__)
+        if not target_system:
+            raise APIException('udpmux connections need the vehicle system id (target_system)')
+        if not ip.startswith('udpmux:'):
+            raise APIException('Expected a udpmux:host:port connection string')
+
+        self._mux = MAVUDPMultiplexer.get(ip[7:], source_system=source_system, source_component=source_component, use_native=use_native)
+        self.master = mavmux_channel(self._mux, target_system, ip, source_system=source_system, source_component=source_component, use_native=use_native)
+        self._patch_send()
+
+        # Targets
+        self.target_system = target_system
+
+        # Listeners.
+        self.loop_listeners = []
+        self.message_listeners = []
+
+        self._accept_input = True
+        self._alive = True
+        self._death_error = None
+        self._replay = []
+
+        # IngestPolicy applied by the multiplexer to this system's frames (None accepts everything).
+        self.ingest_policy = None
+
+    def _patch_send(self):
+        # Monkey-patch MAVLink object for fix_targets.
+        mav = self.master.mav
+        sendfn = mav.send
+
+        def newsendfn(mavmsg, *args, **kwargs):
+            self.fix_targets(mavmsg)
+            return sendfn(mavmsg, *args, **kwargs)
+
+        mav.send = newsendfn
+        self._patched_mav = mav
+
+    def _deliver(self, msg):
+        # Runs on the multiplexer thread.
+        if not self._alive or not self._accept_input:
+            return
+        if self.master.first_byte:
+            self.master.follow_protocol(msg)
+            if self.master.mav is not self._patched_mav:
+                self._patch_send()
+        self.master.post_message(msg)
+        for fn in self.message_listeners:
+            try:
+                fn(self, msg)
+            except Exception:
+                self._logger.exception(
+                    'Exception in message handler for %s' % msg.get_type(),
+                    exc_info=True
+                )
+
+    def _tick(self):
+        # Runs on the multiplexer thread.
+        if not self._alive:
+            return
+        while self._replay:
+            self._deliver(self._replay.pop(0))
+        # A failing listener only affects this vehicle, never the shared socket.
+        for fn in self.loop_listeners:
+            try:
+                fn(self)
+            except APIException as e:
+                self._logger.exception('Exception in MAVLink loop listener')
+                self._die(e)
+                return
+            except Exception:
+                self._logger.exception('Exception in MAVLink loop listener', exc_info=True)
+
+    def _die(self, error):
+        self._alive = False
+        self._death_error = error
+        self._mux.detach(self)
+
+    def fix_targets(self, message):
+        """Set correct target IDs for our vehicle"""
+        if hasattr(message, 'target_system'):
+            message.target_system = self.target_system
+
+    def forward_loop(self, fn):
+        """
+        Decorator for event loop.
+        """
+        self.loop_listeners.append(fn)
+
+    def forward_message(self, fn):
+        """
+        Decorator for message inputs.
+        """
+        self.message_listeners.append(fn)
+
+    def start(self):
+        self._mux.attach(self)
+
+    def reset(self):
+        pass
+
+    def close(self):
+        self._alive = False
+        self._mux.detach(self)
+
+
+# Wakes the writer thread up when the connection is closed.
+_STOP = object()
+
 
 class MAVConnection(object):
 
+    # Upper bound for packets coalesced into a single write, so a batch
+    # still fits in one UDP datagram without IP fragmentation.
+    write_batch_bytes = 1400
+
     def stop_threads(self):
         if self.mavlink_thread_in is not None:
             self.mavlink_thread_in.join()
             self.mavlink_thread_in = None
         if self.mavlink_thread_out is not None:
+            self.out_queue.put(_STOP)
             self.mavlink_thread_out.join()
             self.mavlink_thread_out = None
 
+    def _write_batch(self, batch):
+        if not batch:
+            return
+        try:
+            self.master.write(b''.join(batch))
+        except socket.error as error:
+            # If connection reset (closed), stop polling.
+            if error.errno == ECONNABORTED:
+                raise APIException('Connection aborting during read')
+            raise
+        except Exception as e:
+            self._logger.exception('mav send error: %s' % str(e))
+
+    def _drain_queue(self):
+        while True:
+            try:
+                self.out_queue.get_nowait()
+            except Empty:
+                return
+
     def __init__(self, ip, baud=115200, target_system=0, source_system=255, source_component=0, use_native=False):
         self._logger = logging.getLogger(__name__)
 
@@ -159,6 +518,9 @@ class MAVConnection(object):
         self._alive = True
         self._death_error = None
 
+        # IngestPolicy for incoming messages (None accepts everything).
+        self.ingest_policy = None
+
         import atexit
 
         def onexit():
@@ -170,19 +532,31 @@ class MAVConnection(object):
         def mavlink_thread_out():
             # Huge try catch in case we see http://bugs.python.org/issue1856
             try:
-                while self._alive:
-                    try:
-                        msg = self.out_queue.get(True, timeout=0.01)
-                        self.master.write(msg)
-                    except Empty:
-                        continue
-                    except socket.error as error:
-                        # If connection reset (closed), stop polling.
-                        if error.errno == ECONNABORTED:
-                            raise APIException('Connection aborting during read')
-                        raise
-                    except Exception as e:
-                        self._logger.exception('mav send error: %s' % str(e))
+                while True:
+                    # Block until there is something to send, then drain everything
+                    # queued meanwhile and write it in as few calls as possible.
+                    msg = self.out_queue.get()
+                    if msg is _STOP:
+                        break
+                    batch = [msg]
+                    size = len(msg)
+                    stop = False
+                    while True:
+                        try:
+                            msg = self.out_queue.get_nowait()
+                        except Empty:
+                            break
+                        if msg is _STOP:
+                            stop = True
+                            break
+                        if size + len(msg) > self.write_batch_bytes:
+                            self._write_batch(batch)
+                            batch = []
+                            size = 0
+                        batch.append(msg)
+                        size += len(msg)
+                    self._write_batch(batch)
+                    if stop or not self._alive:
                         break
             except APIException as e:
                 self._logger.exception("Exception in MAVLink write loop", exc_info=True)
@@ -200,7 +574,18 @@ class MAVConnection(object):
                     self._death_error = e
 
             # Explicitly clear out buffer so .close closes.
-            self.out_queue = Queue()
+            self._drain_queue()
+
+        def dispatch(msg):
+            # Message listeners.
+            for fn in self.message_listeners:
+                try:
+                    fn(self, msg)
+                except Exception:
+                    self._logger.exception(
+                        'Exception in message handler for %s' % msg.get_type(),
+                        exc_info=True
+                    )
 
         def mavlink_thread_in():
             # Huge try catch in case we see http://bugs.python.org/issue1856
@@ -213,6 +598,23 @@ class MAVConnection(object):
                     # Sleep
                     self.master.select(0.05)
 
+                    if not self._accept_input:
+                        continue
+
+                    policy = self.ingest_policy
+                    if hasattr(self.master, 'recv_msgs'):
+                        # Drain every datagram queued in the kernel in one wakeup.
+                        try:
+                            msgs = self.master.recv_msgs(None if policy is None else lambda sysid: policy)
+                        except socket.error as error:
+                            # If connection reset (closed), stop polling.
+                            if error.errno == ECONNABORTED:
+                                raise APIException('Connection aborting during send')
+                            raise
+                        for msg in msgs:
+                            dispatch(msg)
+                        continue
+
                     while self._accept_input:
                         try:
                             msg = self.master.recv_msg()
@@ -234,15 +636,9 @@ class MAVConnection(object):
                         if not msg:
                             break
 
-                        # Message listeners.
-                        for fn in self.message_listeners:
-                            try:
-                                fn(self, msg)
-                            except Exception:
-                                self._logger.exception(
-                                    'Exception in message handler for %s' % msg.get_type(),
-                                    exc_info=True
-                                )
+                        if policy is not None and not policy.accept_message(msg):
+                            continue
+                        dispatch(msg)
 
             except APIException as e:
                 self._logger.exception('Exception in MAVLink input loop')
@@ -269,7 +665,7 @@ class MAVConnection(object):
         self.mavlink_thread_out = t
 
     def reset(self):
-        self.out_queue = Queue()
+        self._drain_queue()
         if hasattr(self.master, 'reset'):
             self.master.reset()
         else:
@@ -303,10 +699,12 @@ class MAVConnection(object):
             self.mavlink_thread_out.start()
 
     def close(self):
-        # TODO this can block forever if parameters continue to be added
+        # Let the writer flush what is already queued before it exits.
+        if self.mavlink_thread_out is not None:
+            self.out_queue.put(_STOP)
+            self.mavlink_thread_out.join()
+            self.mavlink_thread_out = None
         self._alive = False
-        while not self.out_queue.empty():
-            time.sleep(0.1)
         self.stop_threads()
         self.master.close()
 
@@ -0,0 +1,446 @@
+"""
+Mission transfer over the MAVLink mission protocol.
+
+:py:class:`MissionUpload` sends a list of mission items in one pass. Each ``MISSION_REQUEST`` /
+``MISSION_REQUEST_INT`` is answered from the receive thread as soon as it arrives, a stalled
+transfer is nudged by resending the last message, and the upload completes on ``MISSION_ACK``.
+It is used by :py:func:`CommandSequence.upload <dronekit.CommandSequence.upload>`.
+
+Items are sent as ``MISSION_ITEM_INT`` (latitude/longitude as 1e7 integers, so no precision is lost
+to single precision floats) when the vehicle requests them that way or reports the
+``MISSION_INT`` capability, and as ``MISSION_ITEM`` otherwise.
+"""
+
+import hashlib
+import struct
+import threading
+
+import monotonic
+from pymavlink import mavutil
+
+from app.libs.dronekit import APIException, Command, TimeoutError
+
+mavlink = mavutil.mavlink
+
+# Frames whose x/y are latitude/longitude (sent as degrees * 1e7 in MISSION_ITEM_INT).
+_GLOBAL_FRAMES = frozenset(getattr(mavlink, name) for name in (
+    'MAV_FRAME_GLOBAL', 'MAV_FRAME_GLOBAL_RELATIVE_ALT', 'MAV_FRAME_GLOBAL_INT',
+    'MAV_FRAME_GLOBAL_RELATIVE_ALT_INT', 'MAV_FRAME_GLOBAL_TERRAIN_ALT',
+    'MAV_FRAME_GLOBAL_TERRAIN_ALT_INT') if hasattr(mavlink, name))
+# Frames whose x/y are local positions in metres (sent as metres * 1e4).
+_LOCAL_FRAMES = frozenset(getattr(mavlink, name) for name in (
+    'MAV_FRAME_LOCAL_NED', 'MAV_FRAME_LOCAL_ENU', 'MAV_FRAME_LOCAL_OFFSET_NED',
+    'MAV_FRAME_BODY_NED', 'MAV_FRAME_BODY_OFFSET_NED') if hasattr(mavlink, name))
+
+
+class MissionTransferError(APIException):
+    """
+    Raised when the vehicle rejects a mission transfer.
+
+    ``result`` is the ``MAV_MISSION_RESULT`` from the vehicle's ``MISSION_ACK``.
+    """
+
+    def __init__(self, message, result=None):
+        super(MissionTransferError, self).__init__(message)
+        self.result = result
+
+
+def mission_result_name(result):
+    """Name of a ``MAV_MISSION_RESULT`` value, e.g. ``'MAV_MISSION_INVALID_SEQUENCE'``."""
+    entry = mavlink.enums['MAV_MISSION_RESULT'].get(result)
+    return entry.name if entry is not None else str(result)
+
+
+def mission_fingerprint(items):
+    """
+    Hash of a list of mission items, as a hex string.
+
+    Items are compared as they travel in ``MISSION_ITEM_INT`` (scaled integer coordinates, single
+    precision parameters), so a mission hashes the same whether it was built locally or
+    downloaded from the vehicle.
+    """
+    digest = hashlib.sha1()
+    for item in items:
+        x, y = item_int_coordinates(item)
+        digest.update(struct.pack('<HHBffffiif', item.command, item.frame, item.autocontinue,
+                                  item.param1, item.param2, item.param3, item.param4, x, y, item.z))
+    return digest.hexdigest()
+
+
+def request_mission_count(vehicle, timeout=1.0, retries=2):
+    """
+    Ask the vehicle how many mission items it holds.
+
+    :returns: ``(count, opaque_id)``, where ``opaque_id`` is the mission id from ``MISSION_COUNT``
+        or ``None`` if the firmware (or the MAVLink dialect) does not provide one.
+    :raises TimeoutError: if the vehicle does not answer.
+    """
+    master = vehicle._master
+    answered = threading.Event()
+    answers = []
+
+    def listener(_, name, msg):
+        answers.append(msg)
+        answered.set()
+
+    vehicle.add_message_listener('MISSION_COUNT', listener)
+    try:
+        for _ in range(retries + 1):
+            master.mav.mission_request_list_send(master.target_system, master.target_component)
+            if answered.wait(timeout):
+                break
+        else:
+            raise TimeoutError('Vehicle did not report its mission count.')
+    finally:
+        vehicle.remove_message_listener('MISSION_COUNT', listener)
+    # End the download the request started.
+    master.mav.mission_ack_send(master.target_system, master.target_component, mavlink.MAV_MISSION_ACCEPTED)
+    msg = answers[0]
+    return msg.count, getattr(msg, 'opaque_id', None) or None
+
+
+def item_int_coordinates(item):
+    """``(x, y)`` of a ``MISSION_ITEM`` scaled to ``MISSION_ITEM_INT`` integers for its frame."""
+    if item.frame in _GLOBAL_FRAMES:
+        scale = 1e7
+    elif item.frame in _LOCAL_FRAMES:
+        scale = 1e4
+    else:
+        scale = 1
+    return int(round(item.x * scale)), int(round(item.y * scale))
+
+
+class MissionUpload(object):
+    """
+    Upload ``items`` (``MISSION_ITEM`` messages or :py:class:`Command` objects, home first) to
+    ``vehicle``.
+
+    :param timeout: Longest wait for a request or acknowledgement before the last message is
+        resent. Once round trips have been measured the wait is shortened to a few round trip
+        times (at least ``min_timeout``).
+    :param retries: Number of consecutive resends before the transfer is abandoned.
+    :param progress: Called as ``progress(sent, total)`` each time a new item is sent (from the
+        receive thread, so it should return quickly).
+    :param start: With ``end``, only send items ``start`` to ``end`` (inclusive) using
+        ``MISSION_WRITE_PARTIAL_LIST``. The vehicle must already hold a mission of the same size.
+    """
+
+    def __init__(self, vehicle, items, timeout=1.5, retries=5, progress=None, min_timeout=0.1,
+                 start=None, end=None):
+        self._vehicle = vehicle
+        self._items = list(items)
+        self._partial = start is not None
+        self._first = start if self._partial else 0
+        self._last = end if self._partial else len(self._items) - 1
+        if self._partial and not 0 <= self._first <= self._last < len(self._items):
+            raise ValueError('Invalid partial mission range %s-%s' % (start, end))
+        self.timeout = timeout
+        self.retries = retries
+        self.min_timeout = min_timeout
+        # Smoothed time from sending a message to the vehicle's next request.
+        self._rtt = None
+        self._progress = progress
+        caps = vehicle._capabilities
+        self._prefer_int = bool(caps and caps & mavlink.MAV_PROTOCOL_CAPABILITY_MISSION_INT)
+
+        self._changed = threading.Condition()
+        self._last_sent = None
+        self._last_activity = None
+        self._result = None
+        #: Number of distinct items sent so far.
+        self.sent = 0
+        #: Mission id from the vehicle's ``MISSION_ACK`` (``None`` if the firmware or dialect has none).
+        self.opaque_id = None
+
+    @property
+    def total(self):
+        """Number of items the transfer sends."""
+        return self._last - self._first + 1
+
+    def _encode(self, seq, as_int):
+        item = self._items[seq]
+        master = self._vehicle._master
+        if as_int:
+            x, y = item_int_coordinates(item)
+            return master.mav.mission_item_int_encode(
+                master.target_system, master.target_component, seq, item.frame, item.command,
+                item.current, item.autocontinue, item.param1, item.param2, item.param3, item.param4,
+                x, y, item.z)
+        return master.mav.mission_item_encode(
+            master.target_system, master.target_component, seq, item.frame, item.command,
+            item.current, item.autocontinue, item.param1, item.param2, item.param3, item.param4,
+            item.x, item.y, item.z)
+
+    def _start_message(self):
+        master = self._vehicle._master
+        if self._partial:
+            return master.mav.mission_write_partial_list_encode(
+                master.target_system, master.target_component, self._first, self._last)
+        if not self._items:
+            # An empty mission is uploaded by clearing it.
+            return master.mav.mission_clear_all_encode(master.target_system, master.target_component)
+        return master.mav.mission_count_encode(master.target_system, master.target_component, len(self._items))
+
+    def _send(self, msg):
+        self._last_sent = msg
+        self._last_activity = monotonic.monotonic()
+        self._vehicle._master.mav.send(msg)
+
+    def _on_request(self, _, name, msg):
+        with self._changed:
+            if self._result is not None or self._last_sent is None:
+                return
+            if not self._first <= msg.seq <= self._last:
+                return
+            rtt = monotonic.monotonic() - self._last_activity
+            self._rtt = rtt if self._rtt is None else 0.875 * self._rtt + 0.125 * rtt
+            if msg.seq - self._first + 1 > self.sent:
+                self.sent = msg.seq - self._first + 1
+                if self._progress:
+                    self._progress(self.sent, self.total)
+            self._send(self._encode(msg.seq, name == 'MISSION_REQUEST_INT' or self._prefer_int))
+            self._changed.notify_all()
+
+    def _on_ack(self, _, name, msg):
+        with self._changed:
+            if self._result is not None or self._last_sent is None:
+                return
+            # An ACCEPTED ack only counts once every item has been requested.
+            if msg.type == mavlink.MAV_MISSION_ACCEPTED and self.sent < self.total:
+                return
+            self._result = msg.type
+            self.opaque_id = getattr(msg, 'opaque_id', None) or None
+            self._changed.notify_all()
+
+    def _resend_timeout(self):
+        if self._rtt is None:
+            return self.timeout
+        return min(self.timeout, max(self.min_timeout, 4 * self._rtt))
+
+    def run(self, deadline=None):
+        """
+        Run the upload, blocking until the vehicle acknowledges it.
+
+        :param deadline: ``monotonic`` time after which :py:class:`TimeoutError` is raised.
+        :raises MissionTransferError: if the vehicle rejects the mission.
+        :raises TimeoutError: if the vehicle stops answering.
+        """
+        vehicle = self._vehicle
+        vehicle.add_message_listener('MISSION_REQUEST', self._on_request)
+        vehicle.add_message_listener('MISSION_REQUEST_INT', self._on_request)
+        vehicle.add_message_listener('MISSION_ACK', self._on_ack)
+        try:
+            with self._changed:
+                self._send(self._start_message())
+                attempts = 0
+                while self._result is None:
+                    now = monotonic.monotonic()
+                    if deadline is not None and now >= deadline:
+                        raise TimeoutError('Timed out uploading mission (%d/%d items sent)' %
+                                           (self.sent, self.total))
+                    if not vehicle._handler._alive:
+                        raise APIException('Connection lost while uploading mission.')
+                    idle = now - self._last_activity
+                    timeout = self._resend_timeout()
+                    if idle >= timeout:
+                        attempts += 1
+                        if attempts > self.retries:
+                            raise TimeoutError('Vehicle stopped answering mission upload (%d/%d items sent)' %
+                                               (self.sent, self.total))
+                        # Lost request or item: resending the last message makes the vehicle ask again.
+                        self._send(self._last_sent)
+                        continue
+                    sent = self.sent
+                    wait = timeout - idle
+                    if deadline is not None:
+                        wait = min(wait, deadline - now)
+                    self._changed.wait(wait)
+                    if self.sent != sent:
+                        attempts = 0
+        finally:
+            vehicle.remove_message_listener('MISSION_REQUEST', self._on_request)
+            vehicle.remove_message_listener('MISSION_REQUEST_INT', self._on_request)
+            vehicle.remove_message_listener('MISSION_ACK', self._on_ack)
+
+        if self._result != mavlink.MAV_MISSION_ACCEPTED:
+            raise MissionTransferError('Vehicle rejected mission: %s' % mission_result_name(self._result),
+                                       self._result)
+        return self._result
+
+
+class MissionDownload(object):
+    """
+    Download the vehicle's mission.
+
+    The transfer is driven by the vehicle's receive thread: :py:func:`handle_count`,
+    :py:func:`handle_item` and :py:func:`handle_ack` are called for the vehicle's ``MISSION_*``
+    messages and :py:func:`tick` from its receive loop. Up to ``window`` items are requested at a
+    time, always starting from the first missing index, and requests that go unanswered are sent
+    again, so a lost packet costs one timeout rather than stalling the download. ``finished`` is
+    set when the download completes or fails (``error`` then holds the reason).
+
+    :param on_complete: Called with the downloaded items (in order, as :py:class:`Command` objects)
+        before ``finished`` is set.
+    :param window: Maximum number of outstanding item requests. Vehicles that only answer
+        requests in sequence (and reject the others with ``MAV_MISSION_INVALID_SEQUENCE``) are
+        handled by falling back to one request at a time.
+    :param timeout: Longest wait for an answer before a request is resent (shortened to a few
+        measured round trips, at least ``min_timeout``).
+    :param retries: Number of consecutive resends without progress before the download fails.
+    """
+
+    def __init__(self, vehicle, on_complete=None, window=4, timeout=1.5, retries=5, min_timeout=0.1):
+        self._vehicle = vehicle
+        self._on_complete = on_complete
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self.min_timeout = min_timeout
+        caps = vehicle._capabilities
+        # Integer coordinates survive the round trip exactly; when AUTOPILOT_VERSION has not
+        # arrived yet they are tried first and given up if the vehicle does not answer them.
+        self._use_int = caps is None or bool(caps & mavlink.MAV_PROTOCOL_CAPABILITY_MISSION_INT)
+        self._probe_int = caps is None
+
+        self._lock = threading.Lock()
+        self._items = {}
+        # seq -> time the outstanding request was sent
+        self._requested = {}
+        self._rtt = None
+        self._attempts = 0
+        self._list_sent = None
+        #: Number of items reported by the vehicle (``None`` until ``MISSION_COUNT`` arrives).
+        self.count = None
+        #: Mission id from ``MISSION_COUNT`` (``None`` if the firmware or dialect has none).
+        self.opaque_id = None
+        self.error = None
+        self.finished = threading.Event()
+
+    @property
+    def received(self):
+        return len(self._items)
+
+    def start(self):
+        master = self._vehicle._master
+        with self._lock:
+            self._list_sent = monotonic.monotonic()
+            master.mav.mission_request_list_send(master.target_system, master.target_component)
+
+    def _resend_timeout(self):
+        if self._rtt is None:
+            return self.timeout
+        return min(self.timeout, max(self.min_timeout, 4 * self._rtt))
+
+    def _request_missing(self, now):
+        master = self._vehicle._master
+        for seq in range(self.count):
+            if len(self._requested) >= self.window:
+                break
+            if seq in self._items or seq in self._requested:
+                continue
+            if self._use_int:
+                master.mav.mission_request_int_send(master.target_system, master.target_component, seq)
+            else:
+                master.mav.mission_request_send(master.target_system, master.target_component, seq)
+            self._requested[seq] = now
+
+    def _finish(self, error=None):
+        self.error = error
+        self._requested.clear()
+        if error is None:
+            master = self._vehicle._master
+            master.mav.mission_ack_send(master.target_system, master.target_component,
+                                        mavlink.MAV_MISSION_ACCEPTED)
+            if self._on_complete:
+                self._on_complete([self._items[seq] for seq in range(self.count)])
+        self.finished.set()
+
+    def handle_count(self, msg):
+        with self._lock:
+            if self.finished.is_set() or self.count is not None:
+                return
+            self.count = msg.count
+            self.opaque_id = getattr(msg, 'opaque_id', None) or None
+            self._attempts = 0
+            if self.count == 0:
+                self._finish()
+            else:
+                self._request_missing(monotonic.monotonic())
+
+    def handle_item(self, name, msg):
+        with self._lock:
+            if self.finished.is_set() or self.count is None or not 0 <= msg.seq < self.count:
+                return
+            now = monotonic.monotonic()
+            sent = self._requested.pop(msg.seq, None)
+            if sent is not None:
+                rtt = now - sent
+                self._rtt = rtt if self._rtt is None else 0.875 * self._rtt + 0.125 * rtt
+            if msg.seq in self._items:
+                return
+            if name == 'MISSION_ITEM_INT':
+                scale = 1e7 if msg.frame in _GLOBAL_FRAMES else 1e4 if msg.frame in _LOCAL_FRAMES else 1
+                x, y = msg.x / scale, msg.y / scale
+            else:
+                x, y = msg.x, msg.y
+            self._items[msg.seq] = Command(msg.target_system, msg.target_component, msg.seq, msg.frame,
+                                           msg.command, msg.current, msg.autocontinue, msg.param1,
+                                           msg.param2, msg.param3, msg.param4, x, y, msg.z)
+            self._attempts = 0
+            if len(self._items) == self.count:
+                self._finish()
+            else:
+                self._request_missing(now)
+
+    def _fall_back_to_float(self, now):
+        """Switch to ``MISSION_REQUEST`` if ``MISSION_REQUEST_INT`` was only a guess and got nothing."""
+        if not (self._probe_int and self._use_int and not self._items):
+            return False
+        self._use_int = False
+        self._requested.clear()
+        self._request_missing(now)
+        return True
+
+    def handle_ack(self, msg):
+        with self._lock:
+            if self.finished.is_set() or self.count is None or msg.type == mavlink.MAV_MISSION_ACCEPTED:
+                return
+            if msg.type == mavlink.MAV_MISSION_UNSUPPORTED and self._fall_back_to_float(monotonic.monotonic()):
+                return
+            if msg.type == mavlink.MAV_MISSION_INVALID_SEQUENCE and self.window > 1:
+                # The vehicle only serves requests in order.
+                self.window = 1
+                self._requested.clear()
+                self._request_missing(monotonic.monotonic())
+                return
+            self._finish('Vehicle aborted mission download: %s' % mission_result_name(msg.type))
+
+    def tick(self, now):
+        """Resend requests that have gone unanswered."""
+        with self._lock:
+            if self.finished.is_set() or self._list_sent is None:
+                return
+            timeout = self._resend_timeout()
+            if self.count is None:
+                if now - self._list_sent < timeout:
+                    return
+                expired = True
+            else:
+                expired = [seq for seq, sent in self._requested.items() if now - sent >= timeout]
+            if not expired:
+                return
+            if self.count is not None and self._fall_back_to_float(now):
+                return
+            self._attempts += 1
+            if self._attempts > self.retries:
+                self._finish('Vehicle stopped answering mission download (%d/%s items received)' %
+                             (len(self._items), self.count))
+                return
+            if self.count is None:
+                master = self._vehicle._master
+                self._list_sent = now
+                master.mav.mission_request_list_send(master.target_system, master.target_component)
+                return
+            for seq in expired:
+                del self._requested[seq]
+            self._request_missing(now)
@@ -0,0 +1,79 @@
+"""
+On-disk cache of vehicle parameter tables.
+
+Reconnecting to a vehicle whose table is cached publishes the parameters straight away;
+the table is then refreshed from the vehicle in the background (see :py:class:`Vehicle.param_cache
+<dronekit.Vehicle.param_cache>`).
+"""
+
+import json
+import logging
+import os
+import struct
+import tempfile
+import zlib
+
+
+class ParamCache(object):
+    """
+    Parameter tables stored as one JSON file per vehicle in ``directory``.
+
+    Entries are keyed by MAVLink system id, the firmware build reported in ``AUTOPILOT_VERSION``
+    (version, git hash and board uid) and the parameter count. Each file also records a hash of
+    the table, so a truncated or edited file is ignored rather than loaded.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def firmware_key(version):
+        """Identity of the firmware build from an ``AUTOPILOT_VERSION`` message."""
+        custom = bytearray(version.flight_custom_version)
+        return '%08x-%s-%x' % (version.flight_sw_version, ''.join('%02x' % b for b in custom), version.uid)
+
+    @staticmethod
+    def table_hash(params):
+        """CRC32 of a table given as ``(name, value, type)`` tuples in index order."""
+        crc = 0
+        for name, value, param_type in params:
+            crc = zlib.crc32(struct.pack('<16sfB', name.encode('ascii'), value, param_type), crc)
+        return '%08x' % (crc & 0xffffffff)
+
+    def path(self, sysid, firmware, count):
+        return os.path.join(self.directory, 'params-%d-%s-%d.json' % (sysid, firmware, count))
+
+    def load(self, sysid, firmware, count):
+        """
+        Return the cached table as a list of ``(name, value, type)`` by parameter index, or
+        ``None`` if there is no valid entry.
+        """
+        path = self.path(sysid, firmware, count)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            params = [(name, value, param_type) for name, value, param_type in data['params']]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+        if len(params) != count or data.get('hash') != self.table_hash(params):
+            self._logger.warning('Ignoring invalid parameter cache %s' % path)
+            return None
+        return params
+
+    def save(self, sysid, firmware, params):
+        """Store a table given as ``(name, value, type)`` tuples in index order. Returns its hash."""
+        table_hash = self.table_hash(params)
+        path = self.path(sysid, firmware, len(params))
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Written aside and renamed, so readers never see a partial file.
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'sysid': sysid, 'firmware': firmware, 'count': len(params),
+                           'hash': table_hash, 'params': params}, f)
+            os.replace(tmp, path)
+        except (IOError, OSError):
+            self._logger.exception('Could not write parameter cache %s' % path)
+        return table_hash
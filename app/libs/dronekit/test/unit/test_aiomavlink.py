@@ -0,0 +1,46 @@
+import socket
+import time
+
+from pymavlink import mavutil
+from nose.tools import assert_equals, assert_raises
+
+from app.libs.dronekit import APIException
+from app.libs.dronekit.aiomavlink import AsyncMAVConnection, parse_connection_string
+
+
+def test_parse_connection_string():
+    assert_equals(parse_connection_string('udpin:0.0.0.0:14550'), ('udpin', ('0.0.0.0', 14550)))
+    assert_equals(parse_connection_string('127.0.0.1:14550'), ('udpin', ('127.0.0.1', 14550)))
+    assert_equals(parse_connection_string('udpout:10.0.0.2:14550'), ('udpout', ('10.0.0.2', 14550)))
+    assert_equals(parse_connection_string('tcp:127.0.0.1:5760'), ('tcp', ('127.0.0.1', 5760)))
+    assert_equals(parse_connection_string('/dev/ttyUSB0'), ('serial', '/dev/ttyUSB0'))
+    assert_raises(APIException, parse_connection_string, 'tcpin:0.0.0.0:5760')
+
+
+def test_udp_roundtrip():
+    handler = AsyncMAVConnection('udpin:127.0.0.1:0')
+    received = []
+    handler.forward_message(lambda _, msg: received.append(msg))
+    handler.start()
+    try:
+        port = handler._transport.get_extra_info('sockname')[1]
+        peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        peer.settimeout(2)
+        sender = mavutil.mavlink.MAVLink(None, srcSystem=7, srcComponent=1)
+        # Two frames packed in one datagram must both be dispatched.
+        data = sender.heartbeat_encode(2, 3, 0, 0, 0).pack(sender) + sender.attitude_encode(1, 0, 0, 0, 0, 0, 0).pack(sender)
+        peer.sendto(data, ('127.0.0.1', port))
+
+        start = time.time()
+        while len(received) < 2 and time.time() - start < 2:
+            time.sleep(0.01)
+        assert_equals([m.get_type() for m in received], ['HEARTBEAT', 'ATTITUDE'])
+
+        # Replies go back to the peer that sent data.
+        handler.master.mav.heartbeat_send(6, 8, 0, 0, 0)
+        reply, _ = peer.recvfrom(1024)
+        parser = mavutil.mavlink.MAVLink(None)
+        assert_equals(parser.parse_buffer(reply)[0].get_type(), 'HEARTBEAT')
+        peer.close()
+    finally:
+        handler.close()
@@ -1,5 +1,13 @@
-from app.libs.dronekit import VehicleMode
-from nose.tools import assert_equals, assert_not_equals
+import asyncio
+import threading
+import time
+
+from pymavlink import mavutil
+from nose.tools import assert_equals, assert_not_equals, assert_raises
+
+from app.libs import dronekit
+from app.libs.dronekit import Battery, TimeoutError, Vehicle, VehicleMode
+from app.libs.dronekit.mavlink import MAVConnection
 
 
 def test_vehicle_mode_eq():
@@ -8,3 +16,107 @@ def test_vehicle_mode_eq():
 
 def test_vehicle_mode_neq():
     assert_not_equals(VehicleMode('AUTO'), VehicleMode('GUIDED'))
+
+
+def test_vehicle_snapshot_is_swapped_per_message():
+    handler = MAVConnection('udpout:127.0.0.1:9')
+    vehicle = Vehicle(handler)
+    handler.start()
+    mav = mavutil.mavlink.MAVLink(None)
+
+    before = vehicle.snapshot
+    vehicle.notify_message_listeners('ATTITUDE', mav.attitude_encode(0, 0.1, 0.2, 0.3, 0, 0, 0))
+    vehicle.notify_message_listeners('GLOBAL_POSITION_INT',
+                                     mav.global_position_int_encode(0, 371234567, 1271234567, 60000, 10000, 0, 0, 0, 0))
+    snap = vehicle.snapshot
+
+    assert_equals(before.pitch, None)
+    assert_equals((snap.roll, snap.pitch, snap.yaw), (0.1, 0.2, 0.3))
+    assert_equals((snap.lat, snap.lon, snap.alt, snap.alt_asl), (37.1234567, 127.1234567, 10.0, 60.0))
+    assert_raises(AttributeError, setattr, snap, 'lat', 0)
+    vehicle.close()
+
+
+def test_vehicle_dispatch_follows_listener_changes():
+    handler = MAVConnection('udpout:127.0.0.1:9')
+    vehicle = Vehicle(handler)
+    handler.start()
+    mav = mavutil.mavlink.MAVLink(None)
+    attitude = mav.attitude_encode(0, 0.1, 0.2, 0.3, 0, 0, 0)
+    seen = []
+
+    def on_message(_, name, msg):
+        seen.append(name)
+
+    def on_attitude(_, name, value):
+        seen.append(value.roll)
+
+    vehicle.add_message_listener('*', on_message)
+    vehicle.add_attribute_listener('attitude', on_attitude)
+    vehicle.notify_message_listeners('ATTITUDE', attitude)
+    vehicle.remove_message_listener('*', on_message)
+    vehicle.remove_attribute_listener('attitude', on_attitude)
+    vehicle.notify_message_listeners('ATTITUDE', attitude)
+
+    assert_equals(seen, [0.1, 'ATTITUDE'])
+    # Attributes are tracked for wait_ready even without listeners.
+    assert 'attitude' in vehicle._ready_attrs
+    vehicle.close()
+
+
+def test_vehicle_battery_is_built_only_for_listeners():
+    handler = MAVConnection('udpout:127.0.0.1:9')
+    vehicle = Vehicle(handler)
+    handler.start()
+    mav = mavutil.mavlink.MAVLink(None)
+    built = []
+
+    class CountingBattery(Battery):
+        def __init__(self, *args):
+            built.append(args)
+            Battery.__init__(self, *args)
+
+    sys_status = mav.sys_status_encode(0, 0, 0, 500, 12600, -1, 80, 0, 0, 0, 0, 0, 0)
+    dronekit.Battery = CountingBattery
+    try:
+        vehicle.notify_message_listeners('SYS_STATUS', sys_status)
+        assert_equals(built, [])
+        snap = vehicle.snapshot
+        assert_equals((snap.battery_voltage, snap.battery_current, snap.battery_level), (12.6, None, 80))
+        assert 'battery' in vehicle._ready_attrs
+
+        seen = []
+        vehicle.add_attribute_listener('battery', lambda _, name, value: seen.append((value.voltage, value.level)))
+        vehicle.notify_message_listeners('SYS_STATUS', sys_status)
+        assert_equals(seen, [(12.6, 80)])
+        assert_equals(built, [(12600, -1, 80)])
+    finally:
+        dronekit.Battery = Battery
+    vehicle.close()
+
+
+def test_vehicle_waits_wake_on_attribute_updates():
+    handler = MAVConnection('udpout:127.0.0.1:9')
+    vehicle = Vehicle(handler)
+    handler.start()
+    mav = mavutil.mavlink.MAVLink(None)
+
+    def heartbeat(custom_mode, delay):
+        time.sleep(delay)
+        vehicle.notify_message_listeners('HEARTBEAT', mav.heartbeat_encode(
+            mavutil.mavlink.MAV_TYPE_QUADROTOR, mavutil.mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA, 1, custom_mode, 3))
+
+    try:
+        # GUIDED is custom mode 4 on copters; the long interval shows the wait does not poll.
+        threading.Thread(target=heartbeat, args=(4, 0.05)).start()
+        t0 = time.time()
+        vehicle.wait_for(lambda: vehicle.mode.name == 'GUIDED', timeout=5, interval=10)
+        assert time.time() - t0 < 1
+
+        threading.Thread(target=heartbeat, args=(9, 0.05)).start()
+        asyncio.run(vehicle.until(lambda v: v.mode.name == 'LAND', timeout=5))
+        with assert_raises(TimeoutError):
+            asyncio.run(vehicle.until(lambda v: v.mode.name == 'RTL', timeout=0.1))
+        assert_equals(vehicle._state_waiters, ())
+    finally:
+        vehicle.close()
@@ -0,0 +1,129 @@
+import threading
+
+import monotonic
+from pymavlink import mavutil
+from nose.tools import assert_equals, assert_raises
+
+from app.libs.dronekit import TimeoutError, Vehicle
+from app.libs.dronekit.mavlink import MAVConnection
+
+mavlink = mavutil.mavlink
+
+
+def command_vehicle():
+    handler = MAVConnection('udpout:127.0.0.1:9')
+    vehicle = Vehicle(handler)
+    handler.start()
+    sent = []
+    vehicle._master.mav.send = lambda msg, **kwargs: sent.append(msg)
+    return vehicle, sent
+
+
+def ack(vehicle, command, result):
+    mav = mavutil.mavlink.MAVLink(None)
+    vehicle.notify_message_listeners('COMMAND_ACK', mav.command_ack_encode(command, result))
+
+
+def test_commands_resolve_on_their_own_ack():
+    vehicle, sent = command_vehicle()
+    client = vehicle.command_client
+    try:
+        takeoff = vehicle.simple_takeoff(10)
+        arm = vehicle.set_armed(True)
+        second_takeoff = vehicle.simple_takeoff(20)
+        # Different ids are in flight together; the same id waits for the first answer.
+        assert_equals([(m.command, m.param7) for m in sent],
+                      [(mavlink.MAV_CMD_NAV_TAKEOFF, 10), (mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 0)])
+
+        ack(vehicle, mavlink.MAV_CMD_COMPONENT_ARM_DISARM, mavlink.MAV_RESULT_ACCEPTED)
+        assert arm.result(0).accepted
+        assert not takeoff.done()
+
+        ack(vehicle, mavlink.MAV_CMD_NAV_TAKEOFF, mavlink.MAV_RESULT_FAILED)
+        assert_equals(takeoff.result(0).name, 'MAV_RESULT_FAILED')
+        assert_equals(sent[-1].param7, 20)
+        ack(vehicle, mavlink.MAV_CMD_NAV_TAKEOFF, mavlink.MAV_RESULT_ACCEPTED)
+        assert second_takeoff.result(0).accepted
+        assert_equals(client.in_flight, [])
+    finally:
+        vehicle.close()
+
+
+def test_unanswered_commands_are_resent_then_fail():
+    vehicle, sent = command_vehicle()
+    client = vehicle.command_client
+    try:
+        future = client.send(mavlink.MAV_CMD_PREFLIGHT_CALIBRATION, 1, retries=2)
+        for i in range(1, 4):
+            client.tick(monotonic.monotonic() + 10 * i)
+        assert_equals([m.confirmation for m in sent], [0, 1, 2])
+        with assert_raises(TimeoutError):
+            future.result(0)
+
+        # IN_PROGRESS stops the resends until the final answer.
+        del sent[:]
+        future = client.send(mavlink.MAV_CMD_PREFLIGHT_CALIBRATION, 1, progress_timeout=30)
+        ack(vehicle, mavlink.MAV_CMD_PREFLIGHT_CALIBRATION, mavlink.MAV_RESULT_IN_PROGRESS)
+        client.tick(monotonic.monotonic() + 10)
+        assert_equals(len(sent), 1)
+        ack(vehicle, mavlink.MAV_CMD_PREFLIGHT_CALIBRATION, mavlink.MAV_RESULT_ACCEPTED)
+        assert_equals(future.result(0).attempts, 1)
+    finally:
+        vehicle.close()
+
+
+def test_calibration_waits_for_a_late_ack():
+    vehicle, sent = command_vehicle()
+    client = vehicle.command_client
+    try:
+        # A fast link: the measured round trip alone would resend after min_timeout.
+        arm = vehicle.set_armed(True)
+        threading.Timer(0.02, ack, (vehicle, mavlink.MAV_CMD_COMPONENT_ARM_DISARM, mavlink.MAV_RESULT_ACCEPTED)).start()
+        assert arm.result(1).accepted
+        assert client.round_trip < 0.1
+
+        # The autopilot only answers once the gyros are calibrated; the receive thread keeps ticking.
+        calibration = vehicle.send_calibrate_gyro()
+        threading.Timer(0.6, ack, (vehicle, mavlink.MAV_CMD_PREFLIGHT_CALIBRATION, mavlink.MAV_RESULT_ACCEPTED)).start()
+        result = calibration.result(2)
+        assert result.accepted
+        assert_equals(result.attempts, 1)
+        assert result.latency >= 0.6
+        assert_equals([m.confirmation for m in sent if m.command == mavlink.MAV_CMD_PREFLIGHT_CALIBRATION], [0])
+
+        # Ordinary commands still resend after a few round trips.
+        takeoff = client.send(mavlink.MAV_CMD_NAV_TAKEOFF, 0, 0, 0, 0, 0, 0, 10)
+        client.tick(monotonic.monotonic() + max(client.min_timeout, 4 * client.round_trip))
+        assert_equals(len([m for m in sent if m.command == mavlink.MAV_CMD_NAV_TAKEOFF]), 2)
+        ack(vehicle, mavlink.MAV_CMD_NAV_TAKEOFF, mavlink.MAV_RESULT_ACCEPTED)
+        assert takeoff.result(0).accepted
+    finally:
+        vehicle.close()
+
+
+def test_stream_profile_goes_through_the_command_client():
+    vehicle, sent = command_vehicle()
+    # Answered from another thread, as the receive thread would; SYS_STATUS is never answered.
+    answers = {mavlink.MAVLINK_MSG_ID_RAW_IMU: mavlink.MAV_RESULT_ACCEPTED,
+               mavlink.MAVLINK_MSG_ID_ATTITUDE: mavlink.MAV_RESULT_DENIED}
+
+    def send(msg, **kwargs):
+        sent.append(msg)
+        if msg.param1 in answers:
+            threading.Timer(0.01, ack, (vehicle, msg.command, answers[msg.param1])).start()
+
+    vehicle._master.mav.send = send
+    try:
+        results = vehicle.set_stream_profile(
+            {'RAW_IMU': 0, 'ATTITUDE': 10, 'SYS_STATUS': 1, 'VFR_HUD': 4}, timeout=0.05, retries=1)
+        assert_equals(results, {'RAW_IMU': mavlink.MAV_RESULT_ACCEPTED, 'ATTITUDE': mavlink.MAV_RESULT_DENIED,
+                                'SYS_STATUS': None, 'VFR_HUD': None})
+        assert_equals(vehicle.stream_profile, {'RAW_IMU': 0})
+        # SYS_STATUS is sent retries + 1 times, then VFR_HUD is not tried at all.
+        assert_equals([(m.param1, m.param2, m.confirmation) for m in sent],
+                      [(mavlink.MAVLINK_MSG_ID_RAW_IMU, -1, 0), (mavlink.MAVLINK_MSG_ID_ATTITUDE, 100000, 0),
+                       (mavlink.MAVLINK_MSG_ID_SYS_STATUS, 1000000, 0), (mavlink.MAVLINK_MSG_ID_SYS_STATUS, 1000000, 1)])
+        # Only the command client listens for COMMAND_ACK.
+        assert_equals(len(vehicle._message_listeners['COMMAND_ACK']), 1)
+    finally:
+        vehicle.close()
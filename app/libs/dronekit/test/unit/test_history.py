@@ -0,0 +1,42 @@
+from nose.tools import assert_equals, assert_raises
+
+from app.libs.dronekit import TelemetrySnapshot
+from app.libs.dronekit.history import TelemetryHistory
+
+
+def fill(history, count, start=0):
+    for i in range(start, start + count):
+        history.record(TelemetrySnapshot(lat=float(i), lon=None, alt=i * 2.0, time=float(i)))
+
+
+def test_ring_keeps_the_newest_samples_in_order():
+    history = TelemetryHistory(5, fields=('lat', 'lon', 'alt'))
+    fill(history, 3)
+    assert_equals(history.window()['lat'], [0.0, 1.0, 2.0])
+
+    fill(history, 4, start=3)
+    assert_equals(len(history), 5)
+    samples = history.window()
+    assert_equals(samples['lat'], [2.0, 3.0, 4.0, 5.0, 6.0])
+    assert_equals(samples['lon'], [None] * 5)
+    # Same snapshot twice is not a new sample.
+    history.record(TelemetrySnapshot(lat=99.0, time=6.0))
+    assert_equals(len(history.window()['time']), 5)
+
+    # Last N seconds, relative to the newest stored time.
+    now = samples['time'][-1]
+    assert_equals(history.window(2, fields=('alt',), now=now)['alt'], [8.0, 10.0, 12.0])
+    assert_raises(ValueError, history.window, fields=('groundspeed',))
+    assert_raises(ValueError, TelemetryHistory, 5, fields=('mode',))
+
+
+def test_downsample_averages_time_buckets():
+    history = TelemetryHistory(100, fields=('lat',), interval=0.5)
+    fill(history, 40)
+    # interval drops nothing at 1 s spacing; 40 samples into 4 buckets of 10.
+    now = history.window()['time'][-1]
+    chart = history.downsample(None, 4, now=now)
+    assert_equals(chart['lat'], [4.5, 14.5, 24.5, 34.5])
+    assert_equals(history.downsample(None, 4, how='last')['lat'], [9.0, 19.0, 29.0, 39.0])
+    # Fewer samples than points: returned as stored.
+    assert_equals(history.downsample(3, 10, now=now)['lat'], [36.0, 37.0, 38.0, 39.0])
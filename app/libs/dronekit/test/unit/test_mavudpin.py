@@ -0,0 +1,198 @@
+import socket
+import time
+
+from pymavlink import mavutil
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+from nose.tools import assert_equals
+
+from app.libs.dronekit.mavlink import MAVMuxConnection, mavudpin_multi
+
+
+def test_recv_msgs_drains_all_datagrams():
+    master = mavudpin_multi('127.0.0.1:0', input=True)
+    port = master.port.getsockname()[1]
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = mavutil.mavlink.MAVLink(None, srcSystem=3, srcComponent=1)
+    for i in range(3):
+        # Several frames packed in one datagram.
+        data = (sender.attitude_encode(i, 0, 0, 0, 0, 0, 0).pack(sender) +
+                sender.vfr_hud_encode(0, 0, i, 0, 0, 0).pack(sender))
+        peer.sendto(data, ('127.0.0.1', port))
+    time.sleep(0.1)
+
+    msgs = master.recv_msgs()
+    assert_equals([m.get_type() for m in msgs], ['ATTITUDE', 'VFR_HUD'] * 3)
+    assert_equals([m.time_boot_ms for m in msgs if m.get_type() == 'ATTITUDE'], [0, 1, 2])
+    assert_equals([a[1] for a in master.addresses], [peer.getsockname()[1]])
+
+    # Nothing left: returns immediately.
+    assert_equals(master.recv_msgs(), [])
+    peer.close()
+    master.close()
+
+
+def test_multiplexer_routes_by_system_id():
+    conns = [MAVMuxConnection('udpmux:127.0.0.1:0', target_system=sysid) for sysid in (1, 2)]
+    mux = conns[0]._mux
+    assert mux is conns[1]._mux
+    received = {1: [], 2: []}
+    for conn in conns:
+        conn.forward_message(lambda c, msg: received[c.target_system].append(msg.get_srcSystem()))
+        conn.start()
+
+    port = mux.master.port.getsockname()[1]
+    peers = {}
+    for sysid in (1, 2, 3):
+        peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        peer.settimeout(2)
+        sender = mavutil.mavlink.MAVLink(None, srcSystem=sysid, srcComponent=1)
+        peer.sendto(sender.heartbeat_encode(2, 3, 0, 0, 0).pack(sender), ('127.0.0.1', port))
+        peers[sysid] = peer
+
+    start = time.time()
+    while (not received[1] or not received[2]) and time.time() - start < 2:
+        time.sleep(0.01)
+    assert_equals(received, {1: [1], 2: [2]})
+    assert_equals(mux.systems, [1, 2, 3])
+
+    # Replies are routed to the address the system was heard from.
+    conns[1].master.mav.heartbeat_send(6, 8, 0, 0, 0)
+    reply, _ = peers[2].recvfrom(1024)
+    assert_equals(mavutil.mavlink.MAVLink(None).parse_buffer(reply)[0].get_type(), 'HEARTBEAT')
+
+    for peer in peers.values():
+        peer.close()
+    for conn in conns:
+        conn.close()
+    mux.close()
+
+
+def test_multiplexed_vehicle_answers_mavlink2_in_mavlink2():
+    conn = MAVMuxConnection('udpmux:127.0.0.1:0', target_system=7)
+    mux = conn._mux
+    received = []
+    conn.forward_message(lambda c, msg: received.append(msg))
+    conn.start()
+
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    peer.settimeout(2)
+    sender = mavlink2.MAVLink(None, srcSystem=7, srcComponent=1)
+    peer.sendto(sender.heartbeat_encode(2, 3, 0, 0, 0).pack(sender), ('127.0.0.1', mux.master.port.getsockname()[1]))
+    start = time.time()
+    while not received and time.time() - start < 2:
+        time.sleep(0.01)
+    assert_equals(conn.master.WIRE_PROTOCOL_VERSION, '2.0')
+    assert not conn.master.first_byte
+
+    # The channel's sender is rebuilt for MAVLink2 and still goes through fix_targets.
+    conn.master.mav.command_long_send(0, 0, 400, 0, 1, 0, 0, 0, 0, 0, 0)
+    reply, _ = peer.recvfrom(1024)
+    assert_equals(reply[:1], b'\xfd')
+    assert_equals(sender.parse_buffer(reply)[0].target_system, 7)
+
+    peer.close()
+    conn.close()
+    mux.close()
+
+
+def wait_for(condition, timeout=2):
+    start = time.time()
+    while not condition() and time.time() - start < timeout:
+        time.sleep(0.01)
+
+
+def test_failing_loop_listener_only_affects_its_vehicle():
+    conns = [MAVMuxConnection('udpmux:127.0.0.1:0', target_system=sysid) for sysid in (1, 2)]
+    mux = conns[0]._mux
+    received = {1: [], 2: []}
+    ticks = []
+
+    def broken(conn):
+        ticks.append(conn.target_system)
+        raise ValueError('broken listener')
+
+    conns[0].forward_loop(broken)
+    conns[1].forward_loop(lambda conn: ticks.append(conn.target_system))
+    for conn in conns:
+        conn.forward_message(lambda c, msg: received[c.target_system].append(msg.get_type()))
+        conn.start()
+
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    port = mux.master.port.getsockname()[1]
+    senders = dict((sysid, mavutil.mavlink.MAVLink(None, srcSystem=sysid, srcComponent=1)) for sysid in (1, 2))
+    for _ in range(3):
+        for sender in senders.values():
+            peer.sendto(sender.heartbeat_encode(2, 3, 0, 0, 0).pack(sender), ('127.0.0.1', port))
+        time.sleep(0.1)
+    wait_for(lambda: len(received[1]) == 3 and len(received[2]) == 3)
+
+    assert_equals(received, {1: ['HEARTBEAT'] * 3, 2: ['HEARTBEAT'] * 3})
+    assert ticks.count(1) > 1 and ticks.count(2) > 1
+    assert mux._alive
+    assert conns[0]._alive and conns[1]._alive
+
+    peer.close()
+    for conn in conns:
+        conn.close()
+    mux.close()
+
+
+def test_multiplexer_only_remembers_recent_vehicles():
+    conn = MAVMuxConnection('udpmux:127.0.0.1:0', target_system=1)
+    mux = conn._mux
+    mux.max_unattached_systems = 3
+    conn.start()
+
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    port = mux.master.port.getsockname()[1]
+    for sysid in range(1, 11):
+        sender = mavutil.mavlink.MAVLink(None, srcSystem=sysid, srcComponent=1)
+        peer.sendto(sender.heartbeat_encode(2, 3, 0, 0, 0).pack(sender), ('127.0.0.1', port))
+    # A ground station and a system that sends no heartbeat are not recorded.
+    gcs = mavutil.mavlink.MAVLink(None, srcSystem=255, srcComponent=190)
+    peer.sendto(gcs.heartbeat_encode(6, 8, 0, 0, 0).pack(gcs), ('127.0.0.1', port))
+    stray = mavutil.mavlink.MAVLink(None, srcSystem=42, srcComponent=1)
+    peer.sendto(stray.attitude_encode(0, 0, 0, 0, 0, 0, 0).pack(stray), ('127.0.0.1', port))
+    wait_for(lambda: mux.systems == [1, 8, 9, 10])
+    time.sleep(0.1)
+    assert_equals(mux.systems, [1, 8, 9, 10])
+
+    # Attaching a remembered vehicle replays its heartbeat and routes replies to it at once.
+    late = MAVMuxConnection('udpmux:127.0.0.1:0', target_system=9)
+    received = []
+    late.forward_message(lambda c, msg: received.append(msg.get_srcSystem()))
+    late.start()
+    wait_for(lambda: received)
+    assert_equals(received, [9])
+    peer.settimeout(2)
+    late.master.mav.heartbeat_send(6, 8, 0, 0, 0)
+    assert_equals(mavutil.mavlink.MAVLink(None).parse_buffer(peer.recvfrom(1024)[0])[0].get_type(), 'HEARTBEAT')
+    assert_equals(mux.systems, [1, 8, 9, 10])
+
+    peer.close()
+    late.close()
+    conn.close()
+    mux.close()
+
+
+def test_recv_msgs_applies_ingest_policy_before_decoding():
+    from app.libs.dronekit.ingest import IngestPolicy
+
+    master = mavudpin_multi('127.0.0.1:0', input=True)
+    port = master.port.getsockname()[1]
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = mavutil.mavlink.MAVLink(None, srcSystem=3, srcComponent=1)
+    for i in range(4):
+        data = (sender.attitude_encode(i, 0, 0, 0, 0, 0, 0).pack(sender) +
+                sender.raw_imu_encode(i, 0, 0, 0, 0, 0, 0, 0, 0, 0).pack(sender) +
+                sender.heartbeat_encode(2, 3, 0, 0, 0).pack(sender))
+        peer.sendto(data, ('127.0.0.1', port))
+    time.sleep(0.1)
+
+    # RAW_IMU is not allowed and ATTITUDE is decimated to 1 Hz; HEARTBEAT is always accepted.
+    policy = IngestPolicy(allow=['ATTITUDE'], rates={'ATTITUDE': 1})
+    msgs = master.recv_msgs(lambda sysid: policy)
+    assert_equals([m.get_type() for m in msgs], ['ATTITUDE'] + ['HEARTBEAT'] * 4)
+    assert_equals(policy.dropped, 7)
+    peer.close()
+    master.close()
@@ -0,0 +1,148 @@
+import monotonic
+from pymavlink import mavutil
+from nose.tools import assert_equals, assert_raises
+
+from app.libs.dronekit import Command, Vehicle
+from app.libs.dronekit.mavlink import MAVConnection
+from app.libs.dronekit.mission import MissionTransferError, MissionUpload, mission_fingerprint
+
+mavlink = mavutil.mavlink
+
+
+def fake_vehicle(reply):
+    """A Vehicle whose outgoing messages are answered synchronously by ``reply(msg)``."""
+    handler = MAVConnection('udpout:127.0.0.1:9')
+    vehicle = Vehicle(handler)
+    handler.start()
+    mav = mavutil.mavlink.MAVLink(None)
+
+    def send(msg, **kwargs):
+        for name, answer in reply(mav, msg):
+            vehicle.notify_message_listeners(name, answer)
+
+    vehicle._master.mav.send = send
+    return vehicle
+
+
+def mission(count):
+    return [Command(0, 0, i, mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT, mavlink.MAV_CMD_NAV_WAYPOINT, 0, 1,
+                    0, 0, 0, 0, 37.1234567 + i * 1e-7, 127.1234567, 30) for i in range(count)]
+
+
+def test_upload_answers_requests_and_retransmits():
+    received = []
+
+    def reply(mav, msg):
+        received.append(msg)
+        if msg.get_type() == 'MISSION_COUNT':
+            # The first request is lost.
+            if len(received) > 1:
+                yield 'MISSION_REQUEST_INT', mav.mission_request_int_encode(255, 0, 0)
+        elif msg.seq + 1 < 3:
+            yield 'MISSION_REQUEST_INT', mav.mission_request_int_encode(255, 0, msg.seq + 1)
+        else:
+            yield 'MISSION_ACK', mav.mission_ack_encode(255, 0, mavlink.MAV_MISSION_ACCEPTED)
+
+    vehicle = fake_vehicle(reply)
+    progress = []
+    try:
+        upload = MissionUpload(vehicle, mission(3), timeout=0.05, progress=lambda *p: progress.append(p))
+        assert_equals(upload.run(), mavlink.MAV_MISSION_ACCEPTED)
+    finally:
+        vehicle.close()
+
+    assert_equals([m.get_type() for m in received],
+                  ['MISSION_COUNT', 'MISSION_COUNT'] + ['MISSION_ITEM_INT'] * 3)
+    assert_equals([(m.seq, m.x, m.y) for m in received[2:]],
+                  [(0, 371234567, 1271234567), (1, 371234568, 1271234567), (2, 371234569, 1271234567)])
+    assert_equals(progress, [(1, 3), (2, 3), (3, 3)])
+
+
+def test_upload_raises_on_rejection():
+    def reply(mav, msg):
+        yield 'MISSION_ACK', mav.mission_ack_encode(255, 0, mavlink.MAV_MISSION_NO_SPACE)
+
+    vehicle = fake_vehicle(reply)
+    try:
+        with assert_raises(MissionTransferError) as cm:
+            MissionUpload(vehicle, mission(3)).run()
+        assert_equals(cm.exception.result, mavlink.MAV_MISSION_NO_SPACE)
+    finally:
+        vehicle.close()
+
+
+def test_partial_upload_sends_only_the_range():
+    received = []
+
+    def reply(mav, msg):
+        received.append(msg)
+        if msg.get_type() == 'MISSION_WRITE_PARTIAL_LIST':
+            yield 'MISSION_REQUEST_INT', mav.mission_request_int_encode(255, 0, msg.start_index)
+        elif msg.seq < 3:
+            yield 'MISSION_REQUEST_INT', mav.mission_request_int_encode(255, 0, msg.seq + 1)
+        else:
+            yield 'MISSION_ACK', mav.mission_ack_encode(255, 0, mavlink.MAV_MISSION_ACCEPTED)
+
+    vehicle = fake_vehicle(reply)
+    try:
+        upload = MissionUpload(vehicle, mission(5), start=2, end=3)
+        assert_equals(upload.run(), mavlink.MAV_MISSION_ACCEPTED)
+    finally:
+        vehicle.close()
+
+    assert_equals((received[0].start_index, received[0].end_index), (2, 3))
+    assert_equals([m.seq for m in received[1:]], [2, 3])
+
+
+def test_fingerprint_ignores_float_noise_in_coordinates():
+    items = mission(3)
+    assert_equals(mission_fingerprint(items), mission_fingerprint(mission(3)))
+    items[1].x += 1e-9
+    assert_equals(mission_fingerprint(items), mission_fingerprint(mission(3)))
+    items[1].z += 1
+    assert mission_fingerprint(items) != mission_fingerprint(mission(3))
+
+
+def test_download_requests_missing_items_again():
+    stored = mission(6)
+    outbox = []
+    requested = []
+    lost = set([2, 4])
+
+    handler = MAVConnection('udpout:127.0.0.1:9')
+    vehicle = Vehicle(handler)
+    handler.start()
+    mav = mavutil.mavlink.MAVLink(None)
+
+    def send(msg, **kwargs):
+        name = msg.get_type()
+        if name == 'MISSION_REQUEST_LIST':
+            outbox.append(('MISSION_COUNT', mav.mission_count_encode(255, 0, len(stored))))
+        elif name == 'MISSION_REQUEST_INT':
+            requested.append(msg.seq)
+            if msg.seq in lost:
+                lost.discard(msg.seq)
+                return
+            item = stored[msg.seq]
+            outbox.append(('MISSION_ITEM_INT', mav.mission_item_int_encode(
+                255, 0, msg.seq, item.frame, item.command, 0, 1, 0, 0, 0, 0,
+                int(round(item.x * 1e7)), int(round(item.y * 1e7)), item.z)))
+
+    vehicle._master.mav.send = send
+    vehicle._capabilities = mavlink.MAV_PROTOCOL_CAPABILITY_MISSION_INT
+    try:
+        vehicle.commands.download()
+        download = vehicle._wp_download
+        while not download.finished.is_set():
+            while outbox:
+                vehicle.notify_message_listeners(*outbox.pop(0))
+            # Well past any resend timeout.
+            download.tick(monotonic.monotonic() + 10)
+        vehicle.commands.wait_ready(timeout=1)
+        assert_equals(len(vehicle.commands), 5)
+        assert_equals(vehicle.commands[4].x, 37.1234572)
+        assert_equals(vehicle.commands.download_progress, (6, 6))
+        # The lost items were requested again, the others once.
+        assert_equals(sorted(requested), [0, 1, 2, 2, 3, 4, 4, 5])
+    finally:
+        vehicle.close()
@@ -0,0 +1,117 @@
+import json
+import shutil
+import tempfile
+import threading
+
+from pymavlink import mavutil
+from nose.tools import assert_equals
+
+from app.libs.dronekit import Vehicle
+from app.libs.dronekit.mavlink import MAVConnection
+from app.libs.dronekit.param_cache import ParamCache
+
+PARAMS = [('SYSID_THISMAV', 1.0, 2), ('WPNAV_SPEED', 500.0, 9), ('RTL_ALT', 1500.0, 6)]
+
+
+def test_cache_round_trip_and_hash_check():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ParamCache(directory)
+        table_hash = cache.save(1, 'fw', PARAMS)
+        assert_equals(cache.load(1, 'fw', 3), PARAMS)
+        assert_equals(cache.load(1, 'fw', 4), None)
+        assert_equals(cache.load(2, 'fw', 3), None)
+
+        path = cache.path(1, 'fw', 3)
+        with open(path) as f:
+            data = json.load(f)
+        assert_equals(data['hash'], table_hash)
+        data['params'][1][1] = 600.0
+        with open(path, 'w') as f:
+            json.dump(data, f)
+        assert_equals(cache.load(1, 'fw', 3), None)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_vehicle_publishes_cached_params_and_revalidates():
+    directory = tempfile.mkdtemp()
+    handler = MAVConnection('udpout:127.0.0.1:9')
+    vehicle = Vehicle(handler)
+    handler.start()
+    try:
+        mav = mavutil.mavlink.MAVLink(None)
+        version = mav.autopilot_version_encode(0, 0x04050600, 0, 0, 0, b'abcdefgh', b'', b'', 0, 0, 1234)
+        vehicle.param_cache = directory
+        vehicle.param_cache.save(1, ParamCache.firmware_key(version), PARAMS)
+        vehicle._heartbeat_system = 1
+        vehicle.notify_message_listeners('AUTOPILOT_VERSION', version)
+
+        vehicle.notify_message_listeners('PARAM_VALUE', mav.param_value_encode(b'RTL_ALT', 2000.0, 6, 3, 2))
+        assert vehicle._params_loaded
+        assert vehicle.parameters.revalidating
+        assert_equals(vehicle.parameters['WPNAV_SPEED'], 500.0)
+        assert_equals(vehicle.parameters['RTL_ALT'], 2000.0)
+
+        for i, (name, value, param_type) in enumerate(PARAMS[:2]):
+            vehicle.notify_message_listeners(
+                'PARAM_VALUE', mav.param_value_encode(name.encode(), value, param_type, 3, i))
+        vehicle._params_complete()
+        assert not vehicle.parameters.revalidating
+        assert_equals(vehicle.param_cache.load(1, ParamCache.firmware_key(version), 3)[2], ('RTL_ALT', 2000.0, 6))
+    finally:
+        vehicle.close()
+        shutil.rmtree(directory)
+
+
+def test_set_many_completes_on_param_value():
+    handler = MAVConnection('udpout:127.0.0.1:9')
+    vehicle = Vehicle(handler)
+    handler.start()
+    mav = mavutil.mavlink.MAVLink(None)
+    sent = []
+
+    def param_set_send(name, value):
+        # The vehicle echoes every PARAM_SET except for a read-only parameter.
+        sent.append(name)
+        reply = 1.0 if name == 'SYSID_THISMAV' else value
+        vehicle.notify_message_listeners('PARAM_VALUE', mav.param_value_encode(name.encode(), reply, 9, 3, 0))
+
+    vehicle._master.param_set_send = param_set_send
+    try:
+        results = vehicle.parameters.set_many({'wpnav_speed': 600, 'RTL_ALT': 1200.1, 'SYSID_THISMAV': 2},
+                                               window=2, retries=2)
+        assert_equals(results, {'WPNAV_SPEED': True, 'RTL_ALT': True, 'SYSID_THISMAV': False})
+        # One request and two resends for the parameter the vehicle keeps reporting unchanged.
+        assert_equals(sorted(sent), ['RTL_ALT', 'SYSID_THISMAV', 'SYSID_THISMAV', 'SYSID_THISMAV', 'WPNAV_SPEED'])
+        assert vehicle.parameters.set('RTL_ALT', 1500)
+
+        del sent[:]
+        assert not vehicle.parameters.set('SYSID_THISMAV', 3, timeout=0.01)
+        assert_equals(sent, ['SYSID_THISMAV'] * 4)
+    finally:
+        vehicle.close()
+
+
+def test_set_many_callbacks_do_not_block_param_value_delivery():
+    handler = MAVConnection('udpout:127.0.0.1:9')
+    vehicle = Vehicle(handler)
+    handler.start()
+    mav = mavutil.mavlink.MAVLink(None)
+    vehicle._master.param_set_send = lambda name, value: vehicle.notify_message_listeners(
+        'PARAM_VALUE', mav.param_value_encode(name.encode(), value, 9, 2, 0))
+    delivered = []
+
+    def callback(name, ok):
+        # A slow callback: the receive thread must still be able to deliver PARAM_VALUEs meanwhile.
+        receiver = threading.Thread(target=vehicle.notify_message_listeners, args=(
+            'PARAM_VALUE', mav.param_value_encode(b'OTHER', 1.0, 9, 2, 1)))
+        receiver.start()
+        receiver.join(1.0)
+        delivered.append((name, ok, not receiver.is_alive()))
+
+    try:
+        vehicle.parameters.set_many({'WPNAV_SPEED': 600, 'RTL_ALT': 1200}, callback=callback)
+        assert_equals(sorted(delivered), [('RTL_ALT', True, True), ('WPNAV_SPEED', True, True)])
+    finally:
+        vehicle.close()
@@ -1,6 +1,6 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import drones
+from app.routers import drones, fleet, telemetry
 
 # FastAPI 애플리케이션 초기화
 app = FastAPI()
@@ -16,5 +16,9 @@ app.add_middleware(
 
 # 드론 관련 라우터를 애플리케이션에 포함
 app.include_router(drones.router)
+# 텔레메트리 WebSocket 라우터를 애플리케이션에 포함
+app.include_router(telemetry.router)
+# 편대 명령 라우터를 애플리케이션에 포함
+app.include_router(fleet.router)
 
 # 추가적인 미들웨어나 시작 이벤트를 여기에 추가할 수 있음
\ No newline at end of file
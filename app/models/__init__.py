@@ -1,10 +1,12 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 # 드론 연결 요청 모델 정의
 class DroneConnectionRequest(BaseModel):
     drone_id: str  # 드론의 고유 ID
     connection_string: str  # 드론 연결을 위한 문자열
+    system_id: Optional[int] = None  # MAVLink 시스템 ID (udpmux 공유 포트 연결 시 필수)
+    tags: List[str] = []  # 편대 명령에서 드론을 묶어 선택하기 위한 태그 (예: ["survey", "team-a"])
 
 # 드론 텔레메트리 응답 모델 정의
 class TelemetryResponse(BaseModel):
@@ -37,6 +39,21 @@ class CommandRequest(BaseModel):
 class FlightModeRequest(BaseModel):
     mode: str  # 변경할 비행 모드 (예: "GUIDED", "AUTO", "RTL", "LAND" 등)
 
+# 스트림 프로필 변경 요청 모델
+class StreamProfileRequest(BaseModel):
+    profile: str  # 적용할 스트림 프로필 (예: "map-view", "mission-monitor", "idle")
+
+# 파라미터 일괄 적용 요청 모델 (params 또는 profile 중 하나 지정)
+class ParamApplyRequest(BaseModel):
+    params: Optional[Dict[str, float]] = None  # 적용할 파라미터 {"이름": 값}
+    profile: Optional[str] = None  # 적용할 파라미터 프로필 이름 (param_profiles 디렉터리)
+    prefix: Optional[str] = None  # 지정 시 해당 접두사로 시작하는 파라미터만 적용 (예: "ATC_")
+
+# 현재 파라미터를 프로필로 저장하는 요청 모델
+class ParamProfileSaveRequest(BaseModel):
+    name: str  # 저장할 프로필 이름
+    prefix: Optional[str] = None  # 지정 시 해당 접두사로 시작하는 파라미터만 저장
+
 # GPS 좌표 모델 정의
 class GPSPosition(BaseModel):
     latitude: float  # 위도
@@ -48,4 +65,13 @@ class HomePositionRequest(BaseModel):
     latitude: float  # 위도
     longitude: float  # 경도
     altitude: float  # 고도 (상대 고도)
-    set_current: bool = False  # 현재 위치를 홈으로 설정할지 여부
\ No newline at end of file
+    set_current: bool = False  # 현재 위치를 홈으로 설정할지 여부
+
+# 편대 명령 요청 모델 (drone_ids 또는 tags 로 대상 선택)
+class FleetCommandRequest(BaseModel):
+    operation: str  # 실행할 작업 (arm, disarm, takeoff, land, rtl, mode)
+    drone_ids: Optional[List[str]] = None  # 대상 드론 ID 목록
+    tags: Optional[List[str]] = None  # 지정한 태그를 모두 가진 드론을 대상으로 선택
+    mode: Optional[str] = None  # operation 이 mode 일 때 변경할 비행 모드
+    altitude: Optional[float] = None  # operation 이 takeoff 일 때 이륙 고도 (미터)
+    concurrency: Optional[int] = None  # 동시에 명령을 보낼 드론 수 (기본값 FLEET_CONCURRENCY)
@@ -1,28 +1,88 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
-from app.models import DroneConnectionRequest, TelemetryResponse, CommandRequest, FlightModeRequest, GPSPosition, HomePositionRequest
-from app.services import drone_service
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Header, Response
+from fastapi.responses import StreamingResponse
+from app.models import DroneConnectionRequest, TelemetryResponse, CommandRequest, FlightModeRequest, GPSPosition, HomePositionRequest, StreamProfileRequest, ParamApplyRequest, ParamProfileSaveRequest
+from app.services import drone_service, param_service, telemetry_codec
+import json
 import os
 
 # 드론 관련 API 라우터 생성
 router = APIRouter(prefix="/drones", tags=["drones"])
 
-# 드론 연결 엔드포인트
-@router.post("/connect")
+# 드론 연결 엔드포인트 (연결은 백그라운드에서 진행되며 즉시 202 반환)
+@router.post("/connect", status_code=202)
 async def connect_drone(request: DroneConnectionRequest):
     # 드론 연결 요청을 처리하고 결과 반환
     return await drone_service.connect_drone(request)
 
+# 드론 연결 진행 상황 조회 엔드포인트
+@router.get("/{drone_id}/connection")
+async def get_connection_status(drone_id: str):
+    # 하트비트 수신 여부, 비행 모드, 파라미터 다운로드 진행률 반환
+    return await drone_service.get_connection_status(drone_id)
+
 # 연결된 드론 목록 조회 엔드포인트
 @router.get("/")
 async def list_connected_drones():
     # 현재 연결된 드론 목록 반환 (await 추가)
     return await drone_service.list_connected_drones()
 
+# 스트림 프로필 목록 조회 엔드포인트
+@router.get("/stream-profiles")
+async def list_stream_profiles():
+    # 프로필별 메시지 전송 주기와 드론별 현재 프로필 반환
+    return await drone_service.list_stream_profiles()
+
+# 파라미터 프로필 목록 조회 엔드포인트
+@router.get("/param-profiles")
+async def list_param_profiles():
+    # param_profiles 디렉터리의 프로필 이름 목록 반환
+    return await param_service.list_param_profiles()
+
+# 여러 드론의 텔레메트리 일괄 조회 엔드포인트
+@router.get("/telemetry")
+async def get_fleet_telemetry(ids: str = None, fields: str = None, accept: str = Header(None)):
+    """
+    연결된 드론의 텔레메트리를 한 번에 조회하는 API
+    :param ids: 조회할 드론 ID 목록 (쉼표로 구분, 생략 시 전체)
+    :param fields: 반환할 필드 목록 (예: latitude,longitude,altitude,mode, 생략 시 전체)
+    """
+    result = await drone_service.get_fleet_telemetry(ids, fields)
+    # Accept 헤더가 msgpack/cbor 를 요청하면 드론별 값을 fields 순서 배열로 응답
+    encoding = telemetry_codec.negotiate_accept(accept)
+    if encoding != "json":
+        fields = result["fields"]
+        result["drones"] = {drone_id: [telemetry[field] for field in fields]
+                            for drone_id, telemetry in result["drones"].items()}
+        return Response(telemetry_codec.dumps(encoding, result),
+                        media_type=telemetry_codec.ENCODINGS[encoding][0])
+    return result
+
+# 드론의 최근 텔레메트리 기록 조회 엔드포인트 (궤적 표시, 단기 차트용)
+@router.get("/{drone_id}/history")
+async def get_telemetry_history(drone_id: str, seconds: Optional[float] = None, points: Optional[int] = None,
+                                fields: str = None, how: str = "mean"):
+    # seconds: 최근 몇 초 (생략 시 보관 중인 전체), points: 최대 점 개수 (시간 구간별로 줄임)
+    return await drone_service.get_telemetry_history(drone_id, seconds, points, fields, how)
+
+# 드론의 비행 궤적 조회 엔드포인트 (지도 궤적 표시용, 서버에서 점 개수를 줄여서 반환)
+@router.get("/{drone_id}/track")
+async def get_track(drone_id: str, since: Optional[float] = None, max_points: Optional[int] = None,
+                    series: Optional[str] = None):
+    # since: 시작 시각 (epoch 초), max_points: 궤적/시계열별 최대 점 개수, series: 함께 받을 시계열 (예: altitude,battery)
+    return await drone_service.get_track(drone_id, since, max_points, series)
+
 # 특정 드론의 텔레메트리 데이터 조회 엔드포인트
 @router.get("/{drone_id}/telemetry", response_model=TelemetryResponse)
-async def get_telemetry(drone_id: str):
+async def get_telemetry(drone_id: str, accept: str = Header(None)):
     # 드론 ID를 기반으로 텔레메트리 데이터 반환
-    return await drone_service.get_telemetry(drone_id)
+    telemetry = await drone_service.get_telemetry(drone_id)
+    # Accept 헤더가 msgpack/cbor 를 요청하면 고정 필드 순서 배열로 응답
+    encoding = telemetry_codec.negotiate_accept(accept)
+    if encoding != "json":
+        return Response(telemetry_codec.dumps(encoding, telemetry_codec.pack_telemetry(telemetry)),
+                        media_type=telemetry_codec.ENCODINGS[encoding][0])
+    return telemetry
 
 # 드론 Arm 명령 엔드포인트
 @router.post("/{drone_id}/arm")
@@ -77,6 +137,15 @@ async def upload_mission(drone_id: str, mission: list[dict]):
     """
     return await drone_service.upload_mission(drone_id, mission)
 
+# 미션 업로드 진행 상황 조회 엔드포인트
+@router.get("/{drone_id}/mission/upload-progress")
+async def get_mission_upload_progress(drone_id: str):
+    """
+    마지막 미션 업로드의 진행 상황을 조회하는 API (state: uploading, uploaded, failed)
+    :param drone_id: 드론의 고유 ID
+    """
+    return await drone_service.get_mission_upload_progress(drone_id)
+
 # 드론 비행 모드 변경 엔드포인트
 @router.post("/{drone_id}/mode")
 async def change_flight_mode(drone_id: str, request: FlightModeRequest):
@@ -87,6 +156,76 @@ async def change_flight_mode(drone_id: str, request: FlightModeRequest):
     """
     return await drone_service.change_flight_mode(drone_id, request.mode)
 
+# 드론 스트림 프로필 변경 엔드포인트
+@router.post("/{drone_id}/stream-profile")
+async def set_stream_profile(drone_id: str, request: StreamProfileRequest):
+    """
+    드론이 보내는 메시지별 전송 주기를 프로필에 맞게 변경하는 API
+    :param drone_id: 드론의 고유 ID
+    :param request: 적용할 스트림 프로필 (map-view, mission-monitor, idle)
+    """
+    return await drone_service.set_stream_profile(drone_id, request.profile)
+
+# 드론 파라미터 조회 엔드포인트
+@router.get("/{drone_id}/params")
+async def get_params(drone_id: str, prefix: str = None, if_none_match: str = Header(None)):
+    """
+    드론의 파라미터 목록을 조회하는 API
+    :param drone_id: 드론의 고유 ID
+    :param prefix: 지정 시 해당 접두사로 시작하는 파라미터만 반환 (예: ATC_)
+    """
+    result, etag = await param_service.get_params(drone_id, prefix)
+    # 파라미터가 바뀌지 않았으면 본문 없이 304 응답
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(json.dumps(result), media_type="application/json", headers={"ETag": etag})
+
+# 드론 파라미터와 프로필 비교 엔드포인트
+@router.get("/{drone_id}/params/diff")
+async def diff_params(drone_id: str, against: str, prefix: str = None):
+    """
+    드론의 현재 파라미터를 프로필과 비교하는 API
+    :param drone_id: 드론의 고유 ID
+    :param against: 비교할 프로필 이름
+    :param prefix: 지정 시 해당 접두사로 시작하는 파라미터만 비교
+    """
+    return await param_service.diff_params(drone_id, against, prefix)
+
+# 드론 파라미터 내보내기 엔드포인트
+@router.get("/{drone_id}/params/export")
+async def export_params(drone_id: str, format: str = "param", prefix: str = None):
+    """
+    드론의 파라미터를 파일로 내보내는 API
+    :param drone_id: 드론의 고유 ID
+    :param format: param (Mission Planner 형식 NAME,VALUE) 또는 json
+    """
+    content = await param_service.export_params(drone_id, format, prefix)
+    media_type = "application/json" if format == "json" else "text/plain"
+    filename = f"{drone_id}.{'json' if format == 'json' else 'param'}"
+    return Response(content, media_type=media_type,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+# 드론 파라미터를 프로필로 저장하는 엔드포인트
+@router.post("/{drone_id}/params/profile")
+async def save_param_profile(drone_id: str, request: ParamProfileSaveRequest):
+    """
+    드론의 현재 파라미터를 프로필로 저장하는 API (다른 드론과 비교/적용할 때 사용)
+    :param drone_id: 드론의 고유 ID
+    :param request: 저장할 프로필 이름과 접두사
+    """
+    return await param_service.save_param_profile(drone_id, request)
+
+# 드론 파라미터 일괄 적용 엔드포인트 (진행 상황을 NDJSON 으로 스트리밍)
+@router.put("/{drone_id}/params")
+async def apply_params(drone_id: str, request: ParamApplyRequest):
+    """
+    드론에 파라미터를 일괄 적용하는 API
+    :param drone_id: 드론의 고유 ID
+    :param request: 적용할 파라미터 또는 프로필 이름
+    """
+    progress = await param_service.apply_params(drone_id, request)
+    return StreamingResponse(progress, media_type="application/x-ndjson")
+
 # GPS 위치로 비행하는 엔드포인트
 @router.post("/{drone_id}/fly-to")
 async def fly_to_position(drone_id: str, position: GPSPosition):
@@ -117,11 +256,12 @@ async def get_drone_mission(drone_id: str):
 
 # 드론 미션 파일 업로드 및 저장 엔드포인트
 @router.post("/{drone_id}/upload-mission-file")
-async def upload_mission_file(drone_id: str, file: UploadFile = File(...)):
+async def upload_mission_file(drone_id: str, file: UploadFile = File(...), altitude: Optional[float] = None):
     """
     드론 ID와 미션 파일을 업로드 받아 서버에 저장하는 API
     :param drone_id: 드론의 고유 ID
     :param file: 업로드할 미션 파일
+    :param altitude: 고도가 없는 좌표에 사용할 고도 (m)
     """
     # 파일 저장 로직을 drone_service로 이동
-    return await drone_service.save_mission_file(drone_id, file)
\ No newline at end of file
+    return await drone_service.save_mission_file(drone_id, file, altitude)
\ No newline at end of file
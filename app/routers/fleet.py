@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+from app.models import FleetCommandRequest
+from app.services import fleet_service
+
+# 편대 (여러 드론) 관련 API 라우터 생성
+router = APIRouter(prefix="/fleet", tags=["fleet"])
+
+# 여러 드론에 같은 작업을 동시에 실행하는 엔드포인트
+@router.post("/command")
+async def fleet_command(request: FleetCommandRequest):
+    """
+    대상 드론들에 작업을 동시에 실행하고 드론별 결과를 끝나는 순서대로 반환하는 API
+    :param request: 작업 이름과 대상 (drone_ids 또는 tags)
+    """
+    progress = await fleet_service.run_fleet_command(request)
+    return StreamingResponse(progress, media_type="application/x-ndjson")
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, WebSocket
+from app.services import telemetry_service, telemetry_codec
+
+# 텔레메트리 스트림 라우터 생성
+router = APIRouter(tags=["telemetry"])
+
+# 텔레메트리 WebSocket 엔드포인트
+@router.websocket("/ws/telemetry")
+async def telemetry_stream(websocket: WebSocket, rate: float = None, ids: str = None, delta: bool = False):
+    """
+    연결된 드론의 텔레메트리를 실시간으로 전송하는 WebSocket
+    :param rate: 초당 전송 횟수 (기본값: TELEMETRY_WS_RATE 환경변수 또는 5Hz)
+    :param ids: 구독할 드론 ID 목록 (쉼표로 구분, 생략 시 전체)
+    :param delta: True 이면 바뀐 필드만 전송 (주기적으로 전체 키프레임 전송)
+    """
+    await telemetry_service.stream_telemetry(websocket, rate, ids, delta)
+
+# 바이너리 텔레메트리 스키마 조회 엔드포인트
+@router.get("/telemetry/schema")
+async def telemetry_schema():
+    # 바이너리 인코딩의 필드 순서와 서버에서 사용 가능한 인코딩 반환
+    return {
+        "fields": list(telemetry_codec.TELEMETRY_FIELDS),
+        "encodings": telemetry_codec.available_encodings(),
+    }
@@ -1,27 +1,209 @@
 from app.libs.dronekit import connect, Command, LocationGlobalRelative, LocationGlobal
+from app.libs.dronekit import TimeoutError as VehicleTimeoutError
+from app.libs.dronekit.ingest import IngestPolicy
+from app.libs.dronekit.mission import MissionTransferError, mission_fingerprint, request_mission_count
 from fastapi import HTTPException, UploadFile
 import asyncio
+import functools
 from pymavlink import mavutil
 import os
+import time
 from app.models import GPSPosition, HomePositionRequest
+from app.services import mission_parser, telemetry_service, track_simplify
 from datetime import datetime
 
 # 연결된 드론을 저장하는 딕셔너리
 connected_drones = {}
 
+# 연결 작업(백그라운드 연결 진행 상황)을 저장하는 딕셔너리
+connection_jobs = {}
+
+# 드론별 태그 (편대 명령의 대상 선택에 사용)
+drone_tags = {}
+
+# 연결 작업 단계 (순서대로 진행)
+CONNECTION_STAGES = ("opening", "waiting_heartbeat", "downloading_parameters", "connected")
+
+# 수신 메시지 필터 사용 여부 (Vehicle 이 사용하지 않는 메시지는 디코딩 전에 버림, "0" 이면 모두 수신)
+INGEST_FILTER = os.environ.get("INGEST_FILTER", "1") != "0"
+# 메시지별 최대 수신 주기 (Hz, 초과분은 버림)
+INGEST_RATES = {"ATTITUDE": float(os.environ.get("INGEST_ATTITUDE_RATE", "10"))}
+
+# 파라미터 캐시 디렉터리 (재연결 시 디스크에서 즉시 불러오고 백그라운드에서 다시 검증)
+PARAM_CACHE_DIR = os.environ.get("PARAM_CACHE_DIR", "param_cache")
+
+# 서버에서 사용하지 않는 고속 스트림 (모든 스트림 프로필에서 전송 중지)
+_UNUSED_STREAMS = {"RAW_IMU": 0, "SCALED_IMU2": 0, "SCALED_PRESSURE": 0, "SERVO_OUTPUT_RAW": 0,
+                   "NAV_CONTROLLER_OUTPUT": 0, "RC_CHANNELS": 0}
+
+# 스트림 프로필 (메시지별 전송 주기 Hz, 화면에서 보고 있는 정보에 맞춰 링크 대역폭 조절)
+STREAM_PROFILES = {
+    # 지도 화면: 위치/자세를 빠르게 갱신
+    "map-view": dict(_UNUSED_STREAMS, GLOBAL_POSITION_INT=5, ATTITUDE=10, VFR_HUD=4,
+                     SYS_STATUS=1, GPS_RAW_INT=1, MISSION_CURRENT=1),
+    # 미션 모니터링: 진행 상황 위주로 낮은 주기
+    "mission-monitor": dict(_UNUSED_STREAMS, GLOBAL_POSITION_INT=2, ATTITUDE=1, VFR_HUD=2,
+                            SYS_STATUS=1, GPS_RAW_INT=1, MISSION_CURRENT=2),
+    # 대기: 연결 유지와 상태 확인에 필요한 최소 주기
+    "idle": dict(_UNUSED_STREAMS, GLOBAL_POSITION_INT=0.5, ATTITUDE=0.5, VFR_HUD=0.5,
+                 SYS_STATUS=0.5, GPS_RAW_INT=0.2, MISSION_CURRENT=0.2),
+}
+
+# 드론별 현재 적용된 스트림 프로필 이름
+stream_profiles = {}
+
+# 드론별 마지막 미션 업로드 진행 상황 (state: uploading, uploaded, failed)
+mission_uploads = {}
+# 드론별 마지막으로 업로드/다운로드한 미션의 지문 (hash, 항목별 해시, opaque id)
+mission_fingerprints = {}
+# 명령 (COMMAND_LONG) 응답 대기 시간 (초, 재전송 포함)
+COMMAND_ACK_TIMEOUT = float(os.environ.get("COMMAND_ACK_TIMEOUT", "10"))
+# 비행 모드 변경 확인 대기 시간 (초)
+MODE_CHANGE_TIMEOUT = float(os.environ.get("MODE_CHANGE_TIMEOUT", "5"))
+# 드론별로 메모리에 보관할 텔레메트리 기록 길이 (초, 0 이면 기록 안 함) 와 기록 주기 (Hz)
+HISTORY_SECONDS = float(os.environ.get("TELEMETRY_HISTORY_SECONDS", "600"))
+HISTORY_RATE = float(os.environ.get("TELEMETRY_HISTORY_RATE", "5"))
+# 궤적 조회 기본 최대 점 개수와 기본 시계열
+TRACK_MAX_POINTS = int(os.environ.get("TRACK_MAX_POINTS", "500"))
+TRACK_SERIES = ("altitude", "groundspeed", "battery")
+# 미션 업로드 전체 제한 시간 (초)
+MISSION_UPLOAD_TIMEOUT = float(os.environ.get("MISSION_UPLOAD_TIMEOUT", "60"))
+# 미션 파일을 읽는 조각 크기 (바이트)
+MISSION_FILE_CHUNK = 64 * 1024
+# 미션 다운로드 전체 제한 시간 (초, 응답이 끊기면 그 전에 실패 처리)
+MISSION_DOWNLOAD_TIMEOUT = float(os.environ.get("MISSION_DOWNLOAD_TIMEOUT", "60"))
+
 # 드론 연결 처리 함수
 async def connect_drone(request):
-    # 이미 연결된 드론인지 확인
+    # 이미 연결된 드론이거나 연결 중인 드론인지 확인
     if request.drone_id in connected_drones:
         raise HTTPException(status_code=400, detail="Drone already connected")
+    job = connection_jobs.get(request.drone_id)
+    if job is not None and job["state"] == "connecting":
+        raise HTTPException(status_code=409, detail="Drone connection already in progress")
+
+    # 연결 작업 등록 후 즉시 반환 (실제 연결은 백그라운드에서 진행)
+    job = {
+        "drone_id": request.drone_id,
+        "state": "connecting",
+        "stage": "opening",
+        "error": None,
+        "vehicle": None,
+        "started_at": datetime.now().isoformat(),
+        "tags": sorted(set(request.tags)),
+    }
+    connection_jobs[request.drone_id] = job
+    job["task"] = asyncio.create_task(_run_connection_job(job, request))
+    return {
+        "message": f"Drone {request.drone_id} connection started",
+        "status_url": f"/drones/{request.drone_id}/connection",
+    }
+
+# 백그라운드 연결 작업 (블로킹 연결 과정은 스레드 풀에서 실행)
+async def _run_connection_job(job, request):
+    loop = asyncio.get_running_loop()
     try:
-        # 드론 연결 시도
-        vehicle = connect(request.connection_string, wait_ready=True, drone_id=request.drone_id)
-        connected_drones[request.drone_id] = vehicle  # 연결된 드론 저장
-        return {"message": f"Drone {request.drone_id} connected successfully"}
+        vehicle = await loop.run_in_executor(None, _connect_blocking, job, request)
     except Exception as e:
-        # 연결 실패 시 예외 처리
-        raise HTTPException(status_code=500, detail=f"Failed to connect to drone: {str(e)}")
+        # 연결 실패 시 작업 상태 기록 및 링크 정리
+        job["state"] = "failed"
+        job["error"] = str(e)
+        vehicle = job["vehicle"]
+        if vehicle is not None:
+            await loop.run_in_executor(None, vehicle.close)
+        return
+    if job["state"] != "connecting":
+        # 연결 도중 취소된 경우
+        await loop.run_in_executor(None, vehicle.close)
+        return
+    job["stage"] = "connected"
+    job["state"] = "connected"
+    connected_drones[request.drone_id] = vehicle  # 연결된 드론 저장
+    drone_tags[request.drone_id] = set(request.tags)
+    telemetry_service.watch_vehicle(request.drone_id, vehicle)  # 텔레메트리 스트림 구독
+
+# 스레드 풀에서 실행되는 실제 연결 과정 (단계별로 작업 상태 갱신)
+def _connect_blocking(job, request):
+    vehicle = connect(request.connection_string, _initialize=False, drone_id=request.drone_id,
+                      target_system=request.system_id or 0, param_cache=PARAM_CACHE_DIR or None)
+    job["vehicle"] = vehicle
+    if INGEST_FILTER:
+        vehicle.set_ingest_policy(IngestPolicy.consumed_by(vehicle, rates=INGEST_RATES))
+    if HISTORY_SECONDS > 0:
+        # 위치/속도/배터리/자세를 고정 크기 링 버퍼에 기록 (드론당 메모리 고정)
+        vehicle.enable_history(HISTORY_SECONDS, HISTORY_RATE,
+                               fields=tuple(telemetry_service.HISTORY_FIELDS.values()))
+    if job["state"] != "connecting":
+        # 링크를 여는 동안 연결이 취소된 경우
+        raise RuntimeError("Connection cancelled")
+    job["stage"] = "waiting_heartbeat"
+    vehicle.initialize()
+    job["stage"] = "downloading_parameters"
+    vehicle.wait_ready(True)
+    return vehicle
+
+# 드론 연결 진행 상황 조회 함수
+async def get_connection_status(drone_id: str):
+    job = connection_jobs.get(drone_id)
+    if job is None:
+        if drone_id in connected_drones:
+            return {"drone_id": drone_id, "state": "connected", "stage": "connected",
+                    "tags": sorted(drone_tags.get(drone_id, ()))}
+        raise HTTPException(status_code=404, detail="No connection job for this drone")
+
+    status = {
+        "drone_id": drone_id,
+        "state": job["state"],
+        "stage": job["stage"],
+        "error": job["error"],
+        "started_at": job["started_at"],
+        "heartbeat": False,
+        "mode": None,
+        "parameters": {"received": 0, "total": None},
+        "tags": job["tags"],
+    }
+    vehicle = job["vehicle"]
+    if vehicle is not None and CONNECTION_STAGES.index(job["stage"]) >= CONNECTION_STAGES.index("downloading_parameters"):
+        # 하트비트 수신 이후에만 모드/파라미터 진행률이 의미 있음
+        received, total = vehicle.parameters.download_progress
+        status["heartbeat"] = True
+        status["mode"] = vehicle.mode.name
+        status["last_heartbeat"] = vehicle.last_heartbeat
+        # revalidating: 캐시에서 불러온 파라미터를 백그라운드에서 다시 받는 중
+        status["parameters"] = {"received": received, "total": total,
+                                "revalidating": vehicle.parameters.revalidating}
+    return status
+
+# COMMAND_LONG 명령의 COMMAND_ACK 결과를 기다림 (거부되면 409, 응답이 없으면 504)
+async def _run_command(future, action: str):
+    try:
+        result = await asyncio.wait_for(asyncio.wrap_future(future), COMMAND_ACK_TIMEOUT)
+    except (VehicleTimeoutError, asyncio.TimeoutError):
+        raise HTTPException(status_code=504, detail=f"No response from drone to {action}")
+    if not result.accepted:
+        raise HTTPException(status_code=409, detail=f"Drone rejected {action}: {result.name}")
+    return result
+
+# 명령 결과를 응답에 포함할 형태로 변환
+def _command_outcome(result):
+    return {"result": result.name, "latency_ms": round(result.latency * 1000, 1), "attempts": result.attempts}
+
+# 비행 모드를 변경하고 드론이 HEARTBEAT 로 새 모드를 알려올 때까지 대기
+async def _set_mode(vehicle, mode: str):
+    if vehicle.mode.name == mode:
+        return None
+    try:
+        future = vehicle.set_mode(mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result = await _run_command(future, f"mode change to {mode}")
+    try:
+        # 모드 속성이 바뀌는 즉시 깨어남 (주기적으로 확인하지 않음)
+        await vehicle.until(lambda v: v.mode.name == mode, timeout=MODE_CHANGE_TIMEOUT)
+    except VehicleTimeoutError:
+        raise HTTPException(status_code=504,
+                            detail=f"Drone did not switch to {mode} within {MODE_CHANGE_TIMEOUT} seconds")
+    return result
 
 # 드론을 Arm 상태로 전환하는 함수
 async def arm_drone(drone_id: str):
@@ -31,9 +213,11 @@ async def arm_drone(drone_id: str):
     try:
         # 드론 객체 가져오기
         vehicle = connected_drones[drone_id]
-        # Arm 상태로 전환
-        vehicle.armed = True
-        return {"message": f"Drone {drone_id} is now armed."}
+        # Arm 명령 전송 후 COMMAND_ACK 확인 (사전 점검 실패 시 거부됨)
+        result = await _run_command(vehicle.set_armed(True), "arming")
+        return dict(_command_outcome(result), message=f"Drone {drone_id} is now armed.")
+    except HTTPException:
+        raise
     except Exception as e:
         # 오류 처리
         raise HTTPException(status_code=500, detail=f"Failed to arm drone: {str(e)}")
@@ -46,9 +230,11 @@ async def disarm_drone(drone_id: str):
     try:
         # 드론 객체 가져오기
         vehicle = connected_drones[drone_id]
-        # Disarm 상태로 전환
-        vehicle.armed = False
-        return {"message": f"Drone {drone_id} is now disarmed."}
+        # Disarm 명령 전송 후 COMMAND_ACK 확인
+        result = await _run_command(vehicle.set_armed(False), "disarming")
+        return dict(_command_outcome(result), message=f"Drone {drone_id} is now disarmed.")
+    except HTTPException:
+        raise
     except Exception as e:
         # 오류 처리
         raise HTTPException(status_code=500, detail=f"Failed to disarm drone: {str(e)}")
@@ -66,15 +252,14 @@ async def takeoff_drone(drone_id: str, altitude: float):
         if not vehicle.armed:
             raise HTTPException(status_code=400, detail="Drone is not armed")
 
-        # 드론이 Guided 모드인지 확인
-        if vehicle.mode.name != "GUIDED":
-            vehicle.mode = "GUIDED"  # Guided 모드로 변경
-            while vehicle.mode.name != "GUIDED":
-                await asyncio.sleep(0.5)  # 모드 변경 대기
+        # 드론이 Guided 모드인지 확인 (아니면 변경 후 HEARTBEAT 로 확인될 때까지 대기)
+        await _set_mode(vehicle, "GUIDED")
 
-        # 이륙 명령 실행
-        vehicle.simple_takeoff(altitude)
-        return {"message": f"Drone {drone_id} is taking off to {altitude} meters."}
+        # 이륙 명령 실행 (드론이 명령을 받아들였는지 COMMAND_ACK 로 확인)
+        result = await _run_command(vehicle.simple_takeoff(altitude), "takeoff")
+        return dict(_command_outcome(result), message=f"Drone {drone_id} is taking off to {altitude} meters.")
+    except HTTPException:
+        raise
     except Exception as e:
         # 오류 처리
         raise HTTPException(status_code=500, detail=f"Failed to take off: {str(e)}")
@@ -88,27 +273,40 @@ async def land_drone(drone_id: str):
         # 드론 객체 가져오기
         vehicle = connected_drones[drone_id]
 
-        # 드론이 Guided 모드인지 확인
-        if vehicle.mode.name != "GUIDED":
-            vehicle.mode = "GUIDED"  # Guided 모드로 변경
-            while vehicle.mode.name != "GUIDED":
-                await asyncio.sleep(0.5)  # 모드 변경 대기
+        # 드론이 Guided 모드인지 확인 (아니면 변경 후 HEARTBEAT 로 확인될 때까지 대기)
+        await _set_mode(vehicle, "GUIDED")
 
         # 착륙 명령 실행
-        vehicle.mode = "LAND"
-        return {"message": f"Drone {drone_id} is landing."}
+        result = await _set_mode(vehicle, "LAND")
+        outcome = _command_outcome(result) if result is not None else {}
+        return dict(outcome, message=f"Drone {drone_id} is landing.")
+    except HTTPException:
+        raise
     except Exception as e:
         # 오류 처리
         raise HTTPException(status_code=500, detail=f"Failed to land drone: {str(e)}")
 
 # 드론 연결 해제 함수
 async def disconnect_drone(drone_id: str):
+    # 연결 중인 드론이면 연결 작업 취소
+    job = connection_jobs.pop(drone_id, None)
+    if job is not None and job["state"] == "connecting":
+        job["state"] = "cancelled"
+        if job["vehicle"] is not None:
+            # 링크를 닫으면 initialize/wait_ready 가 즉시 예외로 종료됨
+            await asyncio.get_running_loop().run_in_executor(None, job["vehicle"].close)
+        return {"message": f"Drone {drone_id} connection cancelled."}
     # 드론이 연결되어 있는지 확인
     if drone_id not in connected_drones:
         raise HTTPException(status_code=404, detail="Drone not connected")
     try:
         # 드론 객체 가져오기
         vehicle = connected_drones.pop(drone_id)
+        telemetry_service.unwatch_vehicle(drone_id)
+        stream_profiles.pop(drone_id, None)
+        mission_uploads.pop(drone_id, None)
+        mission_fingerprints.pop(drone_id, None)
+        drone_tags.pop(drone_id, None)
         # 드론 연결 해제
         vehicle.close()
         return {"message": f"Drone {drone_id} has been disconnected."}
@@ -128,14 +326,96 @@ async def execute_command(drone_id: str, request):
         if request.command == "set_speed":
             vehicle.airspeed = request.params[0]
         elif request.command == "set_altitude":
-            vehicle.simple_takeoff(request.params[0])
+            result = await _run_command(vehicle.simple_takeoff(request.params[0]), "takeoff")
+            return dict(_command_outcome(result),
+                        message=f"Command {request.command} executed successfully on drone {drone_id}.")
         else:
             raise HTTPException(status_code=400, detail="Unsupported command")
         return {"message": f"Command {request.command} executed successfully on drone {drone_id}."}
+    except HTTPException:
+        raise
     except Exception as e:
         # 오류 처리
         raise HTTPException(status_code=500, detail=f"Failed to execute command: {str(e)}")
 
+# 드론에 기록된 미션의 지문 저장 (다음 업로드 때 같은 내용이면 건너뛰고, 일부만 바뀌었으면 해당 구간만 전송)
+def _remember_mission(drone_id: str, commands: list, opaque_id=None):
+    mission_fingerprints[drone_id] = {
+        "hash": mission_fingerprint(commands),
+        # 항목별 해시 (바뀐 구간 계산용, 홈 제외 1번 항목부터)
+        "items": [mission_fingerprint([command]) for command in commands],
+        "opaque_id": opaque_id,
+    }
+
+# 홈 포지션과 미션 명령을 한 번에 업로드하는 함수 (진행 상황은 mission_uploads 에 기록)
+async def _upload_commands(drone_id: str, vehicle, commands: list):
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    total = len(commands) + 1
+    mode = "full"
+    start = end = None
+
+    # 마지막으로 기록한 미션이 드론에 그대로 있는지 MISSION_COUNT (지원 시 opaque id 포함) 로 확인
+    cached = mission_fingerprints.get(drone_id)
+    if cached is not None:
+        try:
+            count, opaque_id = await loop.run_in_executor(None, request_mission_count, vehicle)
+        except Exception:
+            count, opaque_id = None, None
+        verified = count == len(cached["items"]) + 1 and (
+            opaque_id is None or cached["opaque_id"] is None or opaque_id == cached["opaque_id"])
+        if not verified:
+            mission_fingerprints.pop(drone_id, None)
+        elif cached["hash"] == mission_fingerprint(commands):
+            # 같은 미션이면 전송하지 않음
+            mission_uploads[drone_id] = {"state": "unchanged", "sent": 0, "total": total, "error": None}
+            return {"items": total, "mode": "unchanged", "sent": 0,
+                    "duration": round(time.monotonic() - started, 3)}
+        elif len(cached["items"]) == len(commands):
+            # 개수가 같으면 바뀐 첫 항목부터 마지막 항목까지만 전송 (MISSION_WRITE_PARTIAL_LIST)
+            changed = [index + 1 for index, command in enumerate(commands)
+                       if mission_fingerprint([command]) != cached["items"][index]]
+            start, end = changed[0], changed[-1]
+            mode = "partial"
+
+    cmds = vehicle.commands
+    progress = {"state": "uploading", "sent": 0, "total": total if mode == "full" else end - start + 1, "error": None}
+    mission_uploads[drone_id] = progress
+
+    def on_progress(sent, total):
+        progress.update(sent=sent, total=total)
+
+    # 미션을 새로 구성한 뒤 업로드 (clear() 는 진행 중인 미션 다운로드를 기다리고
+    # upload() 는 MISSION_ACK 를 받을 때까지 블로킹되므로 둘 다 스레드 풀에서 실행)
+    def upload(start=None, end=None):
+        # 미션 초기화 (홈 포지션도 새로 넣으므로 기존 홈 항목은 남기지 않음)
+        cmds.clear(keep_home=False)
+        # 홈 포지션 추가 (기본값, 0번 항목)
+        location = vehicle.location.global_relative_frame
+        cmds.add(Command(0, 0, 1, mavutil.mavlink.MAV_FRAME_GLOBAL, mavutil.mavlink.MAV_CMD_NAV_WAYPOINT, 0, 1, 0, 0, 0, 0, location.lat, location.lon, 0))
+        for command in commands:
+            cmds.add(command)
+        cmds.upload(timeout=MISSION_UPLOAD_TIMEOUT, progress=on_progress, start=start, end=end)
+
+    try:
+        try:
+            await loop.run_in_executor(None, functools.partial(upload, start=start, end=end))
+        except MissionTransferError:
+            if mode != "partial":
+                raise
+            # 부분 업로드를 거부하면 전체 업로드
+            mode = "full"
+            progress.update(sent=0, total=total)
+            await loop.run_in_executor(None, upload)
+    except Exception as e:
+        mission_fingerprints.pop(drone_id, None)
+        progress.update(state="failed", error=str(e))
+        raise HTTPException(status_code=500, detail=f"Failed to upload mission: {str(e)}")
+    progress["state"] = "uploaded"
+    _remember_mission(drone_id, commands, cmds.opaque_id)
+    return {"items": total, "mode": mode, "sent": progress["sent"],
+            "duration": round(time.monotonic() - started, 3)}
+
 # 드론 자동비행 미션 업로드 함수
 async def upload_mission(drone_id: str, mission: list[dict]):
 
@@ -145,69 +425,33 @@ async def upload_mission(drone_id: str, mission: list[dict]):
     try:
         # 드론 객체 가져오기
         vehicle = connected_drones[drone_id]
+        commands = []
+        errors = []
 
-        # 미션 초기화
-        cmds = vehicle.commands
-        cmds.clear()
-        vehicle.flush()
-
-        # 홈 포지션 추가 (기본값)
-        home_position = Command(0, 0, 1, mavutil.mavlink.MAV_FRAME_GLOBAL, mavutil.mavlink.MAV_CMD_NAV_WAYPOINT, 0, 1, 0, 0, 0, 0, vehicle.location.global_relative_frame.lat, vehicle.location.global_relative_frame.lon, 0)
-        cmds.add(home_position)
-        cmds.upload()
-        cmds.clear()
-
-        # 미션 추가
+        # 미션 추가 (파일 업로드와 같은 검증 사용, 잘못된 항목은 모두 모아서 응답)
         for index, waypoint in enumerate(mission):
-            lat = waypoint.get("latitude")
-            lon = waypoint.get("longitude")
-            alt = waypoint.get("altitude")
-            alt_type = waypoint.get("altitude_type", "relative")  # 기본값: relative
-            param1 = waypoint.get("param1", 0)
-            param2 = waypoint.get("param2", 0)
-            param3 = waypoint.get("param3", 0)
-            param4 = waypoint.get("param4", 0)
-            command = waypoint.get("command", "waypoint")
-
-            if lat is None or lon is None or alt is None:
-                raise HTTPException(status_code=400, detail="Invalid mission format")
-
-            # 고도 타입에 따라 프레임 설정
-            if alt_type == "relative":
-                frame = mavutil.mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT
-            elif alt_type == "absolute":
-                frame = mavutil.mavlink.MAV_FRAME_GLOBAL
-            elif alt_type == "terrain":
-                frame = mavutil.mavlink.MAV_FRAME_GLOBAL_TERRAIN_ALT
-            else:
-                raise HTTPException(status_code=400, detail="Invalid altitude type")
-            
-            if command == "waypoint":
-                command_type = mavutil.mavlink.MAV_CMD_NAV_WAYPOINT
-            elif command == "takeoff":
-                command_type = mavutil.mavlink.MAV_CMD_NAV_TAKEOFF
-            elif command == "land":
-                command_type = mavutil.mavlink.MAV_CMD_NAV_LAND
-            elif command == "do_set_servo":
-                command_type = mavutil.mavlink.MAV_CMD_DO_SET_SERVO
-            elif command == "do_change_speed":
-                command_type = mavutil.mavlink.MAV_CMD_DO_CHANGE_SPEED
-            elif command == "land":
-                command_type = mavutil.mavlink.MAV_CMD_NAV_LAND
-
-            # 명령 생성 및 추가
-            cmds.add(
-                Command(index + 1, 0, 0, frame, command_type, 0, 1, param1, param2, param3, param4, lat, lon, alt)
-            )
+            try:
+                commands.append(mission_parser.waypoint_command(waypoint))
+            except ValueError as e:
+                errors.append({"item": index, "error": str(e)})
+        if errors:
+            raise HTTPException(status_code=400, detail=_mission_errors(errors, len(errors)))
 
         # 미션 업로드
-        cmds.upload()
-
-        return {"message": f"Mission uploaded successfully to drone {drone_id}."}
+        result = await _upload_commands(drone_id, vehicle, commands)
+        return dict(result, message=f"Mission uploaded successfully to drone {drone_id}.")
+    except HTTPException:
+        raise
     except Exception as e:
         # 오류 처리
         raise HTTPException(status_code=500, detail=f"Failed to upload mission: {str(e)}")
 
+# 미션 업로드 진행 상황 조회 함수
+async def get_mission_upload_progress(drone_id: str):
+    if drone_id not in mission_uploads:
+        raise HTTPException(status_code=404, detail="No mission upload for this drone")
+    return dict(mission_uploads[drone_id], drone_id=drone_id)
+
 # 드론 텔레메트리 데이터 수집 함수
 async def get_telemetry(drone_id: str):
     # 드론이 연결되어 있는지 확인
@@ -218,44 +462,135 @@ async def get_telemetry(drone_id: str):
         vehicle = connected_drones[drone_id]
 
         # 텔레메트리 데이터 수집
-        telemetry_data = {
-            "drone_id": drone_id,  # 드론 ID 추가
-            "latitude": vehicle.location.global_relative_frame.lat,
-            "longitude": vehicle.location.global_relative_frame.lon,
-            "altitude": vehicle.location.global_relative_frame.alt,  # 상대 고도
-            "altitude_asl": vehicle.location.global_frame.alt,  # 해수면 고도 (ASL)
-            "battery": vehicle.battery.voltage,
-            "airspeed": vehicle.airspeed,
-            "groundspeed": vehicle.groundspeed,
-            "heading": vehicle.heading,
-            "mode": vehicle.mode.name,
-            "armed": vehicle.armed,
-            "pitch": vehicle.attitude.pitch,  # 기체의 피치(앞뒤 기울기)
-            "roll": vehicle.attitude.roll,    # 기체의 롤(좌우 기울기)
-            "yaw": vehicle.attitude.yaw,     # 기체의 요(방향)
-            "signal_strength": vehicle.last_heartbeat,  # 수신 감도값 (마지막 신호 수신 시간)
-        }
-
-        # 홈 위치 정보가 있는 경우에만 추가
-        if vehicle.home_location is not None:
-            telemetry_data.update({
-                "home_latitude": vehicle.home_location.lat,
-                "home_longitude": vehicle.home_location.lon,
-                "home_altitude": vehicle.home_location.alt
-            })
-        else:
-            # 홈 위치가 없는 경우 현재 위치를 홈 위치로 사용
-            telemetry_data.update({
-                "home_latitude": vehicle.location.global_relative_frame.lat,
-                "home_longitude": vehicle.location.global_relative_frame.lon,
-                "home_altitude": vehicle.location.global_relative_frame.alt
-            })
+        telemetry_data = telemetry_service.build_telemetry(drone_id, vehicle)
 
         return telemetry_data
     except Exception as e:
         # 오류 처리
         raise HTTPException(status_code=500, detail=f"Failed to get telemetry: {str(e)}")
 
+# 드론의 최근 텔레메트리 기록 조회 함수 (points 지정 시 시간 구간별 평균으로 줄여서 반환)
+async def get_telemetry_history(drone_id: str, seconds: float = None, points: int = None,
+                                fields: str = None, how: str = "mean"):
+    if drone_id not in connected_drones:
+        raise HTTPException(status_code=404, detail="Drone not connected")
+    history = connected_drones[drone_id].history
+    if history is None:
+        raise HTTPException(status_code=404, detail="Telemetry history is disabled")
+    if fields:
+        names = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in names if field not in telemetry_service.HISTORY_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown history fields: {', '.join(unknown)}")
+    else:
+        names = list(telemetry_service.HISTORY_FIELDS)
+    if seconds is not None and seconds <= 0:
+        raise HTTPException(status_code=400, detail="seconds must be positive")
+    snapshot_fields = [telemetry_service.HISTORY_FIELDS[name] for name in names]
+    try:
+        if points is None:
+            samples = history.window(seconds, fields=snapshot_fields)
+        else:
+            samples = history.downsample(seconds, points, fields=snapshot_fields, how=how)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result = {"drone_id": drone_id, "seconds": seconds, "count": len(samples["time"]), "time": samples["time"]}
+    for name, field in zip(names, snapshot_fields):
+        result[name] = samples[field]
+    return result
+
+# 드론의 비행 궤적 조회 함수 (궤적은 RDP, 시계열은 LTTB 로 max_points 개 이하로 줄임)
+async def get_track(drone_id: str, since: float = None, max_points: int = None, series: str = None):
+    if drone_id not in connected_drones:
+        raise HTTPException(status_code=404, detail="Drone not connected")
+    history = connected_drones[drone_id].history
+    if history is None:
+        raise HTTPException(status_code=404, detail="Telemetry history is disabled")
+    max_points = TRACK_MAX_POINTS if max_points is None else max_points
+    if max_points < 3:
+        raise HTTPException(status_code=400, detail="max_points must be at least 3")
+    if series is None:
+        names = list(TRACK_SERIES)
+    else:
+        names = [name.strip() for name in series.split(",") if name.strip()]
+        unknown = [name for name in names if name not in telemetry_service.HISTORY_FIELDS
+                   or name in ("latitude", "longitude")]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown track series: {', '.join(unknown)}")
+
+    # since: 이 시각 (epoch 초) 이후의 기록만 사용 (생략 시 보관 중인 전체)
+    seconds = None if since is None else max(time.time() - since, 0.0)
+    fields = ["lat", "lon", "alt"] + [telemetry_service.HISTORY_FIELDS[name] for name in names]
+    samples = history.window(seconds, fields=list(dict.fromkeys(fields)))
+
+    def simplify():
+        # GPS 위치가 없는 샘플은 궤적에서 제외
+        rows = [i for i, (lat, lon) in enumerate(zip(samples["lat"], samples["lon"]))
+                if lat is not None and lon is not None]
+        lats = [samples["lat"][i] for i in rows]
+        lons = [samples["lon"][i] for i in rows]
+        alts = [samples["alt"][i] for i in rows]
+        kept = track_simplify.simplify_track(lats, lons, alts, max_points)
+        track = {
+            "time": [samples["time"][rows[i]] for i in kept],
+            "latitude": [lats[i] for i in kept],
+            "longitude": [lons[i] for i in kept],
+            "altitude": [alts[i] for i in kept],
+        }
+        reduced = {}
+        for name in names:
+            column = samples[telemetry_service.HISTORY_FIELDS[name]]
+            present = [i for i, value in enumerate(column) if value is not None]
+            times = [samples["time"][i] for i in present]
+            values = [column[i] for i in present]
+            chosen = track_simplify.downsample_series(times, values, max_points)
+            reduced[name] = {"time": [times[i] for i in chosen], "value": [values[i] for i in chosen]}
+        return len(rows), track, reduced
+
+    # 한 시간 분량 기록도 처리할 수 있도록 이벤트 루프 밖에서 계산
+    started = time.perf_counter()
+    count, track, reduced = await asyncio.get_running_loop().run_in_executor(None, simplify)
+    return {
+        "drone_id": drone_id,
+        "since": since,
+        "samples": count,
+        "points": len(track["time"]),
+        "track": track,
+        "series": reduced,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+# 여러 드론의 텔레메트리를 한 번에 조회하는 함수
+async def get_fleet_telemetry(ids: str = None, fields: str = None):
+    # 요청한 필드 검증 (생략 시 전체 필드)
+    if fields:
+        projection = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in projection if field not in telemetry_service.TELEMETRY_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown telemetry fields: {', '.join(unknown)}")
+    else:
+        projection = list(telemetry_service.TELEMETRY_FIELDS)
+
+    # 드론 목록을 한 번만 읽어 응답 전체가 같은 시점의 목록을 기준으로 만들어지도록 함
+    drones = dict(connected_drones)
+    requested = [drone_id for drone_id in ids.split(",") if drone_id] if ids else list(drones)
+    try:
+        # 이벤트 루프에서 중간 대기 없이 한 번에 수집
+        telemetry = {}
+        for drone_id in requested:
+            vehicle = drones.get(drone_id)
+            if vehicle is not None:
+                telemetry[drone_id] = telemetry_service.build_telemetry(drone_id, vehicle, projection)
+    except Exception as e:
+        # 오류 처리
+        raise HTTPException(status_code=500, detail=f"Failed to get telemetry: {str(e)}")
+    return {
+        "timestamp": datetime.now().timestamp(),
+        "fields": projection,
+        "drones": telemetry,
+        "missing": [drone_id for drone_id in requested if drone_id not in drones],  # 연결되지 않은 드론 ID
+    }
+
 # 연결된 드론 목록을 반환하는 함수
 async def list_connected_drones():
     # connected_drones 딕셔너리에서 모든 드론 ID를 리스트로 반환
@@ -274,18 +609,46 @@ async def change_flight_mode(drone_id: str, mode: str):
         if vehicle.mode.name == mode:
             return {"message": f"Drone {drone_id} is already in {mode} mode."}
         
-        # 모드 변경 시도
-        vehicle.mode = mode
-        
-        # 모드 변경이 완료될 때까지 대기
-        while vehicle.mode.name != mode:
-            await asyncio.sleep(0.5)
-            
-        return {"message": f"Drone {drone_id} flight mode changed to {mode}."}
+        # 모드 변경 후 완료될 때까지 대기
+        result = await _set_mode(vehicle, mode)
+        return dict(_command_outcome(result), message=f"Drone {drone_id} flight mode changed to {mode}.")
+    except HTTPException:
+        raise
     except Exception as e:
         # 오류 처리
         raise HTTPException(status_code=500, detail=f"Failed to change flight mode: {str(e)}")
 
+# 스트림 프로필 목록 반환 함수
+async def list_stream_profiles():
+    return {"profiles": STREAM_PROFILES, "active": stream_profiles}
+
+# 드론 스트림 프로필 변경 함수 (메시지별 SET_MESSAGE_INTERVAL 전송 후 COMMAND_ACK 확인)
+async def set_stream_profile(drone_id: str, profile: str):
+    if drone_id not in connected_drones:
+        raise HTTPException(status_code=404, detail="Drone not connected")
+    if profile not in STREAM_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown stream profile: {profile}")
+    vehicle = connected_drones[drone_id]
+
+    # 메시지마다 ACK 를 기다리므로 스레드 풀에서 실행
+    loop = asyncio.get_running_loop()
+    try:
+        results = await loop.run_in_executor(None, vehicle.set_stream_profile, STREAM_PROFILES[profile])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to set stream profile: {str(e)}")
+
+    if all(result is None for result in results.values()):
+        raise HTTPException(status_code=504, detail="Drone did not acknowledge SET_MESSAGE_INTERVAL")
+    stream_profiles[drone_id] = profile
+    result_names = mavutil.mavlink.enums["MAV_RESULT"]
+    return {
+        "message": f"Drone {drone_id} stream profile set to {profile}.",
+        "profile": profile,
+        # 메시지별 결과 (ACK 가 오지 않은 메시지는 null)
+        "results": {message: None if result is None else result_names[result].name
+                    for message, result in results.items()},
+    }
+
 # GPS 위치로 비행하는 함수
 async def fly_to_position(drone_id: str, position: GPSPosition):
     """
@@ -298,11 +661,8 @@ async def fly_to_position(drone_id: str, position: GPSPosition):
         # 드론 객체 가져오기
         vehicle = connected_drones[drone_id]
 
-        # 드론이 Guided 모드인지 확인
-        if vehicle.mode.name != "GUIDED":
-            vehicle.mode = "GUIDED"  # Guided 모드로 변경
-            while vehicle.mode.name != "GUIDED":
-                await asyncio.sleep(0.5)  # 모드 변경 대기
+        # 드론이 Guided 모드인지 확인 (아니면 변경 후 HEARTBEAT 로 확인될 때까지 대기)
+        await _set_mode(vehicle, "GUIDED")
 
         # 목표 위치 객체 생성
         target_location = LocationGlobalRelative(
@@ -315,6 +675,8 @@ async def fly_to_position(drone_id: str, position: GPSPosition):
         vehicle.simple_goto(target_location)
 
         return {"message": f"Drone {drone_id} is flying to position: lat={position.latitude}, lon={position.longitude}, alt={position.altitude}"}
+    except HTTPException:
+        raise
     except Exception as e:
         # 오류 처리
         raise HTTPException(status_code=500, detail=f"Failed to fly to position: {str(e)}")
@@ -390,10 +752,16 @@ async def get_mission(drone_id: str):
         # 드론 객체 가져오기
         vehicle = connected_drones[drone_id]
         
-        # 미션 명령 가져오기
+        # 미션 명령 가져오기 (다운로드가 끝날 때까지 블로킹되므로 스레드 풀에서 실행)
         cmds = vehicle.commands
-        cmds.download()
-        cmds.wait_ready()
+
+        def download():
+            cmds.download()
+            cmds.wait_ready(timeout=MISSION_DOWNLOAD_TIMEOUT)
+
+        await asyncio.get_running_loop().run_in_executor(None, download)
+        # 드론에서 읽은 미션을 기록해 두면 같은 미션 업로드 요청은 전송 없이 완료
+        _remember_mission(drone_id, list(cmds), cmds.opaque_id)
         
         # 미션 데이터 변환
         mission_items = []
@@ -421,71 +789,56 @@ async def get_mission(drone_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"미션을 읽어오는데 실패했습니다: {str(e)}")
 
+# 미션 오류 목록을 응답 메시지로 변환 (앞의 몇 개만 표시)
+def _mission_errors(errors: list, count: int):
+    shown = []
+    for error in errors[:5]:
+        where = f"line {error['line']}" if "line" in error else f"item {error['item']}"
+        shown.append(f"{where}: {error['error']}")
+    more = f" (+{count - len(shown)} more)" if count > len(shown) else ""
+    return f"Invalid mission ({count} errors): " + "; ".join(shown) + more
+
 # 미션 파일 저장 함수 추가
-async def save_mission_file(drone_id: str, file: UploadFile) -> dict:
+async def save_mission_file(drone_id: str, file: UploadFile, altitude: float = None) -> dict:
     """
     드론 ID와 미션 파일을 받아, 현재 날짜와 시간으로 파일명을 생성하고 서버의 missions 디렉토리에 저장합니다.
-    .waypoints 파일이면 파싱 후 해당 드론에 미션을 업로드합니다.
+    미션 파일 (.waypoints, .json, .kml, .csv, 내용으로 판별한 .txt) 이면 저장하면서 파싱한 뒤 해당 드론에 미션을 업로드합니다.
     :param drone_id: 드론의 고유 ID
     :param file: 업로드된 미션 파일 (UploadFile 객체)
+    :param altitude: 고도가 없는 좌표 (plain, kml) 에 사용할 고도 (m, 이륙 지점 기준)
     :return: 저장 성공 메시지와 저장 경로를 포함한 dict
     """
     current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
     file_extension = os.path.splitext(file.filename)[1]
     save_path = os.path.join("missions", f"{current_time}_mission{file_extension}")
 
-    # 파일 저장
-    with open(save_path, "wb") as buffer:
-        buffer.write(await file.read())
-
-    # .waypoints 파일이면 파싱 및 업로드
-    if file_extension == ".waypoints":
+    # 파일 앞부분을 읽어 미션 형식 판별 (미션 파일이 아니면 저장만 함)
+    chunk = await file.read(MISSION_FILE_CHUNK)
+    format = mission_parser.detect_format(file.filename, chunk)
+    parser = None
+    if format is not None:
         if drone_id not in connected_drones:
             raise HTTPException(status_code=404, detail="드론이 연결되어 있지 않습니다.")
-        vehicle = connected_drones[drone_id]
-        missionlist = []
-        with open(save_path) as f:
-            for i, line in enumerate(f):
-                if i == 0:
-                    if not line.startswith('QGC WPL 110'):
-                        raise HTTPException(status_code=400, detail='File is not supported WP version')
-                elif i == 1:
-                    pass
-                else:
-                    linearray = line.split('\t')
-                    ln_index = int(linearray[0])
-                    ln_currentwp = int(linearray[1])
-                    ln_frame = int(linearray[2])
-                    ln_command = int(linearray[3])
-                    ln_param1 = float(linearray[4])
-                    ln_param2 = float(linearray[5])
-                    ln_param3 = float(linearray[6])
-                    ln_param4 = float(linearray[7])
-                    ln_param5 = float(linearray[8])
-                    ln_param6 = float(linearray[9])
-                    ln_param7 = float(linearray[10])
-                    ln_autocontinue = int(linearray[11].strip())
-                    cmd = Command(0, 0, 0, ln_frame, ln_command, ln_currentwp, ln_autocontinue,
-                                  ln_param1, ln_param2, ln_param3, ln_param4, ln_param5, ln_param6, ln_param7)
-                    missionlist.append(cmd)
-
-        # 미션 초기화
-        cmds = vehicle.commands
-        cmds.clear()
-        vehicle.flush()
+        parser = mission_parser.MissionParser(format, default_altitude=altitude)
 
-        # 홈 포지션 추가 (기본값)
-        home_position = Command(0, 0, 1, mavutil.mavlink.MAV_FRAME_GLOBAL, mavutil.mavlink.MAV_CMD_NAV_WAYPOINT, 0, 1, 0, 0, 0, 0, vehicle.location.global_relative_frame.lat, vehicle.location.global_relative_frame.lon, 0)
-        cmds.add(home_position)
-        cmds.upload()
-        cmds.clear()
-
-        # 미션 추가
-        for index, command in enumerate(missionlist):
-            cmds.add(command)
-
-        # 미션 업로드
-        cmds.upload()
-        return {"message": "Mission file uploaded and mission set to drone successfully", "file_path": save_path}
-
-    return {"message": "Mission file uploaded successfully", "file_path": save_path}
+    # 받은 조각을 저장하면서 바로 파싱 (파일 전체를 메모리에 올리거나 다시 읽지 않음)
+    os.makedirs("missions", exist_ok=True)
+    with open(save_path, "wb") as buffer:
+        while chunk:
+            buffer.write(chunk)
+            if parser is not None:
+                parser.feed(chunk)
+            chunk = await file.read(MISSION_FILE_CHUNK)
+
+    if parser is None:
+        return {"message": "Mission file uploaded successfully", "file_path": save_path}
+
+    missionlist = parser.close()
+    if parser.error_count:
+        raise HTTPException(status_code=400, detail=_mission_errors(parser.errors, parser.error_count))
+
+    # 미션 업로드
+    vehicle = connected_drones[drone_id]
+    result = await _upload_commands(drone_id, vehicle, missionlist)
+    return dict(result, message="Mission file uploaded and mission set to drone successfully",
+                file_path=save_path, format=format)
@@ -0,0 +1,96 @@
+from fastapi import HTTPException
+from app.services import drone_service
+import asyncio
+import json
+import os
+import time
+
+# 편대 명령을 동시에 실행할 최대 드론 수
+FLEET_CONCURRENCY = int(os.environ.get("FLEET_CONCURRENCY", "16"))
+# 드론 한 대의 작업 제한 시간 (초, 모드 변경과 COMMAND_ACK 대기를 모두 포함)
+FLEET_DRONE_TIMEOUT = float(os.environ.get("FLEET_DRONE_TIMEOUT", "30"))
+
+# 편대 작업 이름 -> 드론 한 대에 실행할 drone_service 함수
+FLEET_OPERATIONS = {
+    "arm": lambda drone_id, request: drone_service.arm_drone(drone_id),
+    "disarm": lambda drone_id, request: drone_service.disarm_drone(drone_id),
+    "takeoff": lambda drone_id, request: drone_service.takeoff_drone(drone_id, request.altitude),
+    "land": lambda drone_id, request: drone_service.land_drone(drone_id),
+    "rtl": lambda drone_id, request: drone_service.change_flight_mode(drone_id, "RTL"),
+    "mode": lambda drone_id, request: drone_service.change_flight_mode(drone_id, request.mode),
+}
+
+# 요청의 drone_ids 와 tags 로 대상 드론 선택 (둘 다 지정하면 합집합)
+def _select_targets(request):
+    if not request.drone_ids and not request.tags:
+        raise HTTPException(status_code=400, detail="Specify drone_ids or tags")
+    targets = []
+    for drone_id in request.drone_ids or ():
+        if drone_id not in targets:
+            targets.append(drone_id)
+    if request.tags:
+        wanted = set(request.tags)
+        for drone_id in drone_service.connected_drones:
+            if wanted <= drone_service.drone_tags.get(drone_id, set()) and drone_id not in targets:
+                targets.append(drone_id)
+    if not targets:
+        raise HTTPException(status_code=404, detail="No connected drone matches the given tags")
+    return targets
+
+# 드론 한 대에 작업 실행 (실패도 예외 대신 결과로 반환)
+async def _run_one(drone_id, request, semaphore):
+    async with semaphore:
+        started = time.monotonic()
+        outcome = {"drone_id": drone_id}
+        try:
+            result = await asyncio.wait_for(FLEET_OPERATIONS[request.operation](drone_id, request),
+                                            FLEET_DRONE_TIMEOUT)
+            outcome.update(ok=True, status=200, result=result)
+        except HTTPException as e:
+            outcome.update(ok=False, status=e.status_code, detail=e.detail)
+        except asyncio.TimeoutError:
+            outcome.update(ok=False, status=504,
+                           detail=f"No result within {FLEET_DRONE_TIMEOUT} seconds")
+        except Exception as e:
+            outcome.update(ok=False, status=500, detail=str(e))
+        outcome["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+        return outcome
+
+# 여러 드론에 같은 작업을 동시에 실행하고, 끝나는 순서대로 결과를 NDJSON 으로 반환
+async def run_fleet_command(request):
+    if request.operation not in FLEET_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown fleet operation: {request.operation} "
+                                                    f"(expected one of {', '.join(FLEET_OPERATIONS)})")
+    if request.operation == "mode" and not request.mode:
+        raise HTTPException(status_code=400, detail="mode is required for the mode operation")
+    if request.operation == "takeoff" and request.altitude is None:
+        raise HTTPException(status_code=400, detail="altitude is required for the takeoff operation")
+    concurrency = request.concurrency or FLEET_CONCURRENCY
+    if concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency must be at least 1")
+    targets = _select_targets(request)
+
+    async def progress():
+        started = time.monotonic()
+        yield _ndjson({"operation": request.operation, "targets": targets, "concurrency": concurrency})
+        # 모든 드론의 작업을 한 번에 시작하고 세마포어로 동시 실행 수만 제한
+        # (전체 소요 시간은 가장 느린 링크에 맞춰지며 링크별 시간의 합이 되지 않음)
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = [asyncio.ensure_future(_run_one(drone_id, request, semaphore)) for drone_id in targets]
+        succeeded, failed = [], []
+        try:
+            for done, next_result in enumerate(asyncio.as_completed(tasks), 1):
+                outcome = await next_result
+                (succeeded if outcome["ok"] else failed).append(outcome["drone_id"])
+                yield _ndjson(dict(outcome, done=done, total=len(targets)))
+        finally:
+            # 클라이언트가 스트림을 끊으면 남은 작업 취소
+            for task in tasks:
+                task.cancel()
+        yield _ndjson({"complete": True, "succeeded": succeeded, "failed": failed,
+                       "duration_ms": round((time.monotonic() - started) * 1000, 1)})
+
+    return progress()
+
+def _ndjson(data):
+    return (json.dumps(data) + "\n").encode()
@@ -0,0 +1,355 @@
+import codecs
+import json
+import math
+import os
+import re
+from pymavlink import mavutil
+from app.libs.dronekit import Command
+
+mavlink = mavutil.mavlink
+
+# 지원하는 미션 형식
+# - wpl: QGC WPL 110 (.waypoints, Mission Planner/QGroundControl 의 탭 구분 텍스트)
+# - json: POST /drones/{id}/mission 과 같은 웨이포인트 객체 배열
+# - jsonl: 한 줄에 웨이포인트 객체 하나 (NDJSON / JSON Lines)
+# - plain: 한 줄에 "위도,경도[,고도]" (쉼표 또는 공백 구분, # 주석)
+# - kml: <coordinates> 안의 "경도,위도[,고도]" 좌표 (Google Earth 경로/지점)
+MISSION_FORMATS = ("wpl", "json", "jsonl", "plain", "kml")
+# 확장자별 형식 (목록에 없는 확장자는 미션 파일로 취급하지 않고, .txt 는 앞부분으로 판별)
+FORMAT_EXTENSIONS = {
+    ".waypoints": "wpl",
+    ".json": "json",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".kml": "kml",
+    ".csv": "plain",
+    ".txt": None,
+}
+# 오류 목록에 담는 최대 개수 (나머지는 개수만 셈)
+MAX_ERRORS = 20
+# JSON 항목 하나의 최대 크기 (이보다 길게 끝나지 않으면 잘못된 형식으로 처리)
+MAX_JSON_ITEM = 64 * 1024
+
+# JSON 웨이포인트의 고도 타입과 명령 이름
+ALTITUDE_FRAMES = {
+    "relative": mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT,
+    "absolute": mavlink.MAV_FRAME_GLOBAL,
+    "terrain": mavlink.MAV_FRAME_GLOBAL_TERRAIN_ALT,
+}
+COMMAND_NAMES = {
+    "waypoint": mavlink.MAV_CMD_NAV_WAYPOINT,
+    "takeoff": mavlink.MAV_CMD_NAV_TAKEOFF,
+    "land": mavlink.MAV_CMD_NAV_LAND,
+    "do_set_servo": mavlink.MAV_CMD_DO_SET_SERVO,
+    "do_change_speed": mavlink.MAV_CMD_DO_CHANGE_SPEED,
+}
+
+_GLOBAL_FRAMES = frozenset([
+    mavlink.MAV_FRAME_GLOBAL, mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT, mavlink.MAV_FRAME_GLOBAL_TERRAIN_ALT,
+    mavlink.MAV_FRAME_GLOBAL_INT, mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT_INT,
+    mavlink.MAV_FRAME_GLOBAL_TERRAIN_ALT_INT,
+])
+_COORDINATES_TAG = re.compile(r"<(/?)(?:\w+:)?coordinates\s*>")
+_SEPARATORS = re.compile(r"[,\s]+")
+
+
+def _number(value, name):
+    # bool 은 int 의 하위 클래스이므로 별도로 거부
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be a number")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number: {value!r}")
+    if not math.isfinite(number):
+        raise ValueError(f"{name} must be finite")
+    return number
+
+def _check_position(frame, lat, lon):
+    if frame in _GLOBAL_FRAMES and not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"coordinates out of range: {lat}, {lon}")
+
+# JSON 웨이포인트 하나를 Command 로 변환 (잘못된 값이면 ValueError)
+def waypoint_command(waypoint):
+    if not isinstance(waypoint, dict):
+        raise ValueError("waypoint must be an object")
+    for key in ("latitude", "longitude", "altitude"):
+        if waypoint.get(key) is None:
+            raise ValueError(f"missing {key}")
+    lat = _number(waypoint["latitude"], "latitude")
+    lon = _number(waypoint["longitude"], "longitude")
+    alt = _number(waypoint["altitude"], "altitude")
+
+    alt_type = waypoint.get("altitude_type", "relative")
+    if alt_type not in ALTITUDE_FRAMES:
+        raise ValueError(f"invalid altitude_type: {alt_type!r}")
+    frame = ALTITUDE_FRAMES[alt_type]
+
+    # 명령은 이름 또는 MAV_CMD 번호
+    command = waypoint.get("command", "waypoint")
+    if isinstance(command, int) and not isinstance(command, bool) and 0 <= command <= 65535:
+        command_type = command
+    elif command in COMMAND_NAMES:
+        command_type = COMMAND_NAMES[command]
+    else:
+        raise ValueError(f"unknown command: {command!r}")
+
+    params = [_number(waypoint.get(f"param{i}", 0), f"param{i}") for i in range(1, 5)]
+    _check_position(frame, lat, lon)
+    return Command(0, 0, 0, frame, command_type, 0, 1, *params, lat, lon, alt)
+
+# 파일 이름과 앞부분으로 형식 판별 (알 수 없으면 None)
+def detect_format(filename, head=b""):
+    extension = os.path.splitext(filename or "")[1].lower()
+    format = FORMAT_EXTENSIONS.get(extension)
+    if format or extension not in FORMAT_EXTENSIONS:
+        return format
+    text = head.decode("utf-8", "ignore").lstrip("\ufeff \t\r\n")
+    if text.startswith("QGC WPL"):
+        return "wpl"
+    if text.startswith("["):
+        return "json"
+    if text.startswith("{"):
+        return "jsonl"
+    if text.startswith("<"):
+        return "kml"
+    return "plain"
+
+
+class MissionParser:
+    """
+    업로드 스트림을 조각 단위로 받아 바로 Command 로 변환하는 미션 파서.
+
+    feed() 에 받은 바이트를 그대로 넘기고 마지막에 close() 를 호출합니다.
+    잘못된 줄은 건너뛰고 errors 에 {"line": 줄 번호, "error": 내용} 으로 기록합니다.
+    """
+
+    def __init__(self, format, default_altitude=None, max_errors=MAX_ERRORS):
+        if format not in MISSION_FORMATS:
+            raise ValueError(f"unknown mission format: {format!r}")
+        self.format = format
+        self.default_altitude = default_altitude
+        self.max_errors = max_errors
+        self.commands = []
+        self.errors = []
+        self.error_count = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._buffer = ""
+        self._line = 0
+        self._closed = False
+        # 더 읽을 필요가 없는 오류 (헤더 불일치, 인코딩 오류 등) 후에는 나머지를 무시
+        self._stopped = False
+        # wpl: 헤더 확인 여부 / plain: 제목 줄 확인 여부 / kml: <coordinates> 안인지
+        self._header = False
+        self._in_coordinates = False
+        # json: start (배열 시작 전), item (항목 또는 끝), next (쉼표 또는 끝), end
+        self._json_state = "start"
+        self._json_item = 0
+
+    def _error(self, line, message, **extra):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(dict(line=line, error=message, **extra))
+
+    def feed(self, data):
+        if self._closed:
+            raise ValueError("parser is closed")
+        if self._stopped:
+            return
+        try:
+            text = self._decoder.decode(data)
+        except UnicodeDecodeError:
+            self._error(self._line + 1, "file is not UTF-8 text")
+            self._stopped = True
+            return
+        self._buffer += text
+        if self.format == "json":
+            self._parse_json(final=False)
+        else:
+            self._parse_lines(final=False)
+
+    def close(self):
+        if not self._closed and not self._stopped:
+            self._buffer += self._decoder.decode(b"", final=True)
+            if self.format == "json":
+                self._parse_json(final=True)
+            else:
+                self._parse_lines(final=True)
+                if self.format == "wpl" and not self._header:
+                    self._error(1, "missing QGC WPL 110 header")
+        self._closed = True
+        if not self.commands and not self.error_count:
+            self._error(max(self._line, 1), "mission has no items")
+        return self.commands
+
+    # 줄 단위 형식 (wpl, jsonl, plain, kml): 완성된 줄만 처리하고 나머지는 다음 조각과 이어 붙임
+    def _parse_lines(self, final):
+        lines = self._buffer.split("\n")
+        self._buffer = "" if final else lines.pop()
+        parse = getattr(self, "_parse_" + self.format)
+        for line in lines:
+            if self._stopped:
+                break
+            self._line += 1
+            try:
+                parse(line)
+            except ValueError as e:
+                self._error(self._line, str(e))
+
+    def _parse_wpl(self, line):
+        if not self._header:
+            if not line.startswith("QGC WPL 110"):
+                self._stopped = True
+                raise ValueError("file is not a supported WP version (expected QGC WPL 110)")
+            self._header = True
+            return
+        if not line.strip():
+            return
+        # 기존 파서와 같이 탭으로만 구분 (필드 앞뒤 공백은 int()/float() 에서 무시됨)
+        fields = line.rstrip("\r").split("\t")
+        if len(fields) != 12:
+            raise ValueError(f"expected 12 fields, got {len(fields)}")
+        try:
+            index, current, frame, command, autocontinue = (
+                int(fields[0]), int(fields[1]), int(fields[2]), int(fields[3]), int(fields[11]))
+            values = list(map(float, fields[4:11]))
+        except ValueError as e:
+            raise ValueError(f"invalid number: {e}")
+        if not all(map(math.isfinite, values)):
+            raise ValueError("parameters must be finite")
+        if not (0 <= frame <= 255 and 0 <= command <= 65535 and autocontinue in (0, 1)):
+            raise ValueError("frame, command or autocontinue out of range")
+        # 0번 항목은 홈 위치 (업로드할 때 드론의 홈 위치를 새로 넣음)
+        if index == 0:
+            return
+        _check_position(frame, values[4], values[5])
+        self.commands.append(Command(0, 0, 0, frame, command, current, autocontinue, *values))
+
+    def _parse_jsonl(self, line):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            waypoint = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"invalid JSON: {getattr(e, 'msg', str(e))}")
+        self.commands.append(waypoint_command(waypoint))
+
+    def _waypoint(self, lat, lon, alt):
+        if alt is None:
+            if self.default_altitude is None:
+                raise ValueError("missing altitude (set a default altitude)")
+            alt = self.default_altitude
+        if not (math.isfinite(lat) and math.isfinite(lon) and math.isfinite(alt)):
+            raise ValueError("coordinates must be finite")
+        _check_position(mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT, lat, lon)
+        self.commands.append(Command(0, 0, 0, mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT,
+                                     mavlink.MAV_CMD_NAV_WAYPOINT, 0, 1, 0, 0, 0, 0, lat, lon, alt))
+
+    def _parse_plain(self, line):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            return
+        fields = _SEPARATORS.split(line)
+        try:
+            values = [float(field) for field in fields]
+        except ValueError:
+            # 첫 줄이 "latitude,longitude,altitude" 같은 제목이면 건너뜀
+            if not self._header and not self.commands:
+                self._header = True
+                return
+            raise ValueError(f"invalid number in {line!r}")
+        self._header = True
+        if len(values) not in (2, 3):
+            raise ValueError(f"expected latitude,longitude[,altitude], got {len(values)} values")
+        self._waypoint(values[0], values[1], values[2] if len(values) == 3 else None)
+
+    def _parse_kml(self, line):
+        # 한 줄에 여러 태그가 있을 수 있으므로 태그 사이 구간마다 처리
+        position = 0
+        for match in _COORDINATES_TAG.finditer(line):
+            if self._in_coordinates:
+                self._kml_tuples(line[position:match.start()])
+            self._in_coordinates = not match.group(1)
+            position = match.end()
+        if self._in_coordinates:
+            self._kml_tuples(line[position:])
+
+    def _kml_tuples(self, text):
+        # 좌표 하나는 공백 없이 "경도,위도[,고도]"
+        for token in text.split():
+            fields = token.split(",")
+            try:
+                if len(fields) not in (2, 3):
+                    raise ValueError
+                values = [float(field) for field in fields]
+            except ValueError:
+                self._error(self._line, f"invalid coordinate {token!r}")
+                continue
+            try:
+                self._waypoint(values[1], values[0], values[2] if len(values) == 3 else None)
+            except ValueError as e:
+                self._error(self._line, str(e))
+
+    # JSON 배열: 항목 하나가 완성될 때마다 변환하고 처리한 부분은 버퍼에서 제거
+    def _parse_json(self, final):
+        decoder = json.JSONDecoder()
+        buffer = self._buffer
+        position = 0
+        length = len(buffer)
+        while self._json_state != "end" and not self._stopped:
+            # 공백 건너뛰기 (줄 번호 계산)
+            while position < length and buffer[position] in " \t\r\n":
+                if buffer[position] == "\n":
+                    self._line += 1
+                position += 1
+            if position >= length:
+                break
+            char = buffer[position]
+            if self._json_state == "start":
+                if char != "[":
+                    self._error(self._line + 1, "expected a JSON array of waypoints")
+                    self._stopped = True
+                    break
+                position += 1
+                self._json_state = "item"
+            elif self._json_state == "next":
+                if char == ",":
+                    position += 1
+                    self._json_state = "item"
+                elif char == "]":
+                    position += 1
+                    self._json_state = "end"
+                else:
+                    self._error(self._line + 1, "expected ',' or ']' after an item")
+                    self._stopped = True
+                    break
+            elif char == "]" and self._json_item == 0:
+                position += 1
+                self._json_state = "end"
+            else:
+                try:
+                    waypoint, end = decoder.raw_decode(buffer, position)
+                except ValueError as e:
+                    # 항목이 아직 다 도착하지 않은 경우
+                    if not final and length - position < MAX_JSON_ITEM:
+                        break
+                    line = self._line + buffer.count("\n", position, getattr(e, "pos", position)) + 1
+                    self._error(line, f"invalid JSON: {getattr(e, 'msg', str(e))}", item=self._json_item)
+                    self._stopped = True
+                    break
+                line = self._line + 1
+                self._line += buffer.count("\n", position, end)
+                position = end
+                try:
+                    self.commands.append(waypoint_command(waypoint))
+                except ValueError as e:
+                    self._error(line, str(e), item=self._json_item)
+                self._json_item += 1
+                self._json_state = "next"
+        self._buffer = "" if self._stopped else buffer[position:]
+        if self._json_state == "end" and self._buffer.strip():
+            self._error(self._line + 1, "unexpected data after the JSON array")
+            self._stopped = True
+        elif final and self._json_state != "end" and not self._stopped:
+            self._error(self._line + 1, "unexpected end of JSON array")
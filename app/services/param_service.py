@@ -0,0 +1,239 @@
+from fastapi import HTTPException
+import asyncio
+import hashlib
+import json
+import os
+import re
+import struct
+from app.services.drone_service import connected_drones
+
+# 파라미터 프로필 디렉터리 (프로필 이름.json 또는 .param 파일)
+PARAM_PROFILE_DIR = os.environ.get("PARAM_PROFILE_DIR", "param_profiles")
+# 프로필 파일 확장자 (.param 은 Mission Planner 형식 "NAME,VALUE")
+PROFILE_EXTENSIONS = (".json", ".param", ".parm")
+# 프로필 이름으로 허용하는 문자 (디렉터리 밖의 파일 접근 방지)
+_PROFILE_NAME = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")
+
+# 동시에 응답을 기다리는 PARAM_SET 개수
+PARAM_SET_WINDOW = int(os.environ.get("PARAM_SET_WINDOW", "10"))
+
+# MAVLink 파라미터 값은 단정밀도 float 이므로 같은 기준으로 변환
+def _float32(value):
+    return struct.unpack("f", struct.pack("f", float(value)))[0]
+
+# 단정밀도 값을 같은 값으로 돌아오는 가장 짧은 10진수로 표시 (0.10000000149 -> 0.1)
+def _format_value(value):
+    value = _float32(value)
+    for digits in range(6, 10):
+        text = "%.*g" % (digits, value)
+        if _float32(text) == value:
+            return text
+    return repr(value)
+
+def _display_value(value):
+    return float(_format_value(value))
+
+def _get_vehicle(drone_id: str):
+    if drone_id not in connected_drones:
+        raise HTTPException(status_code=404, detail="Drone not connected")
+    return connected_drones[drone_id]
+
+# 이름순으로 정렬한 파라미터 (prefix 지정 시 해당 접두사로 시작하는 것만)
+def _current_params(vehicle, prefix=None):
+    params = vehicle.parameters.as_dict()
+    if prefix:
+        prefix = prefix.upper()
+        params = {name: value for name, value in params.items() if name.startswith(prefix)}
+    return {name: _display_value(params[name]) for name in sorted(params)}
+
+# 파라미터 목록의 해시 (ETag 로 사용, 값이 하나라도 바뀌면 달라짐)
+def params_etag(params: dict):
+    digest = hashlib.sha1()
+    for name, value in params.items():
+        digest.update(("%s=%s\n" % (name, _format_value(value))).encode())
+    return '"%s"' % digest.hexdigest()[:16]
+
+# 드론 파라미터 조회 (응답 본문과 ETag 반환)
+async def get_params(drone_id: str, prefix: str = None):
+    vehicle = _get_vehicle(drone_id)
+    params = _current_params(vehicle, prefix)
+    received, total = vehicle.parameters.download_progress
+    return {
+        "drone_id": drone_id,
+        "count": len(params),
+        # 캐시에서 불러온 값을 백그라운드에서 다시 받는 중이면 true
+        "revalidating": vehicle.parameters.revalidating,
+        "complete": total is not None and received == total,
+        "params": params,
+    }, params_etag(params)
+
+# 프로필 파일 경로 찾기 (이름에 확장자가 없으면 .json, .param, .parm 순서로 찾음)
+def _profile_path(name: str):
+    if not _PROFILE_NAME.match(name):
+        raise HTTPException(status_code=400, detail=f"Invalid profile name: {name}")
+    if name.endswith(PROFILE_EXTENSIONS):
+        candidates = [name]
+    else:
+        candidates = [name + extension for extension in PROFILE_EXTENSIONS]
+    for candidate in candidates:
+        path = os.path.join(PARAM_PROFILE_DIR, candidate)
+        if os.path.isfile(path):
+            return path
+    raise HTTPException(status_code=404, detail=f"Parameter profile not found: {name}")
+
+# 프로필 파일 읽기 (.json: {"NAME": 값}, .param: 한 줄에 "NAME,VALUE" 또는 "NAME VALUE", # 주석)
+def load_profile(name: str):
+    path = _profile_path(name)
+    params = {}
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            try:
+                data = json.load(f)
+                # {"params": {...}} 형식 (export 결과) 도 허용
+                if isinstance(data, dict) and isinstance(data.get("params"), dict):
+                    data = data["params"]
+                for param_name, value in data.items():
+                    params[param_name.upper()] = float(value)
+            except (ValueError, TypeError, AttributeError) as e:
+                raise HTTPException(status_code=400, detail=f"Invalid profile {name}: {str(e)}")
+            return params
+
+        for line_number, line in enumerate(f, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            fields = re.split(r"[,\s]+", line)
+            try:
+                if len(fields) < 2:
+                    raise ValueError("expected NAME,VALUE")
+                params[fields[0].upper()] = float(fields[1])
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid profile {name} line {line_number}: {str(e)}")
+    return params
+
+# 파라미터 프로필 목록 조회
+async def list_param_profiles():
+    if not os.path.isdir(PARAM_PROFILE_DIR):
+        return {"profiles": []}
+    profiles = sorted(os.path.splitext(filename)[0] for filename in os.listdir(PARAM_PROFILE_DIR)
+                      if filename.endswith(PROFILE_EXTENSIONS) and _PROFILE_NAME.match(filename))
+    return {"profiles": profiles}
+
+# 현재 파라미터와 프로필 비교 (값이 다른 것, 드론에 없는 것, 같은 개수 반환, 단정밀도 기준)
+def compare_params(current: dict, profile: dict):
+    changed = {}
+    missing = []
+    same = 0
+    for name in sorted(profile):
+        if name not in current:
+            missing.append(name)
+        elif _float32(profile[name]) != _float32(current[name]):
+            changed[name] = {"current": _display_value(current[name]), "profile": _display_value(profile[name])}
+        else:
+            same += 1
+    return changed, missing, same
+
+# 드론 파라미터와 프로필 비교
+async def diff_params(drone_id: str, against: str, prefix: str = None):
+    vehicle = _get_vehicle(drone_id)
+    profile = load_profile(against)
+    if prefix:
+        prefix = prefix.upper()
+        profile = {name: value for name, value in profile.items() if name.startswith(prefix)}
+
+    changed, missing, same = compare_params(vehicle.parameters.as_dict(), profile)
+    return {
+        "drone_id": drone_id,
+        "profile": against,
+        # 값이 다른 파라미터
+        "changed": changed,
+        # 프로필에는 있지만 드론에 없는 파라미터 (펌웨어 버전 차이 등)
+        "missing": missing,
+        "same": same,
+    }
+
+# 적용할 파라미터 목록 만들기 (요청의 params 또는 프로필)
+def _requested_params(request):
+    if request.profile:
+        params = load_profile(request.profile)
+    elif request.params:
+        params = {name.upper(): float(value) for name, value in request.params.items()}
+    else:
+        raise HTTPException(status_code=400, detail="Either params or profile is required")
+    if request.prefix:
+        prefix = request.prefix.upper()
+        params = {name: value for name, value in params.items() if name.startswith(prefix)}
+    return params
+
+# 파라미터 일괄 적용 (파라미터별 결과를 한 줄씩 내보내는 비동기 제너레이터 반환)
+async def apply_params(drone_id: str, request):
+    vehicle = _get_vehicle(drone_id)
+    params = _requested_params(request)
+    current = vehicle.parameters.as_dict()
+
+    # 드론에 없는 파라미터와 이미 같은 값인 파라미터는 전송하지 않음
+    unknown = sorted(name for name in params if name not in current)
+    values = {name: value for name, value in params.items()
+              if name in current and _float32(value) != _float32(current[name])}
+    unchanged = len(params) - len(unknown) - len(values)
+
+    loop = asyncio.get_running_loop()
+
+    async def progress():
+        queue = asyncio.Queue()
+
+        def on_result(name, ok):
+            loop.call_soon_threadsafe(queue.put_nowait, (name, ok))
+
+        def run():
+            try:
+                return vehicle.parameters.set_many(values, window=PARAM_SET_WINDOW, callback=on_result)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        yield _ndjson({"drone_id": drone_id, "total": len(values), "unchanged": unchanged, "unknown": unknown})
+        # PARAM_VALUE 응답을 기다리며 블로킹되므로 스레드 풀에서 실행
+        future = loop.run_in_executor(None, run)
+        done = 0
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            name, ok = item
+            done += 1
+            yield _ndjson({"name": name, "value": _display_value(values[name]), "ok": ok,
+                           "done": done, "total": len(values)})
+        try:
+            results = await future
+        except Exception as e:
+            yield _ndjson({"error": f"Failed to set parameters: {str(e)}"})
+            return
+        failed = sorted(name for name, ok in results.items() if not ok)
+        yield _ndjson({"complete": True, "set": len(values) - len(failed), "failed": failed,
+                       "unchanged": unchanged, "unknown": unknown})
+
+    return progress()
+
+def _ndjson(data):
+    return (json.dumps(data) + "\n").encode()
+
+# 드론 파라미터 내보내기 (.param 또는 JSON 텍스트 반환)
+async def export_params(drone_id: str, format: str = "param", prefix: str = None):
+    vehicle = _get_vehicle(drone_id)
+    params = _current_params(vehicle, prefix)
+    if format == "json":
+        return json.dumps({"params": params}, indent=1) + "\n"
+    if format != "param":
+        raise HTTPException(status_code=400, detail=f"Unknown export format: {format}")
+    return "".join("%s,%s\n" % (name, _format_value(value)) for name, value in params.items())
+
+# 드론 파라미터를 프로필로 저장 (다른 드론과 비교/적용할 때 사용)
+async def save_param_profile(drone_id: str, request):
+    if not _PROFILE_NAME.match(request.name) or request.name.endswith(PROFILE_EXTENSIONS):
+        raise HTTPException(status_code=400, detail=f"Invalid profile name: {request.name}")
+    content = await export_params(drone_id, "json", request.prefix)
+    os.makedirs(PARAM_PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PARAM_PROFILE_DIR, request.name + ".json")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return {"message": f"Parameter profile {request.name} saved.", "profile": request.name, "path": path}
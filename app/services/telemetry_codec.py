@@ -0,0 +1,177 @@
+import json
+import math
+
+# 바이너리 인코딩 라이브러리 (선택 설치, 없으면 JSON 만 사용)
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# 텔레메트리 필드 고정 순서 (바이너리 인코딩은 필드 이름 대신 이 순서의 배열/인덱스를 사용)
+TELEMETRY_FIELDS = (
+    "drone_id", "latitude", "longitude", "altitude", "altitude_asl",
+    "battery", "airspeed", "groundspeed", "heading", "mode", "armed",
+    "pitch", "roll", "yaw", "signal_strength",
+    "home_latitude", "home_longitude", "home_altitude",
+)
+FIELD_INDEX = {field: index for index, field in enumerate(TELEMETRY_FIELDS)}
+
+# 필드별 변화 감지 임계값 (이 값 이하의 변화는 전송하지 않음, 목록에 없는 필드는 값이 다를 때 전송)
+DEFAULT_DEADBANDS = {
+    "latitude": 1e-7,
+    "longitude": 1e-7,
+    "altitude": 0.05,  # 미터
+    "altitude_asl": 0.05,
+    "home_latitude": 1e-7,
+    "home_longitude": 1e-7,
+    "home_altitude": 0.05,
+    "pitch": math.radians(0.2),  # 자세 값은 라디안 단위
+    "roll": math.radians(0.2),
+    "yaw": math.radians(0.2),
+    "battery": 0.01,  # 볼트
+    "airspeed": 0.05,  # m/s
+    "groundspeed": 0.05,
+    "signal_strength": 0.5,  # 마지막 하트비트 이후 경과 시간 (초)
+}
+
+# 전체 상태(키프레임)를 다시 보내는 기본 주기 (초)
+DEFAULT_KEYFRAME_INTERVAL = 5.0
+
+
+# 구독자별 델타 인코더 (마지막으로 보낸 값과 비교해 바뀐 필드만 반환)
+class TelemetryDeltaEncoder:
+    def __init__(self, deadbands=None, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        self.deadbands = dict(DEFAULT_DEADBANDS)
+        if deadbands:
+            self.deadbands.update(deadbands)
+        self.keyframe_interval = keyframe_interval
+        # 드론별 마지막으로 전송한 값 (수신 측이 알고 있는 상태)
+        self._last_sent = {}
+        # 드론별 마지막 키프레임 전송 시각
+        self._last_keyframe = {}
+
+    # 키프레임 전송 시점인지 확인 (처음 보내는 드론 포함)
+    def keyframe_due(self, drone_id, now):
+        last = self._last_keyframe.get(drone_id)
+        return last is None or now - last >= self.keyframe_interval
+
+    # 텔레메트리를 인코딩하여 (전송할 필드, 키프레임 여부) 반환, 보낼 것이 없으면 필드는 None
+    def encode(self, drone_id, telemetry, now):
+        if self.keyframe_due(drone_id, now):
+            self._last_sent[drone_id] = dict(telemetry)
+            self._last_keyframe[drone_id] = now
+            return dict(telemetry), True
+
+        last = self._last_sent[drone_id]
+        delta = {}
+        for field, value in telemetry.items():
+            previous = last.get(field)
+            if value == previous:
+                continue
+            deadband = self.deadbands.get(field)
+            if (deadband is not None and value is not None and previous is not None
+                    and abs(value - previous) <= deadband):
+                continue
+            delta[field] = value
+            # 마지막 전송 값 기준으로 비교해야 임계값 이하 변화가 누적되어도 놓치지 않음
+            last[field] = value
+        return (delta or None), False
+
+    # 연결 해제된 드론 상태 삭제
+    def forget(self, drone_id):
+        self._last_sent.pop(drone_id, None)
+        self._last_keyframe.pop(drone_id, None)
+
+
+# 인코딩 이름 -> (미디어 타입, WebSocket 서브프로토콜)
+ENCODINGS = {
+    "json": ("application/json", "telemetry.json"),
+    "msgpack": ("application/msgpack", "telemetry.msgpack"),
+    "cbor": ("application/cbor", "telemetry.cbor"),
+}
+
+# Accept 헤더에서 인식하는 추가 미디어 타입
+_MEDIA_TYPE_ALIASES = {
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+}
+
+
+# 현재 환경에서 사용 가능한 인코딩 목록
+def available_encodings():
+    encodings = ["json"]
+    if msgpack is not None:
+        encodings.append("msgpack")
+    if cbor2 is not None:
+        encodings.append("cbor")
+    return encodings
+
+
+# WebSocket 서브프로토콜 협상 (클라이언트가 제시한 순서대로 첫 번째 지원 인코딩 선택)
+def negotiate_subprotocol(requested):
+    available = available_encodings()
+    for subprotocol in requested:
+        for encoding, (_, name) in ENCODINGS.items():
+            if subprotocol == name and encoding in available:
+                return encoding, subprotocol
+    return "json", None
+
+
+# Accept 헤더 협상 (q 값이 가장 높은 지원 인코딩 선택, 없으면 JSON)
+def negotiate_accept(accept):
+    available = available_encodings()
+    best, best_q = "json", 0.0
+    for part in (accept or "").split(","):
+        items = part.strip().split(";")
+        media_type = items[0].strip().lower()
+        q = 1.0
+        for param in items[1:]:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        encoding = _MEDIA_TYPE_ALIASES.get(media_type)
+        if encoding is None:
+            encoding = next((name for name, (mt, _) in ENCODINGS.items() if mt == media_type), None)
+        if encoding in available and q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+# 텔레메트리 딕셔너리를 고정 순서 배열로 변환 (전체 상태)
+def pack_telemetry(telemetry):
+    return [telemetry.get(field) for field in TELEMETRY_FIELDS]
+
+
+# 델타 딕셔너리를 {필드 인덱스: 값} 으로 변환
+def pack_delta(delta):
+    return {FIELD_INDEX[field]: value for field, value in delta.items()}
+
+
+# 인코딩별 직렬화
+def dumps(encoding, data):
+    if encoding == "msgpack":
+        return msgpack.packb(data, use_bin_type=True)
+    if encoding == "cbor":
+        return cbor2.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+# 스트림 프레임을 바이너리로 변환
+# [타임스탬프, {drone_id: 배열 또는 {인덱스: 값}}, 연결 해제 ID 목록, 키프레임 ID 목록]
+def encode_frame(encoding, frame):
+    keyframes = frame.get("keyframes")
+    drones = {}
+    for drone_id, telemetry in frame["drones"].items():
+        if keyframes is None or drone_id in keyframes:
+            drones[drone_id] = pack_telemetry(telemetry)
+        else:
+            drones[drone_id] = pack_delta(telemetry)
+    return dumps(encoding, [frame["timestamp"], drones, frame["removed"], keyframes or []])
@@ -0,0 +1,173 @@
+from fastapi import WebSocket, WebSocketDisconnect
+import asyncio
+import os
+import time
+from app.services.telemetry_codec import TELEMETRY_FIELDS, TelemetryDeltaEncoder, negotiate_subprotocol, encode_frame
+
+# 텔레메트리 변경을 알리는 Vehicle 속성 목록
+TELEMETRY_ATTRIBUTES = (
+    "location", "attitude", "battery", "mode", "armed",
+    "heading", "airspeed", "groundspeed", "home_location",
+)
+
+# 텔레메트리 기록 필드 (API 필드 이름 -> TelemetrySnapshot 필드 이름)
+HISTORY_FIELDS = {
+    "latitude": "lat", "longitude": "lon", "altitude": "alt", "groundspeed": "groundspeed",
+    "battery": "battery_voltage", "pitch": "pitch", "roll": "roll", "yaw": "yaw",
+}
+
+# WebSocket 기본 전송 주기 (Hz) 와 허용 범위
+DEFAULT_STREAM_RATE = float(os.environ.get("TELEMETRY_WS_RATE", "5"))
+MIN_STREAM_RATE = 0.2
+MAX_STREAM_RATE = 50.0
+
+# 텔레메트리를 구독 중인 드론 (drone_id -> vehicle)
+watched_vehicles = {}
+# 드론별 텔레메트리 버전 (속성이 바뀔 때마다 1 증가)
+telemetry_versions = {}
+# 드론별 속성 리스너 (구독 해제 시 사용)
+_listeners = {}
+
+# 드론 텔레메트리 딕셔너리 생성 함수 (REST/WebSocket 공용, fields 지정 시 해당 필드만 반환)
+def build_telemetry(drone_id: str, vehicle, fields=None):
+    # 수신 스레드가 통째로 교체하는 스냅샷을 한 번만 읽음 (모든 값이 같은 시점의 값)
+    snap = vehicle.snapshot
+
+    # 텔레메트리 데이터 수집
+    telemetry_data = {
+        "drone_id": drone_id,  # 드론 ID 추가
+        "latitude": snap.lat,
+        "longitude": snap.lon,
+        "altitude": snap.alt,  # 상대 고도
+        "altitude_asl": snap.alt_asl,  # 해수면 고도 (ASL)
+        "battery": snap.battery_voltage,
+        "airspeed": snap.airspeed,
+        "groundspeed": snap.groundspeed,
+        "heading": snap.heading,
+        "mode": snap.mode,
+        "armed": snap.armed,
+        "pitch": snap.pitch,  # 기체의 피치(앞뒤 기울기)
+        "roll": snap.roll,    # 기체의 롤(좌우 기울기)
+        "yaw": snap.yaw,     # 기체의 요(방향)
+        "signal_strength": vehicle.last_heartbeat,  # 수신 감도값 (마지막 신호 수신 시간)
+    }
+
+    # 홈 위치 정보가 있는 경우에만 추가
+    if snap.home_lat is not None:
+        telemetry_data.update({
+            "home_latitude": snap.home_lat,
+            "home_longitude": snap.home_lon,
+            "home_altitude": snap.home_alt
+        })
+    else:
+        # 홈 위치가 없는 경우 현재 위치를 홈 위치로 사용
+        telemetry_data.update({
+            "home_latitude": snap.lat,
+            "home_longitude": snap.lon,
+            "home_altitude": snap.alt
+        })
+
+    if fields is not None:
+        return {field: telemetry_data[field] for field in fields}
+    return telemetry_data
+
+# 드론 텔레메트리 구독 시작 (연결 완료 시 호출)
+def watch_vehicle(drone_id: str, vehicle):
+    # 수신 스레드에서 호출되며 버전만 올림 (실제 데이터는 전송 시점에 읽음)
+    def on_change(_, attr_name, value):
+        telemetry_versions[drone_id] = telemetry_versions.get(drone_id, 0) + 1
+
+    telemetry_versions[drone_id] = telemetry_versions.get(drone_id, 0) + 1
+    for attr in TELEMETRY_ATTRIBUTES:
+        vehicle.add_attribute_listener(attr, on_change)
+    _listeners[drone_id] = on_change
+    watched_vehicles[drone_id] = vehicle
+
+# 드론 텔레메트리 구독 해제 (연결 해제 시 호출)
+def unwatch_vehicle(drone_id: str):
+    vehicle = watched_vehicles.pop(drone_id, None)
+    on_change = _listeners.pop(drone_id, None)
+    telemetry_versions.pop(drone_id, None)
+    if vehicle is not None and on_change is not None:
+        for attr in TELEMETRY_ATTRIBUTES:
+            vehicle.remove_attribute_listener(attr, on_change)
+
+# WebSocket 텔레메트리 스트림 처리 함수
+async def stream_telemetry(websocket: WebSocket, rate: float = None, ids: str = None, delta: bool = False):
+    rate = min(max(rate or DEFAULT_STREAM_RATE, MIN_STREAM_RATE), MAX_STREAM_RATE)
+    interval = 1.0 / rate
+    wanted = set(ids.split(",")) if ids else None
+    # 델타 모드: 바뀐 필드만 전송하고 주기적으로 전체 상태(키프레임) 전송
+    encoder = TelemetryDeltaEncoder() if delta else None
+
+    # 서브프로토콜로 인코딩 협상 (telemetry.msgpack / telemetry.cbor / telemetry.json)
+    encoding, subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=subprotocol)
+    # 클라이언트가 마지막으로 받은 드론별 버전
+    sent_versions = {}
+
+    # 클라이언트 메시지를 계속 읽어 연결 종료를 바로 감지 (보낼 텔레메트리가 없어도 종료됨)
+    async def receive_until_closed():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+        except (WebSocketDisconnect, RuntimeError):
+            return
+
+    closed = asyncio.ensure_future(receive_until_closed())
+    try:
+        while not closed.done():
+            started = time.monotonic()
+
+            # 마지막 전송 이후 바뀐 드론만 최신 상태로 전송 (중간 변경은 합쳐짐)
+            changed = {}
+            keyframes = []
+            for drone_id, vehicle in list(watched_vehicles.items()):
+                if wanted is not None and drone_id not in wanted:
+                    continue
+                version = telemetry_versions.get(drone_id)
+                if version is None:
+                    continue
+                updated = sent_versions.get(drone_id) != version
+                if not updated and (encoder is None or not encoder.keyframe_due(drone_id, started)):
+                    continue
+                sent_versions[drone_id] = version
+                telemetry = build_telemetry(drone_id, vehicle)
+                if encoder is not None:
+                    telemetry, keyframe = encoder.encode(drone_id, telemetry, started)
+                    if telemetry is None:
+                        continue
+                    if keyframe:
+                        keyframes.append(drone_id)
+                changed[drone_id] = telemetry
+
+            # 연결 해제된 드론 알림
+            removed = [drone_id for drone_id in sent_versions if drone_id not in watched_vehicles]
+            for drone_id in removed:
+                del sent_versions[drone_id]
+                if encoder is not None:
+                    encoder.forget(drone_id)
+
+            if changed or removed:
+                frame = {
+                    "type": "telemetry",
+                    "timestamp": time.time(),
+                    "drones": changed,
+                    "removed": removed,
+                }
+                if encoder is not None:
+                    frame["keyframes"] = keyframes
+                # 느린 클라이언트는 전송이 끝날 때까지 다음 틱이 밀리므로 쌓이지 않고 최신 상태만 받음
+                if encoding == "json":
+                    await websocket.send_json(frame)
+                else:
+                    await websocket.send_bytes(encode_frame(encoding, frame))
+
+            # 다음 틱까지 대기하되 그 사이 연결이 끊기면 즉시 종료
+            await asyncio.wait({closed}, timeout=max(0.0, interval - (time.monotonic() - started)))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        closed.cancel()
@@ -0,0 +1,146 @@
+import heapq
+import math
+
+# 배열 연산 라이브러리 (선택 설치, 없으면 순수 파이썬으로 계산)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# 위도 1도의 길이 (미터, 경도는 cos(위도) 를 곱함)
+METERS_PER_DEGREE = 111320.0
+# 이 거리 (미터) 이하로 벗어난 점은 궤적에 추가하지 않음 (simplify_track 의 기본 허용 오차)
+MIN_DEVIATION = 0.05
+
+# 첫 점을 원점으로 하는 지역 좌표 (미터) 로 변환 (짧은 궤적에서는 평면 근사로 충분)
+def _local_xyz(lats, lons, alts):
+    scale_x = METERS_PER_DEGREE * math.cos(math.radians(lats[0]))
+    lat0, lon0 = lats[0], lons[0]
+    xs = [(lon - lon0) * scale_x for lon in lons]
+    ys = [(lat - lat0) * METERS_PER_DEGREE for lat in lats]
+    zs = [0.0 if alt is None else alt for alt in alts]
+    return xs, ys, zs
+
+# first~last 구간에서 선분 first-last 로부터 가장 멀리 떨어진 점 (거리 제곱, 인덱스)
+def _farthest_py(xs, ys, zs, first, last):
+    ax, ay, az = xs[first], ys[first], zs[first]
+    dx, dy, dz = xs[last] - ax, ys[last] - ay, zs[last] - az
+    length2 = dx * dx + dy * dy + dz * dz
+    best, index = -1.0, first + 1
+    for i in range(first + 1, last):
+        px, py, pz = xs[i] - ax, ys[i] - ay, zs[i] - az
+        if length2 > 0:
+            # 선분 위의 가장 가까운 점까지의 거리 (직선이 아닌 선분 기준이라 되돌아오는 궤적도 처리)
+            t = min(max((px * dx + py * dy + pz * dz) / length2, 0.0), 1.0)
+            px, py, pz = px - t * dx, py - t * dy, pz - t * dz
+        distance2 = px * px + py * py + pz * pz
+        if distance2 > best:
+            best, index = distance2, i
+    return best, index
+
+def _farthest_np(points, first, last):
+    start, segment = points[first], points[last] - points[first]
+    offsets = points[first + 1:last] - start
+    length2 = float(segment.dot(segment))
+    if length2 > 0:
+        t = numpy.clip(offsets.dot(segment) / length2, 0.0, 1.0)
+        offsets = offsets - t[:, None] * segment
+    distances = numpy.einsum("ij,ij->i", offsets, offsets)
+    i = int(distances.argmax())
+    return float(distances[i]), first + 1 + i
+
+# 비행 궤적 단순화 (Ramer-Douglas-Peucker)
+def simplify_track(lats, lons, alts, max_points: int, tolerance: float = MIN_DEVIATION):
+    """
+    가장 많이 벗어난 점부터 추가하는 RDP 로 궤적을 max_points 개 이하로 줄임
+    :param lats: 위도 목록
+    :param lons: 경도 목록
+    :param alts: 고도 목록 (없으면 None, 수직 이동도 모양으로 취급)
+    :param max_points: 최대 점 개수 (2 이상)
+    :param tolerance: 허용 오차 (미터, max_points 에 먼저 도달하지 않으면 버린 점은 모두 이 거리 이내)
+    :return: 남길 점의 인덱스 (오름차순, 첫 점과 마지막 점 포함)
+    """
+    if max_points < 2:
+        raise ValueError("max_points must be at least 2")
+    count = len(lats)
+    if count <= max_points:
+        return list(range(count))
+    xs, ys, zs = _local_xyz(lats, lons, alts)
+    if numpy is not None:
+        points = numpy.column_stack((xs, ys, zs))
+        farthest = lambda first, last: _farthest_np(points, first, last)
+    else:
+        farthest = lambda first, last: _farthest_py(xs, ys, zs, first, last)
+
+    # 구간별 최대 이탈 거리를 힙에 넣고 가장 큰 구간부터 나눔
+    keep = [0, count - 1]
+    segments = []
+
+    def push(first, last):
+        if last - first > 1:
+            distance2, index = farthest(first, last)
+            if distance2 > tolerance * tolerance:
+                heapq.heappush(segments, (-distance2, first, last, index))
+
+    push(0, count - 1)
+    while segments and len(keep) < max_points:
+        _, first, last, index = heapq.heappop(segments)
+        keep.append(index)
+        push(first, index)
+        push(index, last)
+    keep.sort()
+    return keep
+
+# 구간에서 이전 선택 점 (ax, ay) 과 다음 구간 평균 점이 이루는 삼각형 넓이가 가장 큰 점
+def _largest_triangle_py(times, values, lo, hi, ax, ay, next_t, next_v):
+    best, index = -1.0, lo
+    for i in range(lo, hi):
+        area = abs((ax - next_t) * (values[i] - ay) - (ax - times[i]) * (next_v - ay))
+        if area > best:
+            best, index = area, i
+    return index
+
+def _largest_triangle_np(times, values, lo, hi, ax, ay, next_t, next_v):
+    areas = numpy.abs((ax - next_t) * (values[lo:hi] - ay) - (ax - times[lo:hi]) * (next_v - ay))
+    return lo + int(areas.argmax())
+
+# 스칼라 시계열 단순화 (Largest-Triangle-Three-Buckets)
+def downsample_series(times, values, max_points: int):
+    """
+    LTTB 로 시계열을 max_points 개 이하로 줄임 (구간마다 모양을 가장 잘 유지하는 점 하나 선택)
+    :param times: 시간 목록 (오름차순)
+    :param values: 값 목록 (None 없이)
+    :param max_points: 최대 점 개수 (3 이상)
+    :return: 남길 점의 인덱스 (오름차순, 첫 점과 마지막 점 포함)
+    """
+    if max_points < 3:
+        raise ValueError("max_points must be at least 3")
+    count = len(times)
+    if count <= max_points:
+        return list(range(count))
+    # 시간은 epoch 초라 값이 크므로 첫 시간을 빼서 넓이 계산의 정밀도 유지
+    base = times[0]
+    if numpy is not None:
+        times = numpy.asarray(times, dtype=float) - base
+        values = numpy.asarray(values, dtype=float)
+        largest = _largest_triangle_np
+        mean = lambda column, lo, hi: float(column[lo:hi].mean())
+    else:
+        times = [t - base for t in times]
+        largest = _largest_triangle_py
+        mean = lambda column, lo, hi: math.fsum(column[lo:hi]) / (hi - lo)
+
+    # 첫 점과 마지막 점 사이를 max_points - 2 개 구간으로 나눔
+    every = (count - 2) / (max_points - 2)
+    keep = [0]
+    previous = 0
+    for bucket in range(max_points - 2):
+        lo = int(bucket * every) + 1
+        hi = int((bucket + 1) * every) + 1
+        next_hi = min(int((bucket + 2) * every) + 1, count)
+        index = largest(times, values, lo, hi, times[previous], values[previous],
+                        mean(times, hi, next_hi), mean(values, hi, next_hi))
+        keep.append(index)
+        previous = index
+    keep.append(count - 1)
+    return keep
@@ -0,0 +1,115 @@
+import asyncio
+import concurrent.futures
+import json
+import threading
+
+from nose.tools import assert_equals
+from pymavlink.dialects.v20 import ardupilotmega as mavlink
+
+from app.libs.dronekit.command import CommandResult
+from app.models import FleetCommandRequest
+from app.services import drone_service, fleet_service
+
+
+class StubVehicle(object):
+    """Answers set_armed after ``delay`` seconds from another thread, as the receive thread would."""
+
+    in_flight = 0
+    most_in_flight = 0
+    lock = threading.Lock()
+
+    def __init__(self, delay, result=mavlink.MAV_RESULT_ACCEPTED, error=None):
+        self.delay = delay
+        self.result = result
+        self.error = error
+
+    def set_armed(self, armed):
+        if self.error:
+            raise RuntimeError(self.error)
+        future = concurrent.futures.Future()
+        if self.delay is None:
+            # Never acknowledged.
+            return future
+        with StubVehicle.lock:
+            StubVehicle.in_flight += 1
+            StubVehicle.most_in_flight = max(StubVehicle.most_in_flight, StubVehicle.in_flight)
+
+        def acknowledge():
+            with StubVehicle.lock:
+                StubVehicle.in_flight -= 1
+            future.set_result(CommandResult(mavlink.MAV_CMD_COMPONENT_ARM_DISARM, self.result, self.delay, 1))
+
+        threading.Timer(self.delay, acknowledge).start()
+        return future
+
+
+def run_fleet(vehicles, drone_tags=None, **request):
+    async def run():
+        stream = await fleet_service.run_fleet_command(FleetCommandRequest(operation="arm", **request))
+        return [json.loads(line) async for line in stream]
+
+    drone_service.connected_drones.update(vehicles)
+    drone_service.drone_tags.update(drone_tags or {})
+    StubVehicle.in_flight = StubVehicle.most_in_flight = 0
+    try:
+        return asyncio.run(run())
+    finally:
+        for drone_id in vehicles:
+            drone_service.connected_drones.pop(drone_id, None)
+            drone_service.drone_tags.pop(drone_id, None)
+
+
+def test_concurrency_cap():
+    vehicles = {"d%d" % i: StubVehicle(0.02) for i in range(10)}
+    lines = run_fleet(vehicles, drone_ids=sorted(vehicles), concurrency=3)
+    assert_equals(StubVehicle.most_in_flight, 3)
+    assert_equals(lines[0], {"operation": "arm", "targets": sorted(vehicles), "concurrency": 3})
+    assert_equals(sorted(lines[-1]["succeeded"]), sorted(vehicles))
+
+    # Without a cap every drone is commanded at once.
+    run_fleet(vehicles, drone_ids=sorted(vehicles))
+    assert_equals(StubVehicle.most_in_flight, 10)
+
+
+def test_failures_are_isolated_per_drone():
+    vehicles = {
+        "fast": StubVehicle(0.01),
+        "slow": StubVehicle(0.1),
+        "rejects": StubVehicle(0.02, result=mavlink.MAV_RESULT_DENIED),
+        "raises": StubVehicle(0, error="link closed"),
+        "silent": StubVehicle(None),
+    }
+    timeout = fleet_service.FLEET_DRONE_TIMEOUT
+    fleet_service.FLEET_DRONE_TIMEOUT = 0.3
+    try:
+        lines = run_fleet(vehicles, drone_ids=["slow", "fast", "rejects", "raises", "silent", "missing"])
+    finally:
+        fleet_service.FLEET_DRONE_TIMEOUT = timeout
+
+    header, results, summary = lines[0], lines[1:-1], lines[-1]
+    assert_equals(header["targets"], ["slow", "fast", "rejects", "raises", "silent", "missing"])
+    # One line per drone in completion order, each numbered.
+    assert_equals([result["done"] for result in results], [1, 2, 3, 4, 5, 6])
+    assert_equals({result["total"] for result in results}, {6})
+    by_drone = {result["drone_id"]: result for result in results}
+    assert_equals({drone_id: (result["ok"], result["status"]) for drone_id, result in by_drone.items()},
+                  {"fast": (True, 200), "slow": (True, 200), "rejects": (False, 409), "raises": (False, 500),
+                   "silent": (False, 504), "missing": (False, 404)})
+    assert_equals(by_drone["fast"]["result"]["result"], "MAV_RESULT_ACCEPTED")
+    assert_equals(by_drone["raises"]["detail"], "Failed to arm drone: link closed")
+    assert_equals(by_drone["missing"]["detail"], "Drone not connected")
+    order = [result["drone_id"] for result in results]
+    assert order.index("fast") < order.index("slow") < order.index("silent")
+
+    assert_equals(summary["complete"], True)
+    assert_equals(sorted(summary["succeeded"]), ["fast", "slow"])
+    assert_equals(sorted(summary["failed"]), ["missing", "raises", "rejects", "silent"])
+
+
+def test_tags_select_connected_drones():
+    vehicles = {"a": StubVehicle(0), "b": StubVehicle(0), "c": StubVehicle(0)}
+    drone_tags = {"a": {"survey", "north"}, "b": {"survey"}, "c": {"north"}}
+    # Drones with every requested tag, added to the listed ones.
+    lines = run_fleet(vehicles, drone_tags, drone_ids=["c"], tags=["survey", "north"])
+    assert_equals(lines[0]["targets"], ["c", "a"])
+    assert_equals(sorted(lines[-1]["succeeded"]), ["a", "c"])
@@ -0,0 +1,133 @@
+import json
+
+from nose.tools import assert_equals
+
+from app.libs.dronekit import Command
+from app.services.mission_parser import MissionParser, detect_format, waypoint_command
+
+WPL = (
+    "QGC WPL 110\r\n"
+    "0\t1\t0\t16\t0\t0\t0\t0\t37.5\t126.6\t0.000000\t1\r\n"
+    "1\t0\t3\t22\t0.00000000\t0.00000000\t0.00000000\t0.00000000\t37.50000000\t126.60000000\t10.000000\t1\r\n"
+    "2\t0\t3\t16\t1.00000000\t0.00000000\t0.00000000\t0.00000000\t37.50010000\t126.60020000\t30.500000\t1\r\n"
+    "3\t0\t3\t183\t9.00000000\t1500.00000000\t0.00000000\t0.00000000\t0.00000000\t0.00000000\t0.000000\t1\r\n"
+    "4\t0\t3\t21\t0.00000000\t0.00000000\t0.00000000\t0.00000000\t37.50000000\t126.60000000\t0.000000\t1\r\n"
+)
+
+
+def fields(command):
+    return (command.frame, command.command, command.current, command.autocontinue, command.param1,
+            command.param2, command.param3, command.param4, command.x, command.y, command.z)
+
+
+def parse(format, data, chunk=None, **kwargs):
+    parser = MissionParser(format, **kwargs)
+    chunk = chunk or len(data) or 1
+    for i in range(0, len(data), chunk):
+        parser.feed(data[i:i + chunk])
+    return [fields(command) for command in parser.close()], parser.errors
+
+
+def whole_file_wpl(text):
+    # The save_mission_file loop this parser replaced: whole file in memory, split on tabs.
+    missionlist = []
+    for i, line in enumerate(text.splitlines(True)):
+        if i == 0:
+            if not line.startswith('QGC WPL 110'):
+                raise ValueError('File is not supported WP version')
+        elif i == 1:
+            pass
+        else:
+            linearray = line.split('\t')
+            missionlist.append(Command(0, 0, 0, int(linearray[2]), int(linearray[3]), int(linearray[1]),
+                                       int(linearray[11].strip()), float(linearray[4]), float(linearray[5]),
+                                       float(linearray[6]), float(linearray[7]), float(linearray[8]),
+                                       float(linearray[9]), float(linearray[10])))
+    return [fields(command) for command in missionlist]
+
+
+def test_wpl_matches_the_whole_file_parser_for_any_chunking():
+    expected = whole_file_wpl(WPL)
+    assert_equals(len(expected), 4)
+    for chunk in (None, 1, 3, 64):
+        assert_equals(parse("wpl", WPL.encode(), chunk), (expected, []))
+
+
+def test_wpl_reports_bad_lines_with_their_numbers():
+    data = WPL + "5\t0\t3\t16\t0\t0\t0\t0\t37.5\n6 0 3 16 0 0 0 0 37.5 126.6 30 1\n7\t0\t3\t16\t0\t0\t0\t0\tx\t126.6\t30\t1\n"
+    commands, errors = parse("wpl", data.encode(), chunk=5)
+    assert_equals(len(commands), 4)
+    assert_equals([error["line"] for error in errors], [7, 8, 9])
+    assert_equals(errors[0]["error"], "expected 12 fields, got 9")
+    # Space separated fields are not WPL (the tab split is kept from the previous parser).
+    assert_equals(errors[1]["error"], "expected 12 fields, got 1")
+
+    assert_equals(parse("wpl", b"QGC WPL 100\n1\t0\t3\t16\n")[1],
+                  [{"line": 1, "error": "file is not a supported WP version (expected QGC WPL 110)"}])
+
+
+def test_json_array_matches_whole_file_decoding():
+    waypoints = [{"latitude": 37.5 + i * 1e-4, "longitude": 126.6, "altitude": 30, "command": "waypoint"}
+                 for i in range(20)]
+    waypoints[3].update(altitude_type="absolute", command="takeoff")
+    data = json.dumps(waypoints, indent=2).encode()
+    expected = [fields(waypoint_command(waypoint)) for waypoint in json.loads(data)]
+    for chunk in (None, 1, 7):
+        assert_equals(parse("json", data, chunk), (expected, []))
+
+
+def test_json_errors_point_at_the_item():
+    data = b'[\n {"latitude": 37.5, "longitude": 126.6, "altitude": 30},\n {"latitude": 95, "longitude": 1,\n  "altitude": 1},\n {"latitude": 37.5}\n]'
+    commands, errors = parse("json", data, chunk=4)
+    assert_equals(len(commands), 1)
+    assert_equals(errors, [{"line": 3, "error": "coordinates out of range: 95.0, 1.0", "item": 1},
+                           {"line": 5, "error": "missing longitude", "item": 2}])
+
+    commands, errors = parse("json", b'[{"latitude": 37.5, "longitude": 126.6, "altitude": 30},\n{"lat', chunk=3)
+    assert_equals(errors[0]["line"], 2)
+    assert errors[0]["error"].startswith("invalid JSON"), errors
+
+
+def test_json_lines():
+    lines = [{"latitude": 37.5, "longitude": 126.6 + i * 1e-4, "altitude": 20} for i in range(5)]
+    data = "".join(json.dumps(line) + "\n" for line in lines).encode()
+    expected = [fields(waypoint_command(line)) for line in lines]
+    for chunk in (None, 1, 11):
+        assert_equals(parse("jsonl", data, chunk), (expected, []))
+
+    commands, errors = parse("jsonl", data + b'\n{"latitude": 37.5,\n[1, 2]\n', chunk=6)
+    assert_equals(len(commands), 5)
+    assert_equals([error["line"] for error in errors], [7, 8])
+    assert_equals(errors[1]["error"], "waypoint must be an object")
+
+
+def test_plain_text_with_header_default_altitude_and_split_characters():
+    # A multi-byte character and CRLF line ends land on chunk boundaries when fed byte by byte.
+    data = "latitude,longitude,altitude\r\n37.5, 126.6, 30  # 시작점\r\n37.5001 126.6001\r\n\r\n37.5002,abc\r\n".encode()
+    for chunk in (None, 1, 2):
+        commands, errors = parse("plain", data, chunk, default_altitude=15)
+        assert_equals([command[8:] for command in commands], [(37.5, 126.6, 30.0), (37.5001, 126.6001, 15.0)])
+        assert_equals(errors, [{"line": 5, "error": "invalid number in '37.5002,abc'"}])
+
+    assert_equals(parse("plain", b"37.5,126.6\n")[1],
+                  [{"line": 1, "error": "missing altitude (set a default altitude)"}])
+
+
+def test_kml_coordinates_split_across_chunks():
+    data = (b'<?xml version="1.0"?><kml><Placemark><LineString><coordinates>126.6,37.5,10\n'
+            b'126.6001,37.5001,20 126.6002,37.5002\n</coordinates></LineString></Placemark></kml>\n')
+    for chunk in (None, 1, 9):
+        commands, errors = parse("kml", data, chunk, default_altitude=5)
+        assert_equals([command[8:] for command in commands],
+                      [(37.5, 126.6, 10.0), (37.5001, 126.6001, 20.0), (37.5002, 126.6002, 5.0)])
+        assert_equals(errors, [])
+
+
+def test_detect_format():
+    assert_equals(detect_format("survey.waypoints"), "wpl")
+    assert_equals(detect_format("route.ndjson"), "jsonl")
+    assert_equals(detect_format("mission.txt", b"\xef\xbb\xbfQGC WPL 110\n"), "wpl")
+    assert_equals(detect_format("mission.txt", b" [{"), "json")
+    assert_equals(detect_format("mission.txt", b'{"latitude"'), "jsonl")
+    assert_equals(detect_format("mission.txt", b"37.5,126.6"), "plain")
+    assert_equals(detect_format("photo.png"), None)
@@ -0,0 +1,40 @@
+from nose.tools import assert_equals, assert_not_equals
+
+from app.services.param_service import _format_value, compare_params, params_etag
+
+
+def test_format_value_is_the_shortest_float32_round_trip():
+    # Values come back from the autopilot as single precision floats.
+    assert_equals(_format_value(0.10000000149011612), "0.1")
+    assert_equals(_format_value(0.1), "0.1")
+    assert_equals(_format_value(3), "3")
+    assert_equals(_format_value(-1.5e-05), "-1.5e-05")
+    assert_equals(_format_value(16777217), "16777216")
+
+
+def test_etag_follows_values_not_float_noise():
+    params = {"ARMING_CHECK": 1.0, "WPNAV_SPEED": 500.0, "ATC_RAT_RLL_P": 0.135}
+    etag = params_etag(params)
+    assert etag.startswith('"') and etag.endswith('"') and len(etag) == 18
+
+    # The same values read back in double precision give the same tag.
+    assert_equals(params_etag({"ARMING_CHECK": 1, "WPNAV_SPEED": 500, "ATC_RAT_RLL_P": 0.13500000536441803}), etag)
+    assert_not_equals(params_etag(dict(params, WPNAV_SPEED=501.0)), etag)
+    assert_not_equals(params_etag(dict(params, WPNAV_ACCEL=100.0)), etag)
+    assert_not_equals(params_etag({"ARMING_CHECK": 1.0}), params_etag({"ARMING_CHEC": 1.0}))
+    assert_equals(params_etag({}), params_etag({}))
+
+
+def test_compare_params():
+    current = {"ARMING_CHECK": 1.0, "WPNAV_SPEED": 500.0, "ATC_RAT_RLL_P": 0.13500000536441803, "RTL_ALT": 1500.0}
+    profile = {"WPNAV_SPEED": 750.0, "ATC_RAT_RLL_P": 0.135, "RTL_ALT": 1500, "NEW_PARAM": 2.0, "ARMING_CHECK": 0.0}
+    changed, missing, same = compare_params(current, profile)
+    assert_equals(changed, {"ARMING_CHECK": {"current": 1.0, "profile": 0.0},
+                            "WPNAV_SPEED": {"current": 500.0, "profile": 750.0}})
+    assert_equals(list(changed), ["ARMING_CHECK", "WPNAV_SPEED"])
+    assert_equals(missing, ["NEW_PARAM"])
+    # 0.135 and its float32 read-back are the same parameter value.
+    assert_equals(same, 2)
+
+    # Parameters only on the drone are not part of the diff.
+    assert_equals(compare_params(current, {}), ({}, [], 0))
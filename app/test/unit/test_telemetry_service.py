@@ -0,0 +1,35 @@
+import asyncio
+
+from nose.tools import assert_equals
+
+from app.services import telemetry_service
+
+
+class ClosingSocket(object):
+    """A WebSocket whose client disconnects after ``after`` seconds without any telemetry sent."""
+
+    def __init__(self, after):
+        self.scope = {"subprotocols": []}
+        self.after = after
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def receive(self):
+        await asyncio.sleep(self.after)
+        return {"type": "websocket.disconnect", "code": 1000}
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+def test_stream_ends_when_client_disconnects_with_nothing_to_send():
+    async def run():
+        socket = ClosingSocket(0.05)
+        # No watched drones: the loop never sends, so only the receive side can see the close.
+        await asyncio.wait_for(telemetry_service.stream_telemetry(socket, rate=0.2), 2)
+        return socket
+
+    socket = asyncio.run(run())
+    assert_equals(socket.sent, [])
@@ -0,0 +1,95 @@
+import math
+import random
+from unittest import SkipTest
+
+from nose.tools import assert_equals, assert_raises
+
+from app.services import track_simplify
+
+
+def zigzag(count, seed=3):
+    # A lawnmower trail with a few metres of jitter and a climb, around 37.5N.
+    random.seed(seed)
+    lats, lons, alts = [], [], []
+    for i in range(count):
+        leg, step = divmod(i, 50)
+        lats.append(37.5 + leg * 2e-4 + random.gauss(0, 1e-6))
+        lons.append(126.6 + (step if leg % 2 == 0 else 49 - step) * 1e-4 + random.gauss(0, 1e-6))
+        alts.append(min(i * 0.5, 30.0))
+    return lats, lons, alts
+
+
+def series(count, seed=5):
+    random.seed(seed)
+    times = [1700000000.0 + i * 0.1 for i in range(count)]
+    values = [16.8 - i * 1e-3 + random.gauss(0, 0.05) + (2.0 if i % 97 == 0 else 0.0) for i in range(count)]
+    return times, values
+
+
+def largest_error(lats, lons, alts, kept):
+    xs, ys, zs = track_simplify._local_xyz(lats, lons, alts)
+    worst = 0.0
+    for first, last in zip(kept, kept[1:]):
+        if last - first > 1:
+            worst = max(worst, math.sqrt(track_simplify._farthest_py(xs, ys, zs, first, last)[0]))
+    return worst
+
+
+def test_rdp_keeps_endpoints_and_respects_tolerance():
+    lats, lons, alts = zigzag(1000)
+    for tolerance in (0.5, 2.0, 10.0):
+        kept = track_simplify.simplify_track(lats, lons, alts, len(lats) - 1, tolerance=tolerance)
+        assert_equals((kept[0], kept[-1]), (0, len(lats) - 1))
+        assert largest_error(lats, lons, alts, kept) <= tolerance, tolerance
+        assert len(kept) < len(lats) - 1
+
+    # max_points caps the result before the tolerance is reached.
+    kept = track_simplify.simplify_track(lats, lons, alts, 12, tolerance=0.0)
+    assert_equals(len(kept), 12)
+    assert_equals((kept[0], kept[-1]), (0, len(lats) - 1))
+    assert_equals(kept, sorted(set(kept)))
+
+    # A straight line needs only its endpoints.
+    line = [37.5 + i * 1e-5 for i in range(100)]
+    assert_equals(track_simplify.simplify_track(line, [126.6] * 100, [10.0] * 100, 50), [0, 99])
+
+
+def test_lttb_returns_exactly_max_points():
+    times, values = series(5000)
+    for max_points in (3, 10, 250, 4999):
+        picked = track_simplify.downsample_series(times, values, max_points)
+        assert_equals(len(picked), max_points)
+        assert_equals((picked[0], picked[-1]), (0, len(times) - 1))
+        assert all(a < b for a, b in zip(picked, picked[1:]))
+    # Each spike (every 97th sample) lands in its own bucket at this size and is kept.
+    picked = set(track_simplify.downsample_series(times, values, 250))
+    assert set(range(0, 5000, 97)) - {0} <= picked
+    assert_raises(ValueError, track_simplify.downsample_series, times, values, 2)
+
+
+def test_short_inputs_pass_through():
+    lats, lons, alts = zigzag(20)
+    times, values = series(20)
+    assert_equals(track_simplify.simplify_track(lats, lons, alts, 20), list(range(20)))
+    assert_equals(track_simplify.downsample_series(times, values, 50), list(range(20)))
+    for count in (0, 1, 2):
+        assert_equals(track_simplify.simplify_track(lats[:count], lons[:count], alts[:count], 2), list(range(count)))
+        assert_equals(track_simplify.downsample_series(times[:count], values[:count], 3), list(range(count)))
+
+
+def test_numpy_and_python_pick_the_same_points():
+    numpy = track_simplify.numpy
+    if numpy is None:
+        raise SkipTest('numpy is not installed')
+    lats, lons, alts = zigzag(3000)
+    times, values = series(3000)
+    picks = []
+    try:
+        for module in (numpy, None):
+            track_simplify.numpy = module
+            picks.append((track_simplify.simplify_track(lats, lons, alts, 200),
+                          track_simplify.simplify_track(lats, lons, alts, 3000 - 1, tolerance=1.0),
+                          track_simplify.downsample_series(times, values, 200)))
+    finally:
+        track_simplify.numpy = numpy
+    assert_equals(picks[0], picks[1])
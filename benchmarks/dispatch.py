@@ -0,0 +1,90 @@
+"""
+Per-message CPU cost of Vehicle message/attribute dispatch.
+
+Decoded messages are fed straight into Vehicle.notify_message_listeners (no sockets on the
+receive path), with a mix resembling MAV_DATA_STREAM_ALL from ArduCopter.
+
+    python -m benchmarks.dispatch --vehicles 50 --rate 200 --seconds 5 [--watch]
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+from pymavlink import mavutil
+
+from app.libs.dronekit import Vehicle
+from app.libs.dronekit.mavlink import MAVConnection
+
+
+def message_mix(mav):
+    """One second of traffic at 200 msgs/s: (count, message) pairs."""
+    return [
+        (50, mav.attitude_encode(0, 0.01, 0.02, 0.03, 0, 0, 0)),
+        (25, mav.global_position_int_encode(0, 370000000, 1270000000, 60000, 10000, 0, 0, 0, 0)),
+        (25, mav.local_position_ned_encode(0, 1, 2, 3, 0, 0, 0)),
+        (10, mav.vfr_hud_encode(0, 1.5, 90, 0, 10, 0)),
+        (10, mav.rc_channels_encode(0, 8, *([1500] * 18 + [255]))),
+        (5, mav.gps_raw_int_encode(0, 3, 370000000, 1270000000, 0, 100, 100, 0, 0, 10)),
+        (2, mav.sys_status_encode(0, 0, 0, 0, 12000, 100, 80, 0, 0, 0, 0, 0, 0)),
+        (1, mav.heartbeat_encode(mavutil.mavlink.MAV_TYPE_QUADROTOR, mavutil.mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA,
+                                 mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED, 0, 3)),
+        # Streamed but not consumed by Vehicle.
+        (25, mav.raw_imu_encode(0, 0, 0, 0, 0, 0, 0, 0, 0, 0)),
+        (25, mav.servo_output_raw_encode(0, 0, *([1500] * 8))),
+        (10, mav.scaled_pressure_encode(0, 1013, 0, 2000)),
+        (10, mav.nav_controller_output_encode(0, 0, 0, 0, 0, 0, 0, 0)),
+        (2, mav.meminfo_encode(0, 0)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--vehicles', type=int, default=50)
+    parser.add_argument('--rate', type=int, default=200, help='messages per second per vehicle')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--watch', action='store_true',
+                        help='attach listeners like the telemetry service does')
+    args = parser.parse_args()
+
+    mav = mavutil.mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+    mix = message_mix(mav)
+    scale = args.rate / float(sum(count for count, _ in mix))
+    second = []
+    for count, msg in mix:
+        second.extend([(msg.get_type(), msg)] * max(1, int(round(count * scale))))
+
+    vehicles = []
+    for _ in range(args.vehicles):
+        handler = MAVConnection('udpout:127.0.0.1:9')
+        handler.start()
+        vehicle = Vehicle(handler)
+        if args.watch:
+            def on_change(_, name, value):
+                pass
+            for attr in ('location', 'attitude', 'battery', 'mode', 'armed',
+                         'heading', 'airspeed', 'groundspeed', 'home_location'):
+                vehicle.add_attribute_listener(attr, on_change)
+        vehicles.append(vehicle)
+
+    total = 0
+    t0 = time.thread_time()
+    for _ in range(int(args.seconds)):
+        for vehicle in vehicles:
+            notify = vehicle.notify_message_listeners
+            for name, msg in second:
+                notify(name, msg)
+            total += len(second)
+    cpu = time.thread_time() - t0
+
+    for vehicle in vehicles:
+        vehicle.close()
+
+    per_msg = cpu / total
+    print('%d vehicles x %d msgs/s%s' % (args.vehicles, len(second), ' (watched)' if args.watch else ''))
+    print('dispatch  %.2f us/msg  -> %.1f%% of one core' % (
+        per_msg * 1e6, per_msg * len(second) * args.vehicles * 100))
+
+
+if __name__ == '__main__':
+    main()
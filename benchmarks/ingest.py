@@ -0,0 +1,78 @@
+"""
+Receive-path CPU per datagram with and without an ingest policy.
+
+Raw datagrams (one MAVLink frame each, ArduCopter-like mix) are parsed and dispatched to a
+Vehicle the way the receive thread does it, so decoding is included.
+
+    python -m benchmarks.ingest --rate 200 --seconds 5
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+from pymavlink import mavutil
+
+from app.libs.dronekit import Vehicle
+from app.libs.dronekit.ingest import IngestPolicy, parse_filtered
+from app.libs.dronekit.mavlink import MAVConnection
+from benchmarks.dispatch import message_mix
+
+
+def run(vehicle, datagrams, seconds, policy):
+    parser = mavutil.mavlink.MAVLink(None)
+    notify = vehicle.notify_message_listeners
+    policy_for = lambda sysid: policy
+    kept = 0
+    step = 1.0 / len(datagrams)
+    t0 = time.thread_time()
+    for second in range(seconds):
+        for i, data in enumerate(datagrams):
+            if policy is None:
+                msgs = parser.parse_buffer(data)
+            else:
+                # Simulated receive time, so decimation sees the stream rate rather than the replay speed.
+                msgs = parse_filtered(parser, data, policy_for, second + i * step)
+            for msg in msgs:
+                notify(msg.get_type(), msg)
+            kept += len(msgs)
+    return time.thread_time() - t0, kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rate', type=int, default=200, help='messages per second')
+    parser.add_argument('--seconds', type=int, default=5)
+    parser.add_argument('--attitude-rate', type=float, default=10)
+    args = parser.parse_args()
+
+    mav = mavutil.mavlink.MAVLink(None, srcSystem=1, srcComponent=1)
+    mix = message_mix(mav)
+    scale = args.rate / float(sum(count for count, _ in mix))
+    # Each type spread evenly over the second, as the autopilot streams them.
+    timeline = []
+    for count, msg in mix:
+        data = bytes(msg.pack(mav))
+        count = max(1, int(round(count * scale)))
+        timeline.extend(((j + 0.5) / count, data) for j in range(count))
+    datagrams = [data for _, data in sorted(timeline, key=lambda item: item[0])]
+
+    handler = MAVConnection('udpout:127.0.0.1:9')
+    handler.start()
+    vehicle = Vehicle(handler)
+
+    total = len(datagrams) * args.seconds
+    print('%d msgs/s for %d s' % (len(datagrams), args.seconds))
+    for name, policy in (
+            ('no policy', None),
+            ('consumed_by', IngestPolicy.consumed_by(vehicle)),
+            ('consumed_by + ATTITUDE %g Hz' % args.attitude_rate,
+             IngestPolicy.consumed_by(vehicle, rates={'ATTITUDE': args.attitude_rate}))):
+        cpu, kept = run(vehicle, datagrams, args.seconds, policy)
+        print('%-32s %6.2f us/msg  (%d%% of messages dispatched)' % (
+            name, cpu / total * 1e6, 100 * kept // total))
+    vehicle.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Parse time and peak memory of mission file ingest, per format, on a generated survey mission.
+
+The survey is a lawnmower pattern of N waypoints written as QGC WPL 110, a JSON waypoint
+array, plain "lat,lon,alt" lines and a KML LineString. The streaming parser is fed in
+upload-sized chunks; for WPL the old read-everything, split('\\t') loop is the baseline.
+
+    python -m benchmarks.mission_parser --items 10000
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from app.libs.dronekit import Command
+from app.services.mission_parser import MissionParser
+
+
+def survey(items, lat=37.5, lon=126.6, spacing=1e-4):
+    per_leg = 50
+    for i in range(items):
+        leg, step = divmod(i, per_leg)
+        if leg % 2:
+            step = per_leg - 1 - step
+        yield lat + leg * spacing, lon + step * spacing, 30.0
+
+
+def as_wpl(points):
+    lines = ['QGC WPL 110', '0\t1\t0\t16\t0\t0\t0\t0\t37.5\t126.6\t0.000000\t1']
+    for i, (lat, lon, alt) in enumerate(points, 1):
+        lines.append('%d\t0\t3\t16\t0.00000000\t0.00000000\t0.00000000\t0.00000000\t%.8f\t%.8f\t%.6f\t1'
+                     % (i, lat, lon, alt))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def as_json(points):
+    return json.dumps([{'latitude': lat, 'longitude': lon, 'altitude': alt}
+                       for lat, lon, alt in points], indent=1).encode()
+
+
+def as_plain(points):
+    return ''.join('%.8f,%.8f,%.1f\n' % point for point in points).encode()
+
+
+def as_kml(points):
+    coordinates = '\n'.join('%.8f,%.8f,%.1f' % (lon, lat, alt) for lat, lon, alt in points)
+    return ('<?xml version="1.0"?><kml><Placemark><LineString><coordinates>\n%s\n'
+            '</coordinates></LineString></Placemark></kml>\n' % coordinates).encode()
+
+
+def split_parse(data):
+    """The previous .waypoints path: whole file in memory, split('\\t') and one int()/float() per field."""
+    missionlist = []
+    for i, line in enumerate(data.decode().splitlines(True)):
+        if i == 0:
+            if not line.startswith('QGC WPL 110'):
+                raise ValueError('File is not supported WP version')
+        elif i == 1:
+            pass
+        else:
+            linearray = line.split('\t')
+            missionlist.append(Command(0, 0, 0, int(linearray[2]), int(linearray[3]), int(linearray[1]),
+                                       int(linearray[11].strip()), float(linearray[4]), float(linearray[5]),
+                                       float(linearray[6]), float(linearray[7]), float(linearray[8]),
+                                       float(linearray[9]), float(linearray[10])))
+    return missionlist
+
+
+def stream_parse(format, chunk):
+    def parse(data):
+        parser = MissionParser(format)
+        for i in range(0, len(data), chunk):
+            parser.feed(data[i:i + chunk])
+        commands = parser.close()
+        assert not parser.errors, parser.errors
+        return commands
+    return parse
+
+
+def measure(parse, data, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        commands = parse(data)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    parse(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return len(commands), best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--chunk', type=int, default=64 * 1024)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    points = list(survey(args.items))
+    files = {'wpl': as_wpl(points), 'json': as_json(points), 'plain': as_plain(points), 'kml': as_kml(points)}
+    runs = [('wpl', 'split', split_parse)]
+    runs += [(format, 'stream', stream_parse(format, args.chunk)) for format in files]
+
+    print('%d waypoints, %d KB chunks' % (args.items, args.chunk // 1024))
+    for format, name, parse in runs:
+        data = files[format]
+        count, elapsed, peak = measure(parse, data, args.repeat)
+        print('%-6s %-7s %7.0f KB  %7.1f ms  %6.2f us/item  peak %7.0f KB' % (
+            format, name, len(data) / 1024, elapsed * 1e3, elapsed / count * 1e6, peak / 1024))
+
+
+if __name__ == '__main__':
+    main()
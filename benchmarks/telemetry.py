@@ -0,0 +1,103 @@
+"""
+Bytes/s and serialization CPU of the /ws/telemetry stream: full vs delta frames, per encoding.
+
+Drones are simulated offline (no MAVLink links): half of them hover with sensor
+noise, half fly a straight leg, and every drone reports a new state on each tick.
+
+    python -m benchmarks.telemetry --drones 50 --rate 5 --seconds 60
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import random
+import time
+
+from app.services import telemetry_codec
+from app.services.telemetry_codec import TelemetryDeltaEncoder
+
+
+def serialize(encoding, frame):
+    if encoding == 'json':
+        # Same as WebSocket.send_json.
+        return json.dumps(frame, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return telemetry_codec.encode_frame(encoding, frame)
+
+
+def simulate(drone_id, moving, rnd):
+    lat, lon, alt, yaw = 37.0 + rnd.random() * 1e-2, 127.0 + rnd.random() * 1e-2, 20.0, rnd.random() * math.pi
+    battery, t = 16.4, 0.0
+    while True:
+        if moving:
+            lat += 2e-6 * math.cos(yaw)
+            lon += 2e-6 * math.sin(yaw)
+        t += 1
+        battery -= 0.0005
+        yield {
+            "drone_id": drone_id,
+            "latitude": lat + rnd.gauss(0, 5e-8),
+            "longitude": lon + rnd.gauss(0, 5e-8),
+            "altitude": alt + rnd.gauss(0, 0.03),
+            "altitude_asl": 50 + alt + rnd.gauss(0, 0.03),
+            "battery": round(battery, 2),
+            "airspeed": (5.0 if moving else 0.0) + rnd.gauss(0, 0.05),
+            "groundspeed": (5.0 if moving else 0.0) + rnd.gauss(0, 0.05),
+            "heading": int(math.degrees(yaw)) % 360,
+            "mode": "AUTO" if moving else "GUIDED",
+            "armed": True,
+            "pitch": rnd.gauss(-0.05 if moving else 0.0, 0.003),
+            "roll": rnd.gauss(0, 0.003),
+            "yaw": yaw + rnd.gauss(0, 0.003),
+            "signal_strength": (t % 5) * 0.2,
+            "home_latitude": 37.0,
+            "home_longitude": 127.0,
+            "home_altitude": 0.0,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--drones', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=5)
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    ids = ['drone%d' % i for i in range(args.drones)]
+    sources = dict((drone_id, simulate(drone_id, i % 2 == 0, rnd)) for i, drone_id in enumerate(ids))
+    encoder = TelemetryDeltaEncoder()
+
+    full_frames, delta_frames = [], []
+    ticks = int(args.seconds * args.rate)
+    for tick in range(ticks):
+        now = tick / args.rate
+        full, delta, keyframes = {}, {}, []
+        for drone_id in ids:
+            telemetry = next(sources[drone_id])
+            full[drone_id] = telemetry
+            fields, keyframe = encoder.encode(drone_id, telemetry, now)
+            if fields is not None:
+                delta[drone_id] = fields
+            if keyframe:
+                keyframes.append(drone_id)
+        full_frames.append({"type": "telemetry", "timestamp": now, "drones": full, "removed": []})
+        if delta:
+            delta_frames.append({"type": "telemetry", "timestamp": now, "drones": delta,
+                                 "removed": [], "keyframes": keyframes})
+
+    print('%d drones at %g Hz over %g s' % (args.drones, args.rate, args.seconds))
+    baseline = None
+    for encoding in telemetry_codec.available_encodings():
+        for name, frames in (('full', full_frames), ('delta', delta_frames)):
+            t0 = time.perf_counter()
+            size = sum(len(serialize(encoding, frame)) for frame in frames)
+            cpu = (time.perf_counter() - t0) / len(frames)
+            baseline = baseline or size
+            print('%-8s %-6s %8.1f KB/s  (%3.0f%%)  %7.1f us/frame' % (
+                encoding, name, size / args.seconds / 1024, 100.0 * size / baseline, cpu * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Time to reduce a flown trail with RDP (geometry) and LTTB (scalar series), with and without NumPy.
+
+The trail is a lawnmower survey flown at 10 Hz with GPS jitter, a climb and a landing; the
+battery voltage sags with noise. Both implementations must pick the same points; the largest
+distance from a dropped point to the simplified trail is reported as the error.
+
+    python -m benchmarks.track_simplify --seconds 3600 --rate 10 --max-points 500
+"""
+from __future__ import print_function
+
+import argparse
+import math
+import random
+import time
+
+from app.services import track_simplify
+
+
+def survey(seconds, rate, seed=1):
+    random.seed(seed)
+    times, lats, lons, alts, volts = [], [], [], [], []
+    lat, lon, speed = 37.5, 126.6, 8.0
+    heading, leg = 0.0, 0.0
+    for i in range(int(seconds * rate)):
+        t = i / rate
+        # 120 s legs joined by 10 s turns
+        leg += 1.0 / rate
+        if leg > 120:
+            heading = (heading + 180.0 / (10 * rate)) % 360
+            if leg > 130:
+                leg = 0.0
+        step = speed / rate / track_simplify.METERS_PER_DEGREE
+        lat += step * math.cos(math.radians(heading)) + random.gauss(0, 2e-7)
+        lon += step * math.sin(math.radians(heading)) / math.cos(math.radians(lat)) + random.gauss(0, 2e-7)
+        alt = min(t * 2, 50.0) if t < seconds - 30 else max(0.0, (seconds - t) * 50 / 30)
+        times.append(1700000000.0 + t)
+        lats.append(lat)
+        lons.append(lon)
+        alts.append(alt + random.gauss(0, 0.1))
+        volts.append(16.8 - 2.4 * t / seconds + random.gauss(0, 0.02))
+    return times, lats, lons, alts, volts
+
+
+def track_error(lats, lons, alts, kept):
+    xs, ys, zs = track_simplify._local_xyz(lats, lons, alts)
+    worst = 0.0
+    for first, last in zip(kept, kept[1:]):
+        if last - first > 1:
+            distance2, _ = track_simplify._farthest_py(xs, ys, zs, first, last)
+            worst = max(worst, math.sqrt(distance2))
+    return worst
+
+
+def measure(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--seconds', type=float, default=3600)
+    parser.add_argument('--rate', type=float, default=10)
+    parser.add_argument('--max-points', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    times, lats, lons, alts, volts = survey(args.seconds, args.rate)
+    print('%d samples -> at most %d points' % (len(times), args.max_points))
+
+    numpy = track_simplify.numpy
+    backends = [('python', None)] + ([('numpy', numpy)] if numpy is not None else [])
+    results = {}
+    for name, module in backends:
+        track_simplify.numpy = module
+        try:
+            kept, rdp = measure(lambda: track_simplify.simplify_track(lats, lons, alts, args.max_points),
+                                args.repeat)
+            picked, lttb = measure(lambda: track_simplify.downsample_series(times, volts, args.max_points),
+                                   args.repeat)
+        finally:
+            track_simplify.numpy = numpy
+        results[name] = (kept, picked)
+        print('%-6s  rdp %4d points %8.1f ms  error %.2f m   lttb %4d points %7.1f ms' % (
+            name, len(kept), rdp * 1e3, track_error(lats, lons, alts, kept), len(picked), lttb * 1e3))
+    if numpy is None:
+        print('numpy not installed: only the pure-Python fallback was measured')
+    elif results['python'] != results['numpy']:
+        print('WARNING: python and numpy picked different points')
+
+
+if __name__ == '__main__':
+    main()
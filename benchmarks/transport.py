@@ -0,0 +1,115 @@
+"""
+Compare the threaded MAVConnection with the asyncio transport.
+
+Every simulated vehicle streams ATTITUDE messages over UDP to its own ``udpin`` port at
+``--rate`` Hz from a single sender thread. The report gives, per transport, the delivered
+message rate per vehicle, the loss and the process CPU time (the sender's share is the same
+for both transports, so differences come from the receive side).
+
+    python -m benchmarks.transport --vehicles 40 --rate 50 --seconds 5
+"""
+from __future__ import print_function
+
+import argparse
+import socket
+import threading
+import time
+
+from pymavlink import mavutil
+
+from app.libs.dronekit.aiomavlink import AsyncMAVConnection
+from app.libs.dronekit.mavlink import MAVConnection
+
+
+class _Buffer(object):
+    def __init__(self):
+        self.data = b''
+
+    def write(self, buf):
+        self.data = bytes(buf)
+
+
+def _packets(sysid, count):
+    buf = _Buffer()
+    mav = mavutil.mavlink.MAVLink(buf, srcSystem=sysid, srcComponent=1)
+    packets = []
+    for i in range(count):
+        mav.attitude_send(i, 0.1, 0.2, 0.3, 0.0, 0.0, 0.0)
+        packets.append(buf.data)
+    return packets
+
+
+def _sender(ports, rate, seconds, stop):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    packets = [_packets(i + 1, 256) for i in range(len(ports))]
+    tick = 0.01
+    per_tick = rate * tick
+    start = time.time()
+    sent = 0.0
+    n = 0
+    while not stop.is_set() and time.time() - start < seconds:
+        sent += per_tick
+        while n < int(sent):
+            for i, port in enumerate(ports):
+                sock.sendto(packets[i][n % 256], ('127.0.0.1', port))
+            n += 1
+        time.sleep(tick)
+    sock.close()
+    return n
+
+
+def run(handler_class, vehicles, rate, seconds, base_port):
+    ports = [base_port + i for i in range(vehicles)]
+    counts = [0] * vehicles
+    handlers = []
+    for i, port in enumerate(ports):
+        handler = handler_class('udpin:127.0.0.1:%d' % port)
+
+        def listener(_, msg, i=i):
+            if msg.get_type() == 'ATTITUDE':
+                counts[i] += 1
+
+        handler.forward_message(listener)
+        handler.start()
+        handlers.append(handler)
+
+    stop = threading.Event()
+    cpu0 = time.process_time()
+    t0 = time.time()
+    _sender(ports, rate, seconds, stop)
+    time.sleep(0.2)
+    elapsed = time.time() - t0
+    cpu = time.process_time() - cpu0
+    threads = threading.active_count()
+
+    for handler in handlers:
+        handler._alive = False
+    for handler in handlers:
+        handler.close()
+
+    expected = int(rate * seconds)
+    received = sum(counts)
+    return {
+        'per_vehicle_rate': received / float(vehicles) / elapsed,
+        'loss': 1.0 - received / float(expected * vehicles),
+        'cpu': cpu,
+        'threads': threads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--vehicles', type=int, default=40)
+    parser.add_argument('--rate', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--base-port', type=int, default=24550)
+    args = parser.parse_args()
+
+    for name, cls, offset in (('threaded', MAVConnection, 0), ('asyncio', AsyncMAVConnection, 1000)):
+        r = run(cls, args.vehicles, args.rate, args.seconds, args.base_port + offset)
+        print('%-9s %7.1f msg/s/vehicle  loss %5.1f%%  cpu %6.2fs  threads %d' % (
+            name, r['per_vehicle_rate'], r['loss'] * 100, r['cpu'], r['threads']))
+
+
+if __name__ == '__main__':
+    main()
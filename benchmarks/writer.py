@@ -0,0 +1,57 @@
+"""
+Idle CPU and enqueue-to-wire latency of the MAVConnection writer thread.
+
+    python -m benchmarks.writer --vehicles 40 --idle 3 --samples 500
+"""
+from __future__ import print_function
+
+import argparse
+import socket
+import time
+
+from app.libs.dronekit.mavlink import MAVConnection
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--vehicles', type=int, default=40)
+    parser.add_argument('--idle', type=float, default=3)
+    parser.add_argument('--samples', type=int, default=500)
+    args = parser.parse_args()
+
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    sink.settimeout(1)
+    port = sink.getsockname()[1]
+
+    handlers = []
+    for _ in range(args.vehicles):
+        handler = MAVConnection('udpout:127.0.0.1:%d' % port)
+        handler.start()
+        handlers.append(handler)
+
+    # Idle: only the reader threads' select() timeouts should be left.
+    cpu0 = time.process_time()
+    time.sleep(args.idle)
+    idle_cpu = (time.process_time() - cpu0) / args.idle
+
+    latencies = []
+    mav = handlers[0].master.mav
+    for _ in range(args.samples):
+        t0 = time.perf_counter()
+        mav.heartbeat_send(6, 8, 0, 0, 0)
+        sink.recvfrom(1024)
+        latencies.append(time.perf_counter() - t0)
+        time.sleep(0.001)
+    latencies.sort()
+
+    for handler in handlers:
+        handler.close()
+
+    print('idle cpu   %.1f%% of one core for %d vehicles' % (idle_cpu * 100, args.vehicles))
+    print('latency    p50 %.3f ms  p99 %.3f ms' % (latencies[len(latencies) // 2] * 1e3,
+                                                  latencies[int(len(latencies) * 0.99)] * 1e3))
+
+
+if __name__ == '__main__':
+    main()
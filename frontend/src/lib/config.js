@@ -7,6 +7,8 @@ export const API_CONFIG = {
         DRONES: {
             BASE: '/drones/',
             CONNECT: '/drones/connect',
+            CONNECTION: (droneId) => `/drones/${droneId}/connection`,
+            FLEET_TELEMETRY: '/drones/telemetry',
             TELEMETRY: (droneId) => `/drones/${droneId}/telemetry`,
             ARM: (droneId) => `/drones/${droneId}/arm`,
             DISARM: (droneId) => `/drones/${droneId}/disarm`,
@@ -17,8 +19,10 @@ export const API_CONFIG = {
             MISSION: (droneId) => `/drones/${droneId}/mission`,
             MODE: (droneId) => `/drones/${droneId}/mode`,
             FLY_TO: (droneId) => `/drones/${droneId}/fly-to`,
+            STREAM_PROFILE: (droneId) => `/drones/${droneId}/stream-profile`,
             HOME_POSITION: (droneId) => `/drones/${droneId}/home-position`
         },
+        TELEMETRY_STREAM: '/ws/telemetry',
         // MISSION: {
         //     CREATE: '/mission/create',
         //     UPDATE: '/mission/update',
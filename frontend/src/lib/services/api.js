@@ -65,6 +65,11 @@ export const droneApi = {
         });
     },
 
+    // 드론 연결 진행 상황 조회
+    getConnectionStatus: async (droneId) => {
+        return await fetchApi(API_CONFIG.ENDPOINTS.DRONES.CONNECTION(droneId));
+    },
+
     // 드론 연결 해제
     disconnect: async (droneId) => {
         return await fetchApi(API_CONFIG.ENDPOINTS.DRONES.DISCONNECT(droneId), {
@@ -77,6 +82,15 @@ export const droneApi = {
         return await fetchApi(API_CONFIG.ENDPOINTS.DRONES.TELEMETRY(droneId));
     },
 
+    // 여러 드론 텔레메트리 일괄 조회 (fields 로 필요한 필드만 요청 가능)
+    getFleetTelemetry: async (ids = null, fields = null) => {
+        const params = new URLSearchParams();
+        if (ids) params.set('ids', ids.join(','));
+        if (fields) params.set('fields', fields.join(','));
+        const query = params.toString();
+        return await fetchApi(`${API_CONFIG.ENDPOINTS.DRONES.FLEET_TELEMETRY}${query ? `?${query}` : ''}`);
+    },
+
     // 드론 Arm
     arm: async (droneId) => {
         return await fetchApi(API_CONFIG.ENDPOINTS.DRONES.ARM(droneId), {
@@ -121,6 +135,14 @@ export const droneApi = {
         });
     },
 
+    // 스트림 프로필 변경 (map-view, mission-monitor, idle)
+    setStreamProfile: async (droneId, profile) => {
+        return await fetchApi(API_CONFIG.ENDPOINTS.DRONES.STREAM_PROFILE(droneId), {
+            method: 'POST',
+            body: JSON.stringify({ profile }),
+        });
+    },
+
     // 현재 고도 유지하며 특정 위치로 비행
     flyToPosition: async (droneId, position) => {
         return await fetchApi(API_CONFIG.ENDPOINTS.DRONES.FLY_TO(droneId), {
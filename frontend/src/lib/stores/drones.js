@@ -1,5 +1,6 @@
 import { writable, derived, get } from 'svelte/store';
 import { droneApi } from '../services/api';
+import { API_CONFIG } from '../config';
 
 // 드론 목록을 저장할 스토어 생성
 export const drones = writable([]);
@@ -10,16 +11,16 @@ const telemetryMap = writable(new Map());
 
 // 텔레메트리 데이터 업데이트
 export async function updateTelemetry() {
-    const currentDrones = get(drones);
     const newTelemetryMap = new Map();
-    
-    for (const droneId of currentDrones) {
-        try {
-            const data = await droneApi.getTelemetry(droneId);
-            newTelemetryMap.set(droneId, data);
-        } catch (error) {
-            console.error('텔레메트리 데이터 조회 실패:', error);
+
+    // 모든 드론을 한 번의 요청으로 조회
+    try {
+        const data = await droneApi.getFleetTelemetry();
+        for (const [droneId, telemetry] of Object.entries(data.drones)) {
+            newTelemetryMap.set(droneId, telemetry);
         }
+    } catch (error) {
+        console.error('텔레메트리 데이터 조회 실패:', error);
     }
 
     //nsole.log(newTelemetryMap);
@@ -27,6 +28,59 @@ export async function updateTelemetry() {
     telemetryMap.set(newTelemetryMap);
 }
 
+// 텔레메트리 WebSocket 스트림 상태
+let telemetrySocket = null;
+let telemetrySubscribers = 0;
+let reconnectTimer = null;
+
+// 텔레메트리 WebSocket 연결 (변경된 드론의 최신 상태만 수신)
+function openTelemetrySocket(rate) {
+    const url = `${API_CONFIG.BASE_URL.replace(/^http/, 'ws')}${API_CONFIG.ENDPOINTS.TELEMETRY_STREAM}?rate=${rate}&delta=true`;
+    telemetrySocket = new WebSocket(url);
+
+    telemetrySocket.onmessage = (event) => {
+        const frame = JSON.parse(event.data);
+        telemetryMap.update(map => {
+            const next = new Map(map);
+            // 키프레임은 전체 상태, 나머지는 바뀐 필드만 포함하므로 기존 값에 병합
+            const keyframes = new Set(frame.keyframes || []);
+            for (const [droneId, data] of Object.entries(frame.drones)) {
+                next.set(droneId, keyframes.has(droneId) ? data : { ...next.get(droneId), ...data });
+            }
+            for (const droneId of frame.removed) {
+                next.delete(droneId);
+            }
+            return next;
+        });
+    };
+
+    telemetrySocket.onclose = () => {
+        telemetrySocket = null;
+        // 구독 중이면 잠시 후 재연결
+        if (telemetrySubscribers > 0) {
+            reconnectTimer = setTimeout(() => openTelemetrySocket(rate), 2000);
+        }
+    };
+}
+
+// 텔레메트리 스트림 구독 시작 (여러 컴포넌트가 하나의 연결을 공유)
+export function startTelemetryStream(rate = 5) {
+    telemetrySubscribers += 1;
+    if (telemetrySubscribers === 1 && !telemetrySocket) {
+        openTelemetrySocket(rate);
+    }
+}
+
+// 텔레메트리 스트림 구독 종료
+export function stopTelemetryStream() {
+    telemetrySubscribers = Math.max(0, telemetrySubscribers - 1);
+    if (telemetrySubscribers === 0) {
+        if (reconnectTimer) clearTimeout(reconnectTimer);
+        reconnectTimer = null;
+        if (telemetrySocket) telemetrySocket.close();
+    }
+}
+
 // 특정 드론의 텔레메트리 데이터 가져오기
 export function getDroneTelemetry(droneId) {
     return get(telemetryMap).get(droneId);
@@ -57,11 +111,34 @@ export async function refreshDrones() {
     }
 }
 
-// 드론 연결
-export async function connectDrone(droneId, connectionString) {
+// 현재 화면에서 사용하는 스트림 프로필 (새로 연결된 드론에도 적용)
+let currentStreamProfile = null;
+
+// 화면에 맞는 스트림 프로필을 연결된 드론에 적용 (map-view, mission-monitor, idle)
+export async function applyStreamProfile(profile, droneIds = null) {
+    currentStreamProfile = profile;
+    const ids = droneIds || get(drones);
+    await Promise.all(ids.map(droneId =>
+        droneApi.setStreamProfile(droneId, profile).catch(error => {
+            // 프로필 적용 실패는 화면 동작에 영향이 없으므로 기록만 함
+            console.error('스트림 프로필 변경 실패:', droneId, error);
+        })
+    ));
+}
+
+// 드론 연결 (백그라운드 연결이 끝날 때까지 진행 상황 조회)
+export async function connectDrone(droneId, connectionString, onProgress = null) {
     try {
         await droneApi.connect(droneId, connectionString);
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 500));
+            const status = await droneApi.getConnectionStatus(droneId);
+            if (onProgress) onProgress(status);
+            if (status.state === 'connected') break;
+            if (status.state === 'failed') throw new Error(status.error || '드론 연결 실패');
+        }
         await refreshDrones(); // 목록 새로고침
+        if (currentStreamProfile) await applyStreamProfile(currentStreamProfile, [droneId]);
     } catch (error) {
         console.error('드론 연결 실패:', error);
         throw error;